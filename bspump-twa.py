@@ -131,8 +131,8 @@ class MyTimeWindowAnalyzer(bspump.analyzer.TimeWindowAnalyzer):
 		if self.TimeWindow.Matrix is None:
 			return
 
-		# selecting part of matrix specified in configuration
-		x = self.TimeWindow.Matrix[:]
+		# selecting part of matrix specified in configuration, columns ordered from the oldest to the newest
+		x = self.view_ordered()
 
 		# if any of time slots is 0
 		if np.any(x == 0):
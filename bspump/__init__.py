@@ -4,9 +4,11 @@ from .abc.source import Source
 from .abc.source import TriggerSource
 from .abc.sink import Sink
 from .abc.processor import Processor
+from .abc.asyncprocessor import AsyncProcessor
 from .abc.generator import Generator
 from .abc.connection import Connection
 from .exception import ProcessingError
+from .context import EventContext
 from .abc.lookup import Lookup, MappingLookup, DictionaryLookup
 from .fileloader import load_json_file
 
@@ -0,0 +1,165 @@
+import abc
+import asyncio
+import logging
+import functools
+import collections
+
+from .processor import ProcessorBase
+
+#
+
+L = logging.getLogger(__name__)
+
+#
+
+class AsyncProcessor(ProcessorBase):
+
+	'''
+A processor, which `process()` is a coroutine, so it can await I/O (e.g. a database query) for each event.
+
+class MyAsyncProcessor(bspump.AsyncProcessor):
+
+	async def process(self, context, event):
+		event['owner'] = await self.Storage.find(event['user'])
+		return event
+
+The pipeline runs up to `concurrency` events thru the processor at once.
+An event continues down the pipeline when its `process()` is completed, see `Pipeline.resume()`.
+When `ordered` is enabled, events continue in the same order as they entered the processor,
+otherwise they continue as soon as they are completed.
+
+The pipeline is throttled when `concurrency` events are in flight and it is released when the half of them is completed.
+An exception raised by `process()` is passed to `Pipeline.set_error()`, or the event is routed to the dead letter of the pipeline.
+
+A batch (see `Pipeline.process_batch()`) is processed event by event by default.
+Override `process_batch()` with a coroutine to process the whole batch at once, it then counts as a single task.
+	'''
+
+	ConfigDefaults = {
+		'concurrency': 10, # Maximum number of events that are processed at once
+		'ordered': 'yes', # Preserve the order of events
+	}
+
+
+	def __init__(self, app, pipeline, id=None, config=None):
+		super().__init__(app, pipeline, id=id, config=config)
+		self.Loop = app.Loop
+
+		self.Concurrency = int(self.Config['concurrency'])
+		self.Ordered = self.Config['ordered'].lower() == 'yes'
+
+		self.InFlight = 0 # Number of events submitted and not completed yet
+		self.Running = 0 # Number of running tasks
+		self._backlog = collections.deque() # Tasks waiting for a free slot
+		self._pending = collections.deque() # Tasks in the order of submission, used when ordered
+		self._throttled = False
+
+
+	@abc.abstractmethod
+	async def process(self, context, event):
+		raise NotImplementedError()
+
+
+	async def process_batch(self, context, events):
+		result = []
+		for event in events:
+			event = await self.process(context, event)
+			if event is not None:
+				result.append(event)
+		return result
+
+
+	# Called by the pipeline instead of process() and process_batch()
+
+	def submit(self, context, event):
+		self._schedule(_Flight(self.process, context, event, 1, False))
+		return None # The event continues down the pipeline later, see _complete()
+
+
+	def submit_batch(self, context, events):
+		if type(self).process_batch is AsyncProcessor.process_batch:
+			for event in events:
+				self._schedule(_Flight(self.process, context, event, 1, False))
+		else:
+			self._schedule(_Flight(self.process_batch, context, events, len(events), True))
+		return []
+
+
+	def _schedule(self, flight):
+		self.InFlight += flight.Size
+		if self.Ordered:
+			self._pending.append(flight)
+
+		if self.Running < self.Concurrency:
+			self._start(flight)
+		else:
+			self._backlog.append(flight)
+
+		if self.InFlight >= self.Concurrency and not self._throttled:
+			self._throttled = True
+			self.Pipeline.throttle(self, enable=True)
+
+
+	def _start(self, flight):
+		self.Running += 1
+		flight.Future = asyncio.ensure_future(flight.Function(flight.Context, flight.Payload), loop=self.Loop)
+		flight.Future.add_done_callback(functools.partial(self._on_done, flight))
+
+
+	def _on_done(self, flight, future):
+		self.Running -= 1
+		if len(self._backlog) > 0:
+			self._start(self._backlog.popleft())
+
+		if not self.Ordered:
+			self._complete(flight)
+			return
+
+		while len(self._pending) > 0:
+			future = self._pending[0].Future
+			if future is None or not future.done():
+				break
+			self._complete(self._pending.popleft())
+
+
+	def _complete(self, flight):
+		self.InFlight -= flight.Size
+
+		future = flight.Future
+		if not future.cancelled():
+			exc = future.exception()
+			if exc is not None:
+				dead_letter = self.Pipeline.DeadLetter
+				events = flight.Payload if flight.Batch else [flight.Payload]
+				if dead_letter is None or not dead_letter.handle_batch(self, flight.Context, events, exc):
+					L.error("Pipeline processing error in the '{}' in '{}'".format(self.Pipeline.Id, self.Id), exc_info=exc)
+					self.Pipeline.set_error(flight.Context, flight.Payload, exc)
+			elif flight.Batch:
+				events = future.result()
+				self.Pipeline.resume_batch(self, flight.Context, events, consumed=flight.Size - len(events))
+			else:
+				self.Pipeline.resume(self, flight.Context, future.result())
+
+		if self._throttled and self.InFlight <= (self.Concurrency // 2):
+			self._throttled = False
+			self.Pipeline.throttle(self, enable=False)
+
+
+	def rest_get(self):
+		rest = super().rest_get()
+		rest['Concurrency'] = self.Concurrency
+		rest['InFlight'] = self.InFlight
+		return rest
+
+
+class _Flight(object):
+
+	__slots__ = ('Function', 'Context', 'Payload', 'Size', 'Batch', 'Future')
+
+	def __init__(self, function, context, payload, size, batch):
+		self.Function = function
+		self.Context = context
+		self.Payload = payload
+		self.Size = size
+		self.Batch = batch
+		self.Future = None
@@ -13,5 +13,19 @@ class Generator(ProcessorBase):
 					yield item
 
 			return generate(event.items)
+
+	The process() method can also return an async generator, so the generator can await an I/O for each item:
+
+	class AsyncGeneratingProcessor(bspump.Generator):
+
+		def process(self, context, event):
+
+			async def generate(items):
+				for item in items:
+					yield await self.fetch(item)
+
+			return generate(event.items)
+
+	Generators can be nested, the pipeline enumerates events generated on each depth.
 	'''
 	pass
@@ -102,9 +102,9 @@ class Lookup(abc.ABC, asab.ConfigObject):
 			with open(path, 'rb') as f:
 				tlen, = struct.unpack(r"<L", f.read(struct.calcsize(r"<L")))
 				etag_b = f.read(tlen)
-				self.ETag = etag_b.decode('utf-8')
+				self.ETag = etag_b.decode('utf-8').rstrip(' ')
 				f.read(1)
-				data = f.read()
+				data = self.read_cache(f)
 
 			self.deserialize(data)
 		
@@ -117,21 +117,36 @@ class Lookup(abc.ABC, asab.ConfigObject):
 		return True
 
 
+	def read_cache(self, f):
+		'''
+		Read the data part of the cache file `f`, that is positioned at its beginning.
+		Override it e.g. to memory-map the data instead of reading them.
+		'''
+		return f.read()
+
+
 	def save_to_cache(self, data):
 		path = os.path.join(os.path.abspath(asab.Config["general"]["var_dir"]), "lookup_{}.cache".format(self.Id))
 		dirname = os.path.dirname(path)
 		if not os.path.isdir(dirname):
 			os.makedirs(dirname)
 
-		with open(path, 'wb') as fo:
+		# The cache is written to a temporary file and then renamed over the old one,
+		# because other processes may have the old one memory-mapped (see IPGeoLookup.read_cache())
+		tmp_path = "{}.{}.tmp".format(path, os.getpid())
+		with open(tmp_path, 'wb') as fo:
 
 			# Write E-Tag and '\n'
+			# The E-Tag is padded by spaces, so that the data are aligned to 16 bytes and they can be memory-mapped
 			etag_b = self.ETag.encode('utf-8')
+			etag_b += b' ' * (-(struct.calcsize(r"<L") + len(etag_b) + 1) % 16)
 			fo.write(struct.pack(r"<L", len(etag_b))+etag_b+b'\n')
 
 			# Write Data
 			fo.write(data)
 
+		os.replace(tmp_path, path)
+
 
 	# Master/slave mechanism
 
@@ -3,6 +3,10 @@ import asab
 
 class ProcessorBase(abc.ABC, asab.ConfigObject):
 
+	# True if `process_batch()` has no side effects, so a failed batch can be processed again event by event
+	# to find failing events, see `bspump.deadletter.DeadLetter`
+	BatchRetry = False
+
 
 	def __init__(self, app, pipeline, id=None, config=None):
 		super().__init__("pipeline:{}:{}".format(pipeline.Id, id if id is not None else self.__class__.__name__), config=config)
@@ -16,6 +20,22 @@ class ProcessorBase(abc.ABC, asab.ConfigObject):
 		raise NotImplemented()
 
 
+	def process_batch(self, context, events):
+		'''
+		Process a list of events at once, it is called by `Pipeline.process_batch()`.
+		The context is shared by all events in the batch.
+
+		Return a list of events that continue down the pipeline, consumed events are simply left out.
+		The default implementation calls `process()` for each event, override it to process the batch more efficiently.
+		'''
+		result = []
+		for event in events:
+			event = self.process(context, event)
+			if event is not None:
+				result.append(event)
+		return result
+
+
 	def locate_address(self):
 		return "{}.{}".format(self.Pipeline.Id, self.Id)
 
@@ -2,3 +2,5 @@ from .analyzer import Analyzer
 from .timewindowanalyzer import TimeWindowAnalyzer, TimeWindow
 from .timedriftanalyzer import TimeDriftAnalyzer
 from .sessionanalyzer import SessionAnalyzer
+from .timerwheel import TimerWheel
+from .estimators import RunningMoments, P2Quantiles
@@ -0,0 +1,145 @@
+import math
+import bisect
+
+###
+
+class RunningMoments(object):
+
+	'''
+	Count, mean, variance, minimum and maximum of a stream of values, updated in O(1) per value (Welford's algorithm).
+	'''
+
+	def __init__(self):
+		self.reset()
+
+
+	def reset(self):
+		self.Count = 0
+		self.Mean = 0.0
+		self.Min = math.inf
+		self.Max = -math.inf
+		self._m2 = 0.0
+
+
+	def add(self, value):
+		self.Count += 1
+		delta = value - self.Mean
+		self.Mean += delta / self.Count
+		self._m2 += delta * (value - self.Mean)
+		if value < self.Min:
+			self.Min = value
+		if value > self.Max:
+			self.Max = value
+
+
+	def variance(self):
+		if self.Count == 0:
+			return 0.0
+		return self._m2 / self.Count
+
+
+	def stddev(self):
+		return math.sqrt(self.variance())
+
+
+class P2Quantiles(object):
+
+	'''
+	Estimates quantiles of a stream of values in O(1) memory and time per value,
+	by the extended P-square algorithm (Jain & Chlamtac, Raatikainen).
+
+	Markers are kept at the minimum, the maximum, each of `quantiles` and in the middle between them.
+	Heights of markers are adjusted by a piecewise-parabolic interpolation as values arrive.
+	Until there are enough values for all markers, quantiles are computed exactly.
+
+	estimator = P2Quantiles([0.5, 0.9, 0.99])
+	for value in values:
+		estimator.add(value)
+	p50, p90, p99 = estimator.get()
+	'''
+
+	def __init__(self, quantiles):
+		self.Quantiles = sorted(quantiles)
+
+		increments = [0.0]
+		previous = 0.0
+		for quantile in self.Quantiles:
+			increments.append((previous + quantile) / 2)
+			increments.append(quantile)
+			previous = quantile
+		increments.append((previous + 1.0) / 2)
+		increments.append(1.0)
+		self._increments = increments
+
+		self.reset()
+
+
+	def reset(self):
+		self.Count = 0
+		self._heights = [] # Heights of markers, the first values until there is one for each marker
+		self._positions = list(range(1, len(self._increments) + 1))
+
+
+	def add(self, value):
+		self.Count += 1
+		heights = self._heights
+		markers = len(self._increments)
+
+		if self.Count <= markers:
+			heights.append(value)
+			if self.Count == markers:
+				heights.sort()
+			return
+
+		# Find the cell of the value and move positions of markers above it
+		if value < heights[0]:
+			heights[0] = value
+			cell = 0
+		elif value >= heights[-1]:
+			heights[-1] = value
+			cell = markers - 2
+		else:
+			cell = bisect.bisect_right(heights, value) - 1
+
+		positions = self._positions
+		for i in range(cell + 1, markers):
+			positions[i] += 1
+
+		# Adjust heights of inner markers that are off their desired positions
+		increments = self._increments
+		count = self.Count - 1
+		for i in range(1, markers - 1):
+			d = 1 + count * increments[i] - positions[i]
+			if -1 < d < 1:
+				continue
+			if (d >= 1 and positions[i + 1] - positions[i] > 1) or (d <= -1 and positions[i - 1] - positions[i] < -1):
+				d = 1 if d > 0 else -1
+				height = self._parabolic(i, d)
+				if not (heights[i - 1] < height < heights[i + 1]):
+					height = heights[i] + d * (heights[i + d] - heights[i]) / (positions[i + d] - positions[i])
+				heights[i] = height
+				positions[i] += d
+
+
+	def _parabolic(self, i, d):
+		q = self._heights
+		n = self._positions
+		return q[i] + d / (n[i + 1] - n[i - 1]) * (
+			(n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+			+ (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1])
+		)
+
+
+	def get(self):
+		'''
+		Return a list of estimates of `quantiles`, None if no value was added.
+		'''
+		if self.Count == 0:
+			return [None] * len(self.Quantiles)
+
+		if self.Count < len(self._increments):
+			values = sorted(self._heights)
+			return [values[min(len(values) - 1, int(quantile * len(values)))] for quantile in self.Quantiles]
+
+		# Markers of quantiles are at even indexes, between the middle markers
+		return [self._heights[2 * i + 2] for i in range(len(self.Quantiles))]
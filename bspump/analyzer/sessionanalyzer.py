@@ -1,10 +1,13 @@
 import time
+import heapq
+import asyncio
 import logging
 import numpy as np
 
 import asab
 
 from .analyzer import Analyzer
+from .timerwheel import TimerWheel
 
 ###
 
@@ -32,8 +35,32 @@ class SessionAnalyzer(Analyzer):
 	'S', 'a'	String	np.dtype('S5')
 	'U'	Unicode string	np.dtype('U') == np.str_
 	'V'	Raw data (void)	np.dtype('V') == np.void
+
+	Rows are preallocated, the capacity doubles when it is exhausted, `Sessions` is a view of rows used so far.
+	A closed session stays in `Sessions` until `rebuild_sessions('partial')`, which releases its row.
+	Released rows are zeroed and reused by next sessions (the lowest first), rows not in `RevRowMap` are free.
+	The partial rebuild then compacts `Sessions` in place: up to `compact_step` sessions from the end are moved
+	to free rows at the beginning, so that the view can be shortened. `RowMap` changes only for moved sessions.
+
+	Sessions expire when `inactivity_timeout` or `max_duration` is set. Call `touch_session()` on each activity of a session.
+	Expirations are scheduled in a timer wheel, so neither touching a session nor a tick scans the sessions.
+	On each tick of the application (or when `expire_sessions()` is called, if `expiry_clock` is disabled
+	and the time of events should be used), expired sessions are closed with `@timestamp_end` set to their expiration,
+	passed to `sessions_expired()` and their rows are released.
+	By default `sessions_expired()` puts each expired session as an event (with its fields and 'session_id')
+	into the `expiry_target` InternalSource.
 	'''
 
+	ConfigDefaults = {
+		'initial_rows': 1024, # Number of preallocated rows
+		'compact_step': 10000, # Maximum number of sessions moved by a single compaction, 0 means unlimited
+		'inactivity_timeout': 0, # In seconds, sessions are closed after this time with no activity, 0 disables it
+		'max_duration': 0, # In seconds, sessions are closed after this time since their start, 0 disables it
+		'expiry_resolution': 1, # In seconds, a precision of expirations
+		'expiry_clock': 'yes', # Expire sessions by the current time on each tick of the application
+		'expiry_target': '', # An address of the InternalSource, that receives expired sessions, e.g. 'SessionPipeline.*InternalSource'
+	}
+
 
 	def __init__(self, app, pipeline, column_formats, column_names, id=None, config=None):
 		
@@ -48,24 +75,96 @@ class SessionAnalyzer(Analyzer):
 
 		self.ColumnNames.append("@timestamp_end")
 		self.ColumnFormats.append('i4')
+
+		self.InitialRows = int(self.Config['initial_rows'])
+		self.CompactStep = int(self.Config['compact_step'])
+
+		self.InactivityTimeout = float(self.Config['inactivity_timeout'])
+		self.MaxDuration = float(self.Config['max_duration'])
+		self.ExpiryResolution = float(self.Config['expiry_resolution'])
+		self.ExpiryTarget = self.Config['expiry_target']
+		self.Expiry = (self.InactivityTimeout > 0) or (self.MaxDuration > 0)
+		self._svc = app.get_service("bspump.PumpService")
+		self._expiry_target = None
+
 		self._initialize_sessions()
+
+		if self.Expiry:
+			metrics_service = app.get_service('asab.MetricsService')
+			self.ExpiryCounter = metrics_service.create_counter("session.expiry",
+				tags={
+					'pipeline': pipeline.Id,
+					'analyzer': self.Id,
+				},
+				init_values={
+					'expired': 0,
+				}
+			)
+			if self.Config['expiry_clock'].lower() == 'yes':
+				app.PubSub.subscribe("Application.tick!", self._on_tick)
 		
 
 	def _initialize_sessions(self):
-		self.Sessions = np.zeros(0, dtype={'names': self.ColumnNames, 'formats': self.ColumnFormats})
+		self._sessions = np.zeros(self.InitialRows, dtype={'names': self.ColumnNames, 'formats': self.ColumnFormats})
+		self.Sessions = self._sessions[:0]
 		self.RowMap = {}
 		self.RevRowMap = {}
 		self.ClosedRows = set()
+		self.FreeRows = [] # A heap of released rows
+		self.Expirations = {} # session_id -> [expiration, expiration by the max duration]
+		self.TimerWheel = None # Created by the first session that expires
 
 
 	def add_session(self, session_id, start_time):
-		row = np.zeros(1, dtype={'names': self.ColumnNames, 'formats': self.ColumnFormats})
-		row["@timestamp_start"] = start_time
-		self.Sessions = np.append(self.Sessions, row) #discussable, we can preassign big matrix and then fill it untill end and then restructure
-		row_counter = len(self.RowMap)
+		if len(self.FreeRows) > 0:
+			row_counter = heapq.heappop(self.FreeRows)
+		else:
+			row_counter = len(self.Sessions)
+			if row_counter >= len(self._sessions):
+				self._grow(max(self.InitialRows, 2 * len(self._sessions)))
+			self.Sessions = self._sessions[:row_counter + 1]
+
+		self.Sessions[row_counter]["@timestamp_start"] = start_time
 		self.RowMap[session_id] = row_counter
 		self.RevRowMap[row_counter] = session_id
 
+		if self.Expiry:
+			self._schedule(session_id, start_time)
+
+
+	def _schedule(self, session_id, start_time):
+		expiration = float('inf')
+		if self.InactivityTimeout > 0:
+			expiration = start_time + self.InactivityTimeout
+		max_expiration = float('inf')
+		if self.MaxDuration > 0:
+			max_expiration = start_time + self.MaxDuration
+			expiration = min(expiration, max_expiration)
+
+		self.Expirations[session_id] = [expiration, max_expiration]
+		if self.TimerWheel is None:
+			self.TimerWheel = TimerWheel(start_time, resolution=self.ExpiryResolution)
+		self.TimerWheel.add(session_id, expiration)
+
+
+	def touch_session(self, session_id, timestamp):
+		'''
+		Record an activity of the session, it postpones its expiration by the `inactivity_timeout`.
+		'''
+		expiration = self.Expirations.get(session_id)
+		if (expiration is None) or (self.InactivityTimeout <= 0):
+			return
+
+		# The timer wheel is not updated, the session is rescheduled when its original expiration is due
+		expiration[0] = min(max(expiration[0], timestamp + self.InactivityTimeout), expiration[1])
+
+
+	def _grow(self, capacity):
+		sessions = np.zeros(capacity, dtype=self._sessions.dtype)
+		sessions[:len(self._sessions)] = self._sessions
+		self._sessions = sessions
+		self.Sessions = self._sessions[:len(self.Sessions)]
+
 
 	def close_session(self, session_id, end_time):
 		row_counter = self.RowMap.get(session_id)
@@ -76,6 +175,71 @@ class SessionAnalyzer(Analyzer):
 			idx = self.RowMap[session_id]
 			self.Sessions[idx]['@timestamp_end'] = end_time
 			self.ClosedRows.add(row_counter)
+			self.Expirations.pop(session_id, None)
+
+
+	def _on_tick(self, event_name):
+		self.expire_sessions(time.time())
+
+
+	def expire_sessions(self, now):
+		'''
+		Close sessions that expired before the `now` time.
+		'''
+		if self.TimerWheel is None:
+			return
+
+		session_ids = []
+		expirations = []
+		for _, session_id in self.TimerWheel.advance(now):
+			expiration = self.Expirations.get(session_id)
+			if expiration is None:
+				continue # Closed meanwhile
+
+			if expiration[0] > now:
+				# The session was touched meanwhile
+				self.TimerWheel.add(session_id, expiration[0])
+				continue
+
+			del self.Expirations[session_id]
+			session_ids.append(session_id)
+			expirations.append(expiration[0])
+
+		if len(session_ids) == 0:
+			return
+
+		rows = np.fromiter((self.RowMap[session_id] for session_id in session_ids), dtype=np.int64, count=len(session_ids))
+		self.Sessions['@timestamp_end'][rows] = expirations
+		self.ClosedRows.update(rows.tolist())
+		self.ExpiryCounter.add('expired', len(session_ids))
+
+		self.sessions_expired(session_ids, rows)
+
+		self.ClosedRows.difference_update(rows.tolist())
+		self._release_rows(rows.tolist())
+
+
+	def sessions_expired(self, session_ids, rows):
+		'''
+		Called with expired sessions and their rows in `Sessions`, the rows are released after it returns.
+		Override it to handle expired sessions, by default they are put into the `expiry_target`, if it is set.
+		'''
+		if len(self.ExpiryTarget) == 0:
+			return
+
+		if self._expiry_target is None:
+			self._expiry_target = self._svc.locate(self.ExpiryTarget)
+			if self._expiry_target is None:
+				L.error("Cannot locate expiry target '{}' of '{}'".format(self.ExpiryTarget, self.Id))
+				return
+
+		try:
+			for session_id, record in zip(session_ids, self.Sessions[rows].tolist()):
+				event = dict(zip(self.ColumnNames, record))
+				event['session_id'] = session_id
+				self._expiry_target.put({}, event, copy_event=False)
+		except asyncio.QueueFull:
+			L.warning("Expiry target '{}' of '{}' is full, expired sessions are dropped".format(self.ExpiryTarget, self.Id))
 
 
 	def rebuild_sessions(self, mode):
@@ -83,25 +247,69 @@ class SessionAnalyzer(Analyzer):
 		if mode == "full":
 			self._initialize_sessions()
 		elif mode == "partial":
-			new_row_map = {}
-			new_rev_row_map = {}
-			saved_indexes = []
-			for key in self.RowMap.keys():
-				value = self.RowMap[key]
-				if value not in self.ClosedRows:
-					new_row_map[key] = value
-					new_rev_row_map[value] = key
-					saved_indexes.append(value)
-
-			new_sessions = self.Sessions[saved_indexes]
-			self.Sessions = new_sessions
-			self.RowMap = new_row_map
-			self.RevRowMap = new_rev_row_map
+			self._release_rows(self.ClosedRows)
 			self.ClosedRows = set()
+			self.compact(self.CompactStep)
 
 		else:
 			L.warn("Unknown mode")
 
+
+	def _release_rows(self, rows):
+		if len(rows) == 0:
+			return
+
+		for row in rows:
+			session_id = self.RevRowMap.pop(row)
+			del self.RowMap[session_id]
+
+		rows = np.fromiter(rows, dtype=np.int64, count=len(rows))
+		self.Sessions[rows] = 0
+		self.FreeRows.extend(rows.tolist())
+		heapq.heapify(self.FreeRows)
+
+
+	def compact(self, max_moves=0):
+		'''
+		Move up to `max_moves` sessions (all if 0) from the end of `Sessions` to free rows at its beginning
+		and shorten `Sessions` by trailing free rows.
+		'''
+		if len(self.FreeRows) == 0:
+			return
+
+		used = len(self.Sessions)
+
+		free = np.zeros(used, dtype=np.bool_)
+		free[self.FreeRows] = True
+		active = np.flatnonzero(~free)
+
+		# Sessions above the number of active sessions move to free rows below it
+		holes = np.flatnonzero(free[:len(active)])
+		movers = active[active >= len(active)]
+		if (max_moves > 0) and (len(movers) > max_moves):
+			holes = holes[:max_moves]
+			movers = movers[-max_moves:]
+
+		if len(movers) > 0:
+			self.Sessions[holes] = self.Sessions[movers]
+			self.Sessions[movers] = 0
+			free[holes] = False
+			free[movers] = True
+
+			for source, target in zip(movers.tolist(), holes.tolist()):
+				session_id = self.RevRowMap.pop(source)
+				self.RowMap[session_id] = target
+				self.RevRowMap[target] = session_id
+				if source in self.ClosedRows:
+					self.ClosedRows.remove(source)
+					self.ClosedRows.add(target)
+
+		# Trim trailing free rows
+		active = np.flatnonzero(~free)
+		used = (active[-1] + 1) if len(active) > 0 else 0
+		self.Sessions = self._sessions[:used]
+		self.FreeRows = np.flatnonzero(free[:used]).tolist() # Sorted, so it is a heap
+
 	
 	
 	
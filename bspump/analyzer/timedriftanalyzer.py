@@ -2,11 +2,10 @@ import time
 import logging
 import asyncio
 
-import numpy as np
-
 import asab
 
 from .analyzer import Analyzer
+from .estimators import RunningMoments, P2Quantiles
 
 ###
 
@@ -16,33 +15,41 @@ L = logging.getLogger(__name__)
 
 class TimeDriftAnalyzer(Analyzer):
 
+	'''
+	Measures the drift of events, that is the difference between the current time and the `@timestamp` of an event.
+	Every event (or each `sparse_count`-th one) is absorbed by streaming estimators in O(1) time and memory:
+	the average, the standard deviation, the minimum, the maximum and p50/p90/p99 quantiles.
+	They are published in the `timedrift` gauge each `stats_period` seconds, in seconds, and reset.
+
+	When `key` is set, the drift is measured also for each value of this event field (e.g. a source of events),
+	in the `timedrift` gauge tagged by the 'key'. Values are distinguished by their string form, as it is the tag.
+	At most `max_keys` values are measured at once, a value without events for a whole `stats_period` is dropped.
+	Its gauge is removed if the metrics service supports it (`remove_metric()`), otherwise it is kept
+	and reused when the value appears again.
+	'''
+
 	ConfigDefaults = {
 		'stats_period' : 5*60, # once per 5 minutes
-		'history_size' : 100, # keep maximum 100 array members
 		'sparse_count' : 1, # process every single event
+		'key': '', # An event field, the drift is measured also per its values
+		'max_keys': 1000, # Maximum number of measured values of the `key`, 0 means unlimited
 	}
 
 	def __init__(self, app, pipeline, id=None, config=None):
 		super().__init__(app, pipeline, id=id, config=config)
-		
-		self.History = []
-		self.HistorySize = self.Config['history_size']
 
-		metrics_service = app.get_service('asab.MetricsService')
+		self.Key = self.Config['key']
+		self.Moments = RunningMoments()
+		self.Quantiles = P2Quantiles([0.5, 0.9, 0.99])
+		self.KeyEstimators = {} # str(key) -> (moments, quantiles, gauge)
+		self.KeyGauges = {} # str(key) -> gauge, gauges are kept when the metrics service cannot remove them
+		self.MaxKeys = int(self.Config['max_keys'])
+		self._max_keys_reported = False
 
-		self.DifferenceCounter = metrics_service.create_counter("timedrift.difference", tags={}, init_values={'positive': 0, 'negative': 0})
-		self.Gauge = metrics_service.create_gauge("timedrift",
-			tags = {
-				'pipeline': pipeline.Id,
-			},
-			init_values = {
-				"avg": 0.0,
-				"median" : 0.0,
-				"stddev": 0.0,
-				"min" : 0.0,
-				"max" : 0.0,
-			}
-		)
+		self.MetricsService = app.get_service('asab.MetricsService')
+
+		self.DifferenceCounter = self.MetricsService.create_counter("timedrift.difference", tags={}, init_values={'positive': 0, 'negative': 0})
+		self.Gauge = self._create_gauge({'pipeline': pipeline.Id})
 		
 		self.EventCount = 0
 		self.SparseCount = int(self.Config['sparse_count'])
@@ -57,6 +64,22 @@ class TimeDriftAnalyzer(Analyzer):
 		await self.analyze()
 
 
+	def _create_gauge(self, tags):
+		return self.MetricsService.create_gauge("timedrift",
+			tags = tags,
+			init_values = {
+				"avg": 0.0,
+				"median" : 0.0,
+				"stddev": 0.0,
+				"min" : 0.0,
+				"max" : 0.0,
+				"p50": 0.0,
+				"p90": 0.0,
+				"p99": 0.0,
+			}
+		)
+
+
 	def predicate(self, event):
 		if "@timestamp" not in event:
 			return False
@@ -81,20 +104,65 @@ class TimeDriftAnalyzer(Analyzer):
 			self.DifferenceCounter.add('negative', 1)
 			return
 		self.DifferenceCounter.add('positive', 1)
-		
-		self.History.append(diff)
 
-		while len(self.History) > self.HistorySize:
-			self.History.pop(0)
+		self.Moments.add(diff)
+		self.Quantiles.add(diff)
+
+		if len(self.Key) > 0:
+			key = event.get(self.Key)
+			if key is None:
+				return
+			key = str(key)
+			estimators = self.KeyEstimators.get(key)
+			if estimators is None:
+				if (self.MaxKeys > 0) and (len(self.KeyEstimators) >= self.MaxKeys):
+					if not self._max_keys_reported:
+						self._max_keys_reported = True
+						L.warning("Number of values of '{}' in '{}' reached max_keys {}, new values are not measured".format(
+							self.Key, self.Id, self.MaxKeys
+						))
+					return
+				gauge = self.KeyGauges.get(key)
+				if gauge is None:
+					gauge = self._create_gauge({'pipeline': self.Pipeline.Id, 'key': key})
+					self.KeyGauges[key] = gauge
+				estimators = (RunningMoments(), P2Quantiles([0.5, 0.9, 0.99]), gauge)
+				self.KeyEstimators[key] = estimators
+			estimators[0].add(diff)
+			estimators[1].add(diff)
 
 
 	async def analyze(self):
+		self._publish(self.Moments, self.Quantiles, self.Gauge)
+
+		idle = []
+		for key, (moments, quantiles, gauge) in self.KeyEstimators.items():
+			if moments.Count == 0:
+				idle.append(key)
+				continue
+			self._publish(moments, quantiles, gauge)
+
+		if len(idle) > 0:
+			remove_metric = getattr(self.MetricsService, 'remove_metric', None)
+			for key in idle:
+				del self.KeyEstimators[key]
+				if remove_metric is not None:
+					remove_metric(self.KeyGauges.pop(key))
+			self._max_keys_reported = False
+
+
+	def _publish(self, moments, quantiles, gauge):
 		# in seconds
-		if len(self.History) > 0:
-			self.Gauge.set("avg", np.mean(self.History)/1000)
-			self.Gauge.set("median", np.median(self.History)/1000)
-			self.Gauge.set("stddev", np.std(self.History)/1000)
-			self.Gauge.set("min", np.min(self.History)/1000)
-			self.Gauge.set("max", np.max(self.History)/1000)
-
-			self.History = []
+		if moments.Count > 0:
+			p50, p90, p99 = quantiles.get()
+			gauge.set("avg", moments.Mean/1000)
+			gauge.set("median", p50/1000)
+			gauge.set("stddev", moments.stddev()/1000)
+			gauge.set("min", moments.Min/1000)
+			gauge.set("max", moments.Max/1000)
+			gauge.set("p50", p50/1000)
+			gauge.set("p90", p90/1000)
+			gauge.set("p99", p99/1000)
+
+			moments.reset()
+			quantiles.reset()
@@ -0,0 +1,134 @@
+import logging
+
+###
+
+L = logging.getLogger(__name__)
+
+###
+
+class TimerWheel(object):
+
+	'''
+	A hierarchical timer wheel, it schedules keys to expire at a given time.
+	Adding a key is O(1) and so is advancing the wheel by a tick, except when a slot of an upper level is cascaded.
+
+	Time is split to ticks of `resolution` seconds. The first level has `slots[0]` slots of one tick,
+	each next level has `slots[i]` slots, that span the whole previous level.
+	When the lower level wraps around, keys of the next slot of the upper level are cascaded to lower levels.
+	Keys scheduled beyond the range of the wheel are kept in its last slot and rescheduled when they get there.
+
+	The wheel doesn't support removal of keys, a key that should expire later or not at all
+	is meant to be rescheduled or dropped when it is returned by `advance()`.
+
+	Advancing by a gap that is longer than the number of scheduled keys (e.g. after the wheel was idle)
+	doesn't step thru ticks, all keys are redistributed at once instead.
+	'''
+
+	def __init__(self, start_time, resolution=1, slots=(256, 64, 64, 64)):
+		self.Resolution = resolution
+		self.Tick = int(start_time // resolution) # The current tick, keys scheduled before or at it are expired
+
+		self.Bits = []
+		for size in slots:
+			bits = size.bit_length() - 1
+			if size != (1 << bits):
+				raise ValueError("Number of slots must be a power of two")
+			self.Bits.append(bits)
+
+		self.Levels = [[[] for _ in range(size)] for size in slots]
+		self.Count = 0 # Number of scheduled keys
+		self._slot_count = sum(slots)
+
+		self._due = [] # Keys that expired when they were added
+
+
+	def add(self, key, expiration):
+		'''
+		Schedule the `key` to expire at the `expiration` time.
+		'''
+		self._insert(key, int(-(-expiration // self.Resolution)))
+		self.Count += 1
+
+
+	def _insert(self, key, tick):
+		delta = tick - self.Tick
+		if delta <= 0:
+			self._due.append((tick, key))
+			return
+
+		shift = 0
+		for bits, level in zip(self.Bits, self.Levels):
+			if delta < (1 << (shift + bits)):
+				level[(tick >> shift) & ((1 << bits) - 1)].append((tick, key))
+				return
+			shift += bits
+
+		# Beyond the range of the wheel, rescheduled when the last level cascades its furthest slot
+		level = self.Levels[-1]
+		bits = self.Bits[-1]
+		shift -= bits
+		level[((self.Tick >> shift) - 1) & ((1 << bits) - 1)].append((tick, key))
+
+
+	def advance(self, now):
+		'''
+		Advance the wheel to the `now` time, return a list of (expiration tick, key) tuples of expired keys.
+		'''
+		due = self._due
+		self._due = []
+
+		target = int(now // self.Resolution)
+		if self.Count == len(due):
+			# Nothing is scheduled
+			self.Tick = max(self.Tick, target)
+
+		elif target - self.Tick > self.Count - len(due) + self._slot_count:
+			# Stepping thru the gap would be slower than redistributing all keys
+			self._jump(target, due)
+
+		while self.Tick < target:
+			self.Tick += 1
+			tick = self.Tick
+
+			# Cascade upper levels when lower levels wrap around
+			shift = 0
+			for i in range(len(self.Levels) - 1):
+				shift += self.Bits[i]
+				if (tick & ((1 << shift) - 1)) != 0:
+					break
+				slot = self.Levels[i + 1][(tick >> shift) & ((1 << self.Bits[i + 1]) - 1)]
+				entries = slot[:]
+				del slot[:]
+				for entry_tick, key in entries:
+					self._insert(key, entry_tick)
+
+			slot = self.Levels[0][tick & ((1 << self.Bits[0]) - 1)]
+			if len(slot) > 0:
+				due.extend(slot)
+				del slot[:]
+
+			due.extend(self._due)
+			self._due = []
+
+		self.Count -= len(due)
+		return due
+
+
+	def _jump(self, target, due):
+		entries = []
+		for level in self.Levels:
+			for slot in level:
+				if len(slot) > 0:
+					entries.extend(slot)
+					del slot[:]
+
+		self.Tick = target
+		expired = []
+		for entry_tick, key in entries:
+			if entry_tick <= target:
+				expired.append((entry_tick, key))
+			else:
+				self._insert(key, entry_tick)
+
+		expired.sort(key=lambda entry: entry[0])
+		due.extend(expired)
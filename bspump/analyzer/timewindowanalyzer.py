@@ -33,9 +33,21 @@ class TimeWindow(object):
 	^                       ^
 	End (past)   <          Start (== now)
 
+	The matrix is a circular buffer of columns, the oldest column is at the `Head` index.
+	When the window advances, the oldest column is zeroed and reused as the newest one, the rest of the matrix is not moved.
+	`get_column()` returns the index of the column in the `Matrix`, so it can be used to update it directly.
+	The order of columns in the `Matrix` is therefore NOT chronological, code that reads the matrix by time
+	(e.g. `Matrix[:, -1]` as the newest column) has to use `view_ordered()`, which returns the matrix
+	with columns ordered from the oldest to the newest.
+
+	Rows are preallocated, the capacity doubles when it is exhausted. `Matrix` and `WarmingUpRows` are views
+	of rows that have been used so far. A row that is removed by `remove_row()` is zeroed and reused by the next `add_row()`,
+	rows not in `RevRowMap` are free. When `idle_columns` is set, rows that are zero in this number
+	of the most recent complete columns are removed when the window advances.
+
 	'''
 
-	def __init__(self, app, pipeline, start_time, third_dimension=1, resolution=60, columns=15):
+	def __init__(self, app, pipeline, start_time, third_dimension=1, resolution=60, columns=15, idle_columns=0, initial_rows=64):
 
 		if start_time is None:
 			start_time = time.time()
@@ -48,6 +60,7 @@ class TimeWindow(object):
 		self.Start = (1 + (start_time // self.Resolution)) * self.Resolution
 		self.End = self.Start - (self.Resolution * self.Columns)
 		self.Matrix = None
+		self.Head = 0 # Index of the oldest column in the Matrix
 
 		self.RowMap = {}
 		self.RevRowMap = {}
@@ -55,6 +68,13 @@ class TimeWindow(object):
 		#to warm up
 		self.WarmingUpRows = None
 
+		self.Capacity = 0 # Number of preallocated rows
+		self.InitialRows = initial_rows
+		self.FreeRows = [] # Removed rows to be reused
+		self.IdleColumns = min(idle_columns, self.Columns - 1)
+		self._matrix = None # The whole preallocated matrix, `Matrix` is a view of its used rows
+		self._warming_up_rows = None
+
 
 		metrics_service = app.get_service('asab.MetricsService')
 		self.Counters = metrics_service.create_counter(
@@ -66,6 +86,18 @@ class TimeWindow(object):
 			init_values={
 				'events.early': 0,
 				'events.late': 0,
+				'rows.evicted': 0,
+			}
+		)
+		self.Gauge = metrics_service.create_gauge(
+			"timewindow.rows",
+			tags={
+				'pipeline': pipeline.Id,
+				'tw': "TimeWindow",
+			},
+			init_values={
+				'active': 0,
+				'capacity': 0,
 			}
 		)
 
@@ -77,39 +109,87 @@ class TimeWindow(object):
 		if self.Matrix is None:
 			return
 
-		if self.ThirdDimension >= 2:
-			column = np.zeros([len(self.RowMap), 1, self.ThirdDimension])
-			self.Matrix = np.hstack((self.Matrix, column))
-			self.Matrix = np.delete(self.Matrix, 0, axis=1)
-
-		else:
-			column = np.zeros([len(self.RowMap), 1])
-			self.Matrix = np.hstack((self.Matrix, column))
-			self.Matrix = np.delete(self.Matrix, 0, axis=1)
+		# The oldest column becomes the newest one
+		self.Matrix[:, self.Head] = 0
+		self.Head = (self.Head + 1) % self.Columns
 
 		#decrease warming up
 		self.WarmingUpRows[:, 0] -= 1
 
-	
+		if self.IdleColumns > 0:
+			self.evict_idle_rows()
+
+
+	def evict_idle_rows(self):
+		'''
+		Remove rows that are zero in the `IdleColumns` most recent complete columns.
+		Rows that were added later than that are kept.
+		'''
+		if self.Matrix is None or len(self.RowMap) == 0:
+			return
+
+		# The newest column is the last one before the Head, the most recent complete columns precede it
+		columns = [(self.Head - 2 - i) % self.Columns for i in range(self.IdleColumns)]
+		recent = self.Matrix[:, columns].reshape(self.Matrix.shape[0], -1)
+		idle = np.logical_not(recent.any(axis=1))
+		idle &= (self.Columns - self.WarmingUpRows[:, 0]) >= self.IdleColumns
+
+		evicted = 0
+		for row in np.nonzero(idle)[0]:
+			row_name = self.RevRowMap.get(row)
+			if row_name is None:
+				continue # A free row
+			self.remove_row(row_name)
+			evicted += 1
+
+		if evicted > 0:
+			self.Counters.add('rows.evicted', evicted)
+
+
 	def add_row(self, row_name):
-		rowcounter = len(self.RowMap)
-		self.RowMap[row_name] = rowcounter
-		self.RevRowMap[rowcounter] = row_name
+		if len(self.FreeRows) > 0:
+			row = self.FreeRows.pop()
+		else:
+			row = 0 if self.Matrix is None else self.Matrix.shape[0]
+			if row >= self.Capacity:
+				self._grow(max(self.InitialRows, 2 * self.Capacity))
+			self.Matrix = self._matrix[:row + 1]
+			self.WarmingUpRows = self._warming_up_rows[:row + 1]
+
+		self.RowMap[row_name] = row
+		self.RevRowMap[row] = row_name
 
 		#and to warming up
+		self.WarmingUpRows[row] = self.Columns
+		self.Gauge.set('active', len(self.RowMap))
+
+
+	def remove_row(self, row_name):
+		'''
+		Remove the row, it is zeroed and reused by a next `add_row()`.
+		'''
+		row = self.RowMap.pop(row_name)
+		del self.RevRowMap[row]
+		self.Matrix[row] = 0
+		self.FreeRows.append(row)
+		self.Gauge.set('active', len(self.RowMap))
+
+
+	def _grow(self, capacity):
 		if self.ThirdDimension >= 2:
-			row = np.zeros([1, self.Columns, self.ThirdDimension])
+			matrix = np.zeros([capacity, self.Columns, self.ThirdDimension])
 		else:
-			row = np.zeros([1, self.Columns])
-		
-		warm_up = self.Columns * np.ones([1, 1])
-		
-		if self.Matrix is None:
-			self.Matrix = row
-			self.WarmingUpRows = warm_up
-		else:
-			self.Matrix = np.vstack((self.Matrix, row))
-			self.WarmingUpRows = np.vstack((self.WarmingUpRows, warm_up))
+			matrix = np.zeros([capacity, self.Columns])
+		warming_up_rows = np.zeros([capacity, 1])
+
+		if self._matrix is not None:
+			matrix[:self.Capacity] = self._matrix
+			warming_up_rows[:self.Capacity] = self._warming_up_rows
+
+		self._matrix = matrix
+		self._warming_up_rows = warming_up_rows
+		self.Capacity = capacity
+		self.Gauge.set('capacity', capacity)
 
 	
 	def get_row(self, row_name):
@@ -133,7 +213,18 @@ class TimeWindow(object):
 
 		assert(column_idx >= 0)
 		assert(column_idx < self.Columns)
-		return column_idx
+		return (self.Head + column_idx) % self.Columns
+
+
+	def view_ordered(self):
+		'''
+		Return the matrix with columns ordered from the oldest (End) to the newest (Start).
+		It is a view of the `Matrix` when its columns are in order, otherwise it is a copy.
+		'''
+		if (self.Matrix is None) or (self.Head == 0):
+			return self.Matrix
+
+		return np.concatenate((self.Matrix[:, self.Head:], self.Matrix[:, :self.Head]), axis=1)
 
 
 	def advance(self, target_ts):
@@ -166,11 +257,13 @@ class TimeWindowAnalyzer(Analyzer):
 	This is the analyzer for events with a temporal dimension (aka timestamp).
 	Configurable sliding window records events withing specified windows and implements functions to find the exact time slot.
 	Timer periodically shifts the window by time window resolution, dropping previous events.
+	Columns of `TimeWindow.Matrix` are not in chronological order, read the window thru `view_ordered()`.
 	'''
 
 	ConfigDefaults = {
 		'columns': 15,
 		'resolution': 60, # Resolution (aka column width) in seconds
+		'idle_columns': 0, # Remove rows with no values in this number of recent columns, 0 disables it
 	}
 
 	def __init__(self, app, pipeline, labels=None, dimension=None, start_time=None, clock_driven=True, time_windows=None, id=None, config=None):
@@ -226,7 +319,8 @@ class TimeWindowAnalyzer(Analyzer):
 					pipeline,
 					start_time=start_time,
 					resolution=int(self.Config['resolution']),
-					columns=int(self.Config['columns'])
+					columns=int(self.Config['columns']),
+					idle_columns=int(self.Config['idle_columns']),
 				)
 			else:
 				self.TimeWindows[label] = TimeWindow(
@@ -235,7 +329,8 @@ class TimeWindowAnalyzer(Analyzer):
 					third_dimension=dimension,
 					start_time=start_time,
 					resolution=int(self.Config['resolution']),
-					columns=int(self.Config['columns'])
+					columns=int(self.Config['columns']),
+					idle_columns=int(self.Config['idle_columns']),
 				)
 		
 		self.TimeWindow = self.TimeWindows[labels[0]]
@@ -264,6 +359,20 @@ class TimeWindowAnalyzer(Analyzer):
 			self.TimeWindows[label].add_row(row_name)
 
 
+	def remove_row(self, row_name, label=None):
+		if label is None:
+			self.TimeWindow.remove_row(row_name)
+		else:
+			self.TimeWindows[label].remove_row(row_name)
+
+
+	def view_ordered(self, label=None):
+		if label is None:
+			return self.TimeWindow.view_ordered()
+		else:
+			return self.TimeWindows[label].view_ordered()
+
+
 
 	def advance(self, target_ts):
 		for tw in self.TimeWindows.values():
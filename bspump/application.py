@@ -83,6 +83,7 @@ build: {} [{}]
 	def parse_arguments(self):
 		args = super().parse_arguments()
 		self._web_listen = args.web
+		return args
 
 
 	async def main(self):
@@ -0,0 +1,9 @@
+from .application import BenchmarkApplication
+from .generator import benchmark_generators
+from .dispatch import benchmark_dispatch
+from .routing import benchmark_routing, benchmark_copy
+from .processors import benchmark_processors
+from .lookup import benchmark_lookups
+from .analyzer import benchmark_analyzers, benchmark_session_churn
+from .file import benchmark_files
+from .synthetic import SyntheticSource, LatencySink, BenchmarkPipeline
@@ -0,0 +1,4 @@
+from .application import BenchmarkApplication
+
+app = BenchmarkApplication()
+app.run()
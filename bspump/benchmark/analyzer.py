@@ -0,0 +1,143 @@
+import time
+
+import bspump.analyzer
+
+from .synthetic import measure, BenchmarkPipeline, SyntheticSource, LatencySink
+
+###
+
+def analyzer_event(i):
+	return {
+		'@timestamp': int(time.time() * 1000) - (i % 600) * 1000,
+		'key': "key{}".format(i % 1000),
+		'session': "session{}".format(i % 5000),
+		'close': (i % 10) == 0,
+	}
+
+
+class BenchmarkTimeWindowAnalyzer(bspump.analyzer.TimeWindowAnalyzer):
+
+	def __init__(self, app, pipeline, id=None, config=None):
+		super().__init__(app, pipeline, clock_driven=False, id=id, config=config)
+
+
+	def predicate(self, event):
+		return True
+
+
+	def evaluate(self, event):
+		row = self.TimeWindow.get_row(event['key'])
+		if row is None:
+			self.TimeWindow.add_row(event['key'])
+			row = self.TimeWindow.get_row(event['key'])
+
+		column = self.TimeWindow.get_column(event['@timestamp'] / 1000)
+		if column is not None:
+			self.TimeWindow.Matrix[row, column] += 1
+
+
+	async def analyze(self):
+		pass
+
+
+def churn_event(i, sessions):
+	# There are `sessions` open sessions, each has 4 events and the last one closes it
+	generation, rnd = divmod(i // sessions, 4)
+	return {
+		'@timestamp': int(time.time() * 1000),
+		'session': "session{}-{}".format(generation, i % sessions),
+		'close': rnd == 3,
+	}
+
+
+class BenchmarkSessionAnalyzer(bspump.analyzer.SessionAnalyzer):
+
+	def __init__(self, app, pipeline, id=None, config=None):
+		super().__init__(app, pipeline, column_formats=['i4'], column_names=['count'], id=id, config=config)
+
+
+	def predicate(self, event):
+		return True
+
+
+	def evaluate(self, event):
+		session_id = event['session']
+		row = self.RowMap.get(session_id)
+		if row is None:
+			self.add_session(session_id, event['@timestamp'] // 1000)
+			row = self.RowMap[session_id]
+
+		self.Sessions[row]['count'] += 1
+		if event['close']:
+			self.close_session(session_id, event['@timestamp'] // 1000)
+
+
+	async def analyze(self):
+		pass
+
+
+class BenchmarkSessionChurnAnalyzer(BenchmarkSessionAnalyzer):
+
+	def __init__(self, app, pipeline, rebuild_period=1000, id=None, config=None):
+		super().__init__(app, pipeline, id=id, config=config)
+		self.RebuildPeriod = rebuild_period
+		self.Evaluated = 0
+
+
+	def evaluate(self, event):
+		super().evaluate(event)
+		self.Evaluated += 1
+		if (self.Evaluated % self.RebuildPeriod) == 0:
+			self.rebuild_sessions('partial')
+
+###
+
+# Name: analyzer factory
+Analyzers = {
+	'timewindow': lambda app, pipeline: BenchmarkTimeWindowAnalyzer(app, pipeline),
+	'session': lambda app, pipeline: BenchmarkSessionAnalyzer(app, pipeline),
+	'timedrift': lambda app, pipeline: bspump.analyzer.TimeDriftAnalyzer(app, pipeline),
+}
+
+
+async def benchmark_analyzers(app, events=10000):
+	'''
+	Measure the time window, the session and the time drift analyzers on events with 1000 keys and 5000 sessions.
+	'''
+	results = []
+	for name, analyzer in Analyzers.items():
+		pipeline = BenchmarkPipeline(app, "AnalyzerBenchmark-{}".format(name),
+			lambda app, pipeline: SyntheticSource(app, pipeline, analyzer_event, events, pool_size=events),
+			analyzer,
+			lambda app, pipeline: LatencySink(app, pipeline, events),
+		)
+
+		result = await measure(app, pipeline, events)
+
+		# Stop the timer of the analyzer, if any
+		timer = getattr(pipeline.Processors[0][0], 'Timer', None)
+		if timer is not None:
+			timer.stop()
+
+		results.append(dict({'name': 'analyzer', 'analyzer': name}, **result))
+
+	return results
+
+
+async def benchmark_session_churn(app, events=10000, sessions=10000, rebuild_periods=(100, 1000)):
+	'''
+	Measure the session analyzer with `sessions` open sessions, when sessions are opened and closed all the time
+	and closed sessions are released by a partial rebuild each `rebuild_period` events.
+	'''
+	results = []
+	for rebuild_period in rebuild_periods:
+		pipeline = BenchmarkPipeline(app, "SessionChurnBenchmark-{}".format(rebuild_period),
+			lambda app, pipeline: SyntheticSource(app, pipeline, lambda i: churn_event(i, sessions), events, pool_size=events),
+			lambda app, pipeline: BenchmarkSessionChurnAnalyzer(app, pipeline, rebuild_period=rebuild_period),
+			lambda app, pipeline: LatencySink(app, pipeline, events),
+		)
+
+		result = await measure(app, pipeline, events)
+		results.append(dict({'name': 'churn', 'sessions': sessions, 'rebuild': rebuild_period}, **result))
+
+	return results
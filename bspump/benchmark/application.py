@@ -0,0 +1,95 @@
+import sys
+import json
+import platform
+import datetime
+
+from ..application import BSPumpApplication
+from ..__version__ import __version__
+from .synthetic import rss
+from .generator import benchmark_generators
+from .dispatch import benchmark_dispatch
+from .routing import benchmark_routing, benchmark_copy
+from .processors import benchmark_processors
+from .lookup import benchmark_lookups
+from .analyzer import benchmark_analyzers, benchmark_session_churn
+from .file import benchmark_files
+
+
+class BenchmarkApplication(BSPumpApplication):
+
+	'''
+	Runs the BSPump benchmarks and prints the results.
+	Each result contains the throughput (events per second), latency percentiles (in seconds), if measured,
+	and the current and the peak RSS of the process (in bytes) after the benchmark.
+
+	$ python3 -m bspump.benchmark --events 1000 --fanout 10
+	$ python3 -m bspump.benchmark --benchmark dispatch
+	$ python3 -m bspump.benchmark --output results.json
+	'''
+
+	Benchmarks = {
+		'generator': lambda app, args: benchmark_generators(app, events=args.events, fanout=args.fanout),
+		'dispatch': lambda app, args: benchmark_dispatch(app, events=args.events * 100),
+		'routing': lambda app, args: benchmark_routing(app, events=args.events * 10),
+		'copy': lambda app, args: benchmark_copy(app, events=args.events * 10),
+		'processor': lambda app, args: benchmark_processors(app, events=args.events * 10),
+		'lookup': lambda app, args: benchmark_lookups(app, events=args.events * 10),
+		'analyzer': lambda app, args: benchmark_analyzers(app, events=args.events * 10),
+		'churn': lambda app, args: benchmark_session_churn(app, events=args.events * 100),
+		'file': lambda app, args: benchmark_files(app, events=args.events * 10),
+	}
+
+
+	def create_argument_parser(self):
+		parser = super().create_argument_parser()
+		parser.add_argument('--benchmark', action='append', choices=sorted(self.Benchmarks.keys()), help='run only the specified benchmark, can be repeated')
+		parser.add_argument('--events', type=int, default=1000, help='number of events sent into each benchmarked pipeline')
+		parser.add_argument('--fanout', type=int, default=10, help='number of events generated from each event by a generator')
+		parser.add_argument('--output', metavar='FILE', help='write results into the FILE in JSON, so that they can be compared across releases')
+		return parser
+
+
+	def parse_arguments(self):
+		args = super().parse_arguments()
+		self.Arguments = args
+		return args
+
+
+	async def main(self):
+		names = self.Arguments.benchmark
+		if names is None:
+			names = self.Benchmarks.keys()
+
+		output = []
+		for name in names:
+			results = await self.Benchmarks[name](self, self.Arguments)
+			for result in results:
+				result['rss'], result['rss.max'] = rss()
+				sys.stdout.write("{:<12} {}\n".format(
+					result['name'],
+					' '.join("{}={}".format(k, self._format(v)) for k, v in result.items() if k != 'name')
+				))
+				output.append(result)
+
+		if self.Arguments.output is not None:
+			with open(self.Arguments.output, 'w') as f:
+				json.dump({
+					'bspump': __version__,
+					'python': platform.python_version(),
+					'platform': platform.platform(),
+					'timestamp': datetime.datetime.utcnow().isoformat() + 'Z',
+					'arguments': {
+						'events': self.Arguments.events,
+						'fanout': self.Arguments.fanout,
+					},
+					'results': output,
+				}, f, indent=2)
+
+		self.stop()
+
+
+	@staticmethod
+	def _format(value):
+		if isinstance(value, float):
+			return "{:0.6g}".format(value)
+		return str(value)
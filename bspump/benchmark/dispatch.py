@@ -0,0 +1,94 @@
+import asyncio
+
+import bspump
+import bspump.common
+
+from ..context import EventContext
+
+###
+
+class PassThruProcessor(bspump.Processor):
+
+	def process(self, context, event):
+		return event
+
+
+class DispatchBenchmarkPipeline(bspump.Pipeline):
+
+	def __init__(self, app, pipeline_id, processors):
+		super().__init__(app, pipeline_id)
+		# Events are fed into the pipeline directly, hence no source
+		self.build(
+			[],
+			*[PassThruProcessor(app, self, id="PassThruProcessor{}".format(i)) for i in range(processors)],
+			bspump.common.NullSink(app, self),
+		)
+
+###
+
+def _interpreted_do_process(pipeline, event, depth, context):
+	'''
+	A reference of the per-event dispatch loop, as it was implemented before the processor chains were compiled.
+	'''
+	for processor in pipeline.Processors[depth]:
+		try:
+			event = processor.process(context, event)
+		except BaseException as e:
+			pipeline.set_error(context, event, e)
+			raise
+
+		if event is None:
+			if len(pipeline.Processors) == (depth + 1):
+				if isinstance(processor, bspump.Sink):
+					pipeline.MetricsCounter.add('event.out', 1)
+				else:
+					pipeline.MetricsCounter.add('event.drop', 1)
+			return
+
+	raise bspump.ProcessingError("Incomplete pipeline, event '{}' is not consumed by a Sink".format(event))
+
+
+async def benchmark_dispatch(app, events=100000, processors=(1, 10, 20)):
+	'''
+	Measure the per-event dispatch cost of the pipeline with 1, 10 and 20 cheap processors.
+	The compiled processor chain is compared with the reference interpreted loop.
+	'''
+	results = []
+	for count in processors:
+		pipeline = DispatchBenchmarkPipeline(app, "DispatchBenchmark{}".format(count), processors=count)
+		pipeline.start()
+
+		context = EventContext()
+
+		t0 = app.Loop.time()
+		for i in range(events):
+			_interpreted_do_process(pipeline, i, 0, context)
+		reference = app.Loop.time() - t0
+
+		t0 = app.Loop.time()
+		for i in range(events):
+			pipeline._do_process(i, 0, context)
+		compiled = app.Loop.time() - t0
+
+		t0 = app.Loop.time()
+		for i in range(events):
+			await pipeline.process(i)
+		duration = app.Loop.time() - t0
+
+		await pipeline.stop()
+
+		results.append({
+			'name': 'dispatch',
+			'processors': count,
+			'events.in': events,
+			'duration': duration,
+			'eps.in': events / duration if duration > 0 else None,
+			'dispatch.reference': reference / events,
+			'dispatch.compiled': compiled / events,
+			'speedup': reference / compiled if compiled > 0 else None,
+		})
+
+		# Give a chance to other tasks
+		await asyncio.sleep(0)
+
+	return results
@@ -0,0 +1,90 @@
+import os
+import csv
+import json
+import asyncio
+import tempfile
+
+import bspump.file
+import bspump.trigger
+
+from .synthetic import synthetic_event, synthetic_flat_event, measure, BenchmarkPipeline, SyntheticSource, LatencySink
+
+###
+
+async def benchmark_files(app, events=10000):
+	'''
+	Measure file sources (lines, CSV) reading and file sinks (CSV, blocks) writing `events` records.
+	Files are created in a temporary directory.
+	'''
+	results = []
+	with tempfile.TemporaryDirectory() as tmpdir:
+
+		# Sources
+		path = os.path.join(tmpdir, 'events.json')
+		with open(path, 'w') as f:
+			for i in range(events):
+				f.write(json.dumps(synthetic_event(i)))
+				f.write('\n')
+
+		result = await _measure_source(app, "FileLineSourceBenchmark", events,
+			lambda app, pipeline: bspump.file.FileLineSource(app, pipeline, config={'path': path, 'post': 'noop'}),
+		)
+		results.append(dict({'name': 'file', 'file': 'FileLineSource'}, **result))
+
+		path = os.path.join(tmpdir, 'events.csv')
+		with open(path, 'w', newline='') as f:
+			fieldnames = list(synthetic_flat_event(0).keys())
+			writer = csv.DictWriter(f, fieldnames=fieldnames)
+			writer.writeheader()
+			for i in range(events):
+				writer.writerow(synthetic_flat_event(i))
+
+		result = await _measure_source(app, "FileCSVSourceBenchmark", events,
+			lambda app, pipeline: bspump.file.FileCSVSource(app, pipeline, config={'path': path, 'post': 'noop'}),
+		)
+		results.append(dict({'name': 'file', 'file': 'FileCSVSource'}, **result))
+
+		# Sinks
+		path = os.path.join(tmpdir, 'output.csv')
+		pipeline = BenchmarkPipeline(app, "FileCSVSinkBenchmark",
+			lambda app, pipeline: SyntheticSource(app, pipeline, synthetic_flat_event, events),
+			lambda app, pipeline: bspump.file.FileCSVSink(app, pipeline, config={'path': path}),
+		)
+		result = await measure(app, pipeline, events, done=pipeline.Sources[0].Done)
+		pipeline.Processors[0][-1].rotate()
+		results.append(dict({'name': 'file', 'file': 'FileCSVSink'}, **result))
+
+		path = os.path.join(tmpdir, 'output.bin')
+		pipeline = BenchmarkPipeline(app, "FileBlockSinkBenchmark",
+			lambda app, pipeline: SyntheticSource(app, pipeline, lambda i: (json.dumps(synthetic_event(i)) + '\n').encode('utf-8'), events),
+			lambda app, pipeline: bspump.file.FileBlockSink(app, pipeline, config={'path': path}),
+		)
+		result = await measure(app, pipeline, events, done=pipeline.Sources[0].Done)
+		results.append(dict({'name': 'file', 'file': 'FileBlockSink'}, **result))
+
+	return results
+
+
+async def _measure_source(app, pipeline_id, events, source):
+	pipeline = BenchmarkPipeline(app, pipeline_id,
+		lambda app, pipeline: source(app, pipeline).on(bspump.trigger.PubSubTrigger(app, "bspump.benchmark.read!", pipeline.PubSub)),
+		lambda app, pipeline: LatencySink(app, pipeline, events),
+	)
+	# The file is read once, right after the pipeline is started by measure()
+	pipeline.PubSub.publish("bspump.benchmark.read!", asynchronously=True)
+
+	# The source is stopped only after the whole cycle is completed
+	cycle = _CycleEnd(pipeline)
+	return await measure(app, pipeline, events, done=cycle.Done)
+
+
+class _CycleEnd(object):
+
+	def __init__(self, pipeline):
+		self.Done = asyncio.Future(loop=pipeline.Loop)
+		pipeline.PubSub.subscribe("bspump.pipeline.cycle_end!", self._on_cycle_end)
+
+
+	def _on_cycle_end(self, event_name, pipeline):
+		if not self.Done.done():
+			self.Done.set_result(True)
@@ -0,0 +1,83 @@
+import asyncio
+
+import bspump
+import bspump.common
+
+###
+
+class FanOutGenerator(bspump.Generator):
+
+	def __init__(self, app, pipeline, fanout, asynchronous=False, id=None, config=None):
+		super().__init__(app, pipeline, id=id, config=config)
+		self.FanOut = fanout
+		self.Asynchronous = asynchronous
+
+
+	def process(self, context, event):
+
+		def generate():
+			for i in range(self.FanOut):
+				yield event
+
+		async def agenerate():
+			for i in range(self.FanOut):
+				yield event
+
+		if self.Asynchronous:
+			return agenerate()
+		return generate()
+
+
+class GeneratorBenchmarkPipeline(bspump.Pipeline):
+
+	def __init__(self, app, pipeline_id, levels, fanout, asynchronous=False):
+		super().__init__(app, pipeline_id)
+		# Events are fed into the pipeline directly, hence no source
+		self.build(
+			[],
+			*[FanOutGenerator(app, self, fanout, asynchronous=asynchronous, id="FanOutGenerator{}".format(level)) for level in range(levels)],
+			bspump.common.NullSink(app, self),
+		)
+
+###
+
+async def benchmark_generators(app, events=1000, fanout=10, levels=(1, 2, 3)):
+	'''
+	Measure the throughput of (nested) generators with a 1-, 2- and 3-level fan-out.
+	Each level multiplies the number of events by `fanout`.
+	'''
+	results = []
+	for asynchronous in (False, True):
+		for level in levels:
+			pipeline = GeneratorBenchmarkPipeline(app,
+				"GeneratorBenchmark{}{}".format(level, "Async" if asynchronous else ""),
+				levels=level,
+				fanout=fanout,
+				asynchronous=asynchronous,
+			)
+			pipeline.start()
+
+			t0 = app.Loop.time()
+			for i in range(events):
+				await pipeline.process(i)
+			duration = app.Loop.time() - t0
+
+			await pipeline.stop()
+
+			events_out = events * (fanout ** level)
+			results.append({
+				'name': 'generator',
+				'levels': level,
+				'fanout': fanout,
+				'async': asynchronous,
+				'events.in': events,
+				'events.out': events_out,
+				'duration': duration,
+				'eps.in': events / duration if duration > 0 else None,
+				'eps.out': events_out / duration if duration > 0 else None,
+			})
+
+			# Give a chance to other tasks
+			await asyncio.sleep(0)
+
+	return results
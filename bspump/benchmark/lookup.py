@@ -0,0 +1,104 @@
+import os
+import random
+import tempfile
+
+import bspump
+import bspump.lookup
+
+from .synthetic import synthetic_event, measure, BenchmarkPipeline, SyntheticSource, LatencySink
+
+###
+
+class BenchmarkDictionaryLookup(bspump.DictionaryLookup):
+
+	def __init__(self, app, lookup_id, size, config=None):
+		super().__init__(app, lookup_id, config=config)
+		self.Size = size
+
+
+	async def load(self):
+		self.set({"user{}".format(i): {'department': "department{}".format(i % 50), 'level': i % 5} for i in range(self.Size)})
+		return True
+
+
+class DictionaryLookupEnricher(bspump.Processor):
+
+	def __init__(self, app, pipeline, lookup, id=None, config=None):
+		super().__init__(app, pipeline, id=id, config=config)
+		self.Lookup = lookup
+
+
+	def process(self, context, event):
+		event['client']['user'].update(self.Lookup.get(event['client']['user']['name'], {}))
+		return event
+
+
+class IPGeoLookupEnricher(bspump.Processor):
+
+	def __init__(self, app, pipeline, lookup, id=None, config=None):
+		super().__init__(app, pipeline, id=id, config=config)
+		self.Lookup = lookup
+
+
+	def process(self, context, event):
+		event['client']['geo'] = self.Lookup.lookup_location(event['client']['ip'])
+		return event
+
+
+	def process_batch(self, context, events):
+		locations = self.Lookup.lookup_location_many([event['client']['ip'] for event in events])
+		for event, location in zip(events, locations):
+			event['client']['geo'] = location
+		return events
+
+
+def write_ipgeo_database(path, ranges):
+	'''
+	Write a synthetic IPv4 database in the ip2location CSV format, the address space is split to `ranges` ranges.
+	'''
+	rnd = random.Random(0)
+	step = (1 << 32) // ranges
+	with open(path, 'w') as f:
+		for i in range(ranges):
+			start = i * step
+			end = (start + step - 1) if i < (ranges - 1) else (1 << 32) - 1
+			f.write('"{}","{}","C{}","Country {}","Region {}","City {}","{:.5f}","{:.5f}"\n'.format(
+				start, end, i % 250, i % 250, i % 4000, i,
+				rnd.uniform(-90, 90), rnd.uniform(-180, 180),
+			))
+
+###
+
+async def benchmark_lookups(app, events=10000, size=100000, batch_sizes=(0, 1000)):
+	'''
+	Measure the enrichment of events from a `DictionaryLookup` with `size` items
+	and from an `IPGeoLookup` with `size` IP address ranges, events are enriched one by one and in batches.
+	'''
+	results = []
+
+	lookup = BenchmarkDictionaryLookup(app, "BenchmarkDictionaryLookup", size)
+	await lookup.load()
+	pipeline = BenchmarkPipeline(app, "DictionaryLookupBenchmark",
+		lambda app, pipeline: SyntheticSource(app, pipeline, synthetic_event, events),
+		lambda app, pipeline: DictionaryLookupEnricher(app, pipeline, lookup),
+		lambda app, pipeline: LatencySink(app, pipeline, events),
+	)
+	result = await measure(app, pipeline, events)
+	results.append(dict({'name': 'lookup', 'lookup': 'dictionary', 'size': size}, **result))
+
+	with tempfile.TemporaryDirectory() as tmpdir:
+		path = os.path.join(tmpdir, 'ipgeo.csv')
+		write_ipgeo_database(path, size)
+		lookup = bspump.lookup.IPGeoLookup(app, "BenchmarkIPGeoLookup", config={'path': path})
+		await lookup.load()
+
+	for batch_size in batch_sizes:
+		pipeline = BenchmarkPipeline(app, "IPGeoLookupBenchmark-{}".format(batch_size),
+			lambda app, pipeline: SyntheticSource(app, pipeline, synthetic_event, events, batch_size=batch_size),
+			lambda app, pipeline: IPGeoLookupEnricher(app, pipeline, lookup),
+			lambda app, pipeline: LatencySink(app, pipeline, events),
+		)
+		result = await measure(app, pipeline, events)
+		results.append(dict({'name': 'lookup', 'lookup': 'ipgeo', 'size': size, 'batch': batch_size}, **result))
+
+	return results
@@ -0,0 +1,56 @@
+import bspump
+import bspump.common
+
+from .synthetic import synthetic_event, synthetic_json, synthetic_flat_event, measure, BenchmarkPipeline, SyntheticSource, LatencySink
+
+###
+
+class BenchmarkTransformator(bspump.common.MappingTransformator):
+
+	def build(self, app):
+		return {
+			'status': lambda key, value: (key, str(value)),
+			'client.ip': lambda key, value: ('source.ip', value),
+			'server.ip': lambda key, value: ('destination.ip', value),
+			'http.method': lambda key, value: (key, value.lower()),
+		}
+
+###
+
+# Name: (event factory, processor factories)
+Processors = {
+	'json': (synthetic_json, [
+		lambda app, pipeline: bspump.common.JSONParser(app, pipeline),
+	]),
+	'flatten': (synthetic_event, [
+		lambda app, pipeline: bspump.common.FlattenDictProcessor(app, pipeline),
+	]),
+	'transformator': (synthetic_flat_event, [
+		lambda app, pipeline: BenchmarkTransformator(app, pipeline),
+	]),
+	'json+flatten+transformator': (synthetic_json, [
+		lambda app, pipeline: bspump.common.JSONParser(app, pipeline),
+		lambda app, pipeline: bspump.common.FlattenDictProcessor(app, pipeline),
+		lambda app, pipeline: BenchmarkTransformator(app, pipeline),
+	]),
+}
+
+
+async def benchmark_processors(app, events=10000, batch_sizes=(0, 1000)):
+	'''
+	Measure common processors (JSON parser, dictionary flattening, mapping transformator),
+	events are sent one by one and in batches.
+	'''
+	results = []
+	for name, (factory, processors) in Processors.items():
+		for batch_size in batch_sizes:
+			pipeline = BenchmarkPipeline(app, "ProcessorBenchmark-{}-{}".format(name, batch_size),
+				lambda app, pipeline: SyntheticSource(app, pipeline, factory, events, batch_size=batch_size),
+				*processors,
+				lambda app, pipeline: LatencySink(app, pipeline, events)
+			)
+
+			result = await measure(app, pipeline, events)
+			results.append(dict({'name': 'processor', 'processors': name, 'batch': batch_size}, **result))
+
+	return results
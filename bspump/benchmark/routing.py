@@ -0,0 +1,109 @@
+import time
+import itertools
+
+import bspump
+import bspump.common
+from bspump.common.copystrategy import CopyStrategies
+
+from .synthetic import synthetic_event, measure, BenchmarkPipeline, SyntheticSource, LatencySink
+
+###
+
+class BenchmarkRouterSink(bspump.common.RouterSink):
+
+	def __init__(self, app, pipeline, targets, id=None, config=None):
+		super().__init__(app, pipeline, id=id, config=config)
+		self.Targets = targets
+		self.Copy = self.CopyEvent
+		if self.Copy is CopyStrategies['frozen']:
+			# Freeze the event once, it is shared by all targets then
+			self.Copy = CopyStrategies['none']
+
+
+	def process(self, context, event):
+		if self.Copy is not self.CopyEvent:
+			event = self.CopyEvent(event)
+		for target in self.Targets:
+			self.route(context, event, target, copy_event=self.Copy)
+
+
+	def process_batch(self, context, events):
+		if self.Copy is not self.CopyEvent:
+			events = [self.CopyEvent(event) for event in events]
+		for target in self.Targets:
+			self.route_many(context, events, target, copy_event=self.Copy)
+		return []
+
+###
+
+async def benchmark_routing(app, events=10000, fanout=(1, 4), copy_event='deep', batch_sizes=(0, 100)):
+	'''
+	Measure the routing of events thru `InternalSource` from one pipeline to `fanout` target pipelines.
+	Events are routed one by one by `route()` and in batches by `route_many()`.
+	The throughput and the latency are measured at the first target.
+	'''
+	svc = app.get_service("bspump.PumpService")
+
+	results = []
+	for count, batch_size in itertools.product(fanout, batch_sizes):
+		suffix = "{}-{}-{}".format(count, copy_event, batch_size)
+		targets = []
+		for n in range(count):
+			target = BenchmarkPipeline(app, "RoutingBenchmarkTarget{}-{}".format(suffix, n),
+				lambda app, pipeline: bspump.common.InternalSource(app, pipeline, config={
+					'queue_max_size': 1000,
+					'batch_max_size': max(batch_size, 1), # Batches are processed as batches by targets too
+				}),
+				lambda app, pipeline: LatencySink(app, pipeline, events),
+			)
+			svc.add_pipeline(target)
+			targets.append(target)
+
+		pipeline = BenchmarkPipeline(app, "RoutingBenchmark{}".format(suffix),
+			lambda app, pipeline: SyntheticSource(app, pipeline, synthetic_event, events, batch_size=batch_size),
+			lambda app, pipeline: BenchmarkRouterSink(
+				app, pipeline,
+				["{}.*InternalSource".format(target.Id) for target in targets],
+				config={'copy_event': copy_event},
+			),
+		)
+
+		result = await measure(app, targets[0], events, pipelines=[pipeline] + targets[1:])
+		for target in targets:
+			del svc.Pipelines[target.Id]
+
+		results.append(dict({'name': 'routing', 'fanout': count, 'copy': copy_event, 'batch': batch_size}, **result))
+
+	return results
+
+
+async def benchmark_copy(app, events=10000, fanout=4):
+	'''
+	Compare copy strategies of routed events against `copy.deepcopy()`.
+	First, the copy function alone is timed on synthetic events (`speedup` is relative to 'deep'),
+	then the routing to `fanout` target pipelines is measured with each strategy.
+	'''
+	pool = [synthetic_event(i) for i in range(min(events, 1000))]
+
+	durations = {}
+	for name, copy_event in CopyStrategies.items():
+		t0 = time.perf_counter()
+		for i in range(events):
+			copy_event(pool[i % len(pool)])
+		durations[name] = time.perf_counter() - t0
+
+	results = []
+	for name, duration in durations.items():
+		results.append({
+			'name': 'copy',
+			'copy': name,
+			'events.in': events,
+			'duration': duration,
+			'eps.in': events / duration if duration > 0 else None,
+			'speedup': durations['deep'] / duration if duration > 0 else None,
+		})
+
+	for name in CopyStrategies.keys():
+		results.extend(await benchmark_routing(app, events=events, fanout=(fanout,), copy_event=name, batch_sizes=(0,)))
+
+	return results
@@ -0,0 +1,225 @@
+import os
+import sys
+import time
+import json
+import asyncio
+import resource
+
+import bspump
+
+from ..profiler import LatencyHistogram
+
+###
+
+def synthetic_event(i):
+	'''
+	A nested document of about 1 kB, similar to a parsed log record.
+	'''
+	return {
+		'@timestamp': 1546300800000 + i,
+		'id': i,
+		'message': "GET /api/v1/resource/{} HTTP/1.1".format(i % 1000),
+		'status': 200 if i % 10 else 404,
+		'bytes': (i * 7919) % 65536,
+		'client': {
+			'ip': "10.{}.{}.{}".format((i >> 16) & 0xFF, (i >> 8) & 0xFF, i & 0xFF),
+			'port': 1024 + (i % 60000),
+			'user': {
+				'name': "user{}".format(i % 1000),
+				'roles': ['reader', 'writer'] if i % 3 else ['reader'],
+			},
+		},
+		'server': {
+			'host': "server{}.example.com".format(i % 16),
+			'ip': "192.168.0.{}".format(i % 254 + 1),
+			'port': 443,
+		},
+		'http': {
+			'method': 'GET',
+			'version': '1.1',
+			'user_agent': "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko)",
+			'referrer': "https://www.example.com/page/{}".format(i % 100),
+			'headers': {
+				'accept': "application/json",
+				'accept-encoding': "gzip, deflate",
+				'connection': "keep-alive",
+			},
+		},
+	}
+
+
+def synthetic_json(i):
+	return json.dumps(synthetic_event(i)).encode('utf-8')
+
+
+def synthetic_flat_event(i):
+	'''
+	The synthetic event flattened to a dictionary of scalar values, as `FlattenDictProcessor` does.
+	'''
+	flat = {}
+
+	def flatten(prefix, value):
+		if isinstance(value, dict):
+			for k, v in value.items():
+				flatten(k if prefix is None else prefix + '.' + k, v)
+		else:
+			flat[prefix] = value
+
+	flatten(None, synthetic_event(i))
+	return flat
+
+
+def rss():
+	'''
+	Returns the current and the peak resident set size of the process in bytes.
+	The current RSS is available only on Linux, it is None elsewhere.
+	'''
+	try:
+		with open('/proc/self/statm', 'r') as f:
+			current = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+	except (OSError, ValueError, IndexError):
+		current = None
+
+	# Linux reports the maximum RSS in kilobytes, macOS in bytes
+	peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	if sys.platform != 'darwin':
+		peak *= 1024
+
+	# The peak is updated by the kernel lazily
+	if current is not None and current > peak:
+		peak = current
+
+	return current, peak
+
+###
+
+class SyntheticSource(bspump.Source):
+
+	'''
+	Emits `events` events into the pipeline and stops.
+	Events are taken round-robin from a pool of `pool_size` events created upfront by `factory(i)`,
+	so that the cost of the event creation is not measured.
+	The time of emission is stored in the context, so that a `LatencySink` can measure a latency of the pipeline.
+	When `batch_size` is set, events are emitted in batches thru `Pipeline.process_batch()`.
+	'''
+
+	def __init__(self, app, pipeline, factory, events, batch_size=0, pool_size=1000, id=None, config=None):
+		super().__init__(app, pipeline, id=id, config=config)
+		self.Pool = [factory(i) for i in range(min(events, pool_size))]
+		self.Events = events
+		self.BatchSize = batch_size
+		self.Done = asyncio.Future(loop=app.Loop)
+
+
+	async def main(self):
+		pool = self.Pool
+		try:
+			if self.BatchSize > 0:
+				for start in range(0, self.Events, self.BatchSize):
+					await self.Pipeline.ready()
+					events = [pool[i % len(pool)] for i in range(start, min(start + self.BatchSize, self.Events))]
+					await self.Pipeline.process_batch(events, context={'benchmark_t0': time.perf_counter()})
+			else:
+				for i in range(self.Events):
+					await self.Pipeline.ready()
+					await self.Pipeline.process(pool[i % len(pool)], context={'benchmark_t0': time.perf_counter()})
+		finally:
+			if not self.Done.done():
+				self.Done.set_result(self.Events)
+
+
+class LatencySink(bspump.Sink):
+
+	'''
+	A stand-in for real sinks, it counts events and records the latency of the pipeline (see `SyntheticSource`).
+	The `Done` future is resolved when `expected` events arrived.
+	'''
+
+	def __init__(self, app, pipeline, expected, id=None, config=None):
+		super().__init__(app, pipeline, id=id, config=config)
+		self.Expected = expected
+		self.Count = 0
+		self.Histogram = LatencyHistogram()
+		self.Done = asyncio.Future(loop=app.Loop)
+
+
+	def process(self, context, event):
+		self._record(context, 1)
+
+
+	def process_batch(self, context, events):
+		self._record(context, len(events))
+		return []
+
+
+	def _record(self, context, count):
+		t0 = _emitted_at(context)
+		if t0 is not None:
+			self.Histogram.record(time.perf_counter() - t0, count)
+
+		self.Count += count
+		if self.Count >= self.Expected and not self.Done.done():
+			self.Done.set_result(self.Count)
+
+
+def _emitted_at(context):
+	# Routed events have the original context stored under the 'ancestor' key
+	while context is not None:
+		t0 = context.get('benchmark_t0')
+		if t0 is not None:
+			return t0
+		context = context.get('ancestor')
+	return None
+
+
+class BenchmarkPipeline(bspump.Pipeline):
+
+	'''
+	A pipeline built from factories `factory(app, pipeline)` of its source and processors.
+	'''
+
+	def __init__(self, app, pipeline_id, source, *processors):
+		super().__init__(app, pipeline_id)
+		self.build(
+			source(app, self) if source is not None else [],
+			*[processor(app, self) for processor in processors]
+		)
+
+###
+
+async def measure(app, pipeline, events, done=None, pipelines=()):
+	'''
+	Start the pipeline (and other `pipelines`), wait till `done` and stop them.
+	By default, it waits for the `LatencySink` at the end of the pipeline.
+
+	Returns a dictionary with the duration, the throughput and latency percentiles.
+	'''
+	sink = pipeline.Processors[-1][-1]
+	if done is None:
+		done = sink.Done
+
+	t0 = time.perf_counter()
+	for p in pipelines:
+		p.start()
+	pipeline.start()
+	await done
+	duration = time.perf_counter() - t0
+
+	await pipeline.stop()
+	for p in pipelines:
+		await p.stop()
+
+	result = {
+		'events.in': events,
+		'duration': duration,
+		'eps.in': events / duration if duration > 0 else None,
+	}
+
+	if isinstance(sink, LatencySink) and sink.Histogram.Count > 0:
+		result['latency.p50'] = sink.Histogram.percentile(50)
+		result['latency.p99'] = sink.Histogram.percentile(99)
+
+	# Give a chance to other tasks
+	await asyncio.sleep(0)
+
+	return result
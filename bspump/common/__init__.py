@@ -14,3 +14,5 @@ from .iterator import IteratorGenerator
 from .mapping import MappingKeysProcessor, MappingValuesProcessor, MappingItemsProcessor
 from .mapping import MappingKeysGenerator, MappingValuesGenerator, MappingItemsGenerator
 from .transfr import MappingTransformator
+from .offload import OffloadProcessor
+from .copystrategy import FrozenDict, freeze, thaw
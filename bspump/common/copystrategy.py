@@ -0,0 +1,179 @@
+'''
+Copy strategies are used when an event (or its context) is handed over to another pipeline,
+see `InternalSource.put()` and `RouterMixIn.route()`.
+
+'deep' (default)
+	A `copy.deepcopy()` of the event.
+	Always safe, both the producer and the consumer can modify the event freely. It is also the slowest one.
+
+'serialize'
+	A pickle round trip of the event, typically several times faster than `copy.deepcopy()` for JSON-like events.
+	It is as safe as 'deep', but the event has to be picklable.
+
+'shallow'
+	A copy of the top-level container only (e.g. `dict(event)`), nested values are shared.
+	Mappings (such as `EventContext`) are copied into a plain `dict`.
+	It is safe when pipelines only add, replace or remove top-level keys of the event (e.g. flattened events),
+	modification of a nested value is visible in all pipelines.
+
+'frozen'
+	The event is converted into an immutable `FrozenDict` (nested dicts too, lists to tuples, sets to frozensets).
+	Freezing an already frozen event is free, so a frozen event is shared by all targets without further copying.
+	Any attempt to modify the event raises `TypeError`, a consumer can create a modified version
+	by `FrozenDict.set()` (that shares the rest of the event) or get a mutable copy by `thaw()`.
+	Values other than containers are expected to be immutable.
+
+'none'
+	No copy, the same object is shared.
+	It is safe only when neither the producer nor consumers modify the event after routing,
+	or when the event is immutable (bytes, str).
+'''
+
+import copy
+import pickle
+import collections.abc
+
+###
+
+class FrozenDict(dict):
+
+	'''
+	An immutable dictionary, see the 'frozen' copy strategy.
+	It is a `dict` subclass, so it can be serialized by `json` and passes `isinstance(event, dict)` checks.
+	'''
+
+	__slots__ = ()
+
+
+	def __new__(cls, *args, **kwargs):
+		# Items are filled here, so that __init__() cannot be used to modify an existing FrozenDict
+		self = dict.__new__(cls)
+		dict.__init__(self, *args, **kwargs)
+		return self
+
+
+	def __init__(self, *args, **kwargs):
+		pass
+
+
+	def _immutable(self, *args, **kwargs):
+		raise TypeError("'{}' object is immutable, use set() or thaw()".format(self.__class__.__name__))
+
+	__setitem__ = _immutable
+	__delitem__ = _immutable
+	clear = _immutable
+	pop = _immutable
+	popitem = _immutable
+	setdefault = _immutable
+	update = _immutable
+	__ior__ = _immutable
+
+
+	def set(self, key, value):
+		'''
+		Return a new FrozenDict with the `key` set to (frozen) `value`, other values are shared.
+		'''
+		d = dict(self)
+		d[key] = freeze(value)
+		return FrozenDict(d)
+
+
+	def discard(self, key):
+		'''
+		Return a new FrozenDict without the `key`, other values are shared.
+		'''
+		d = dict(self)
+		d.pop(key, None)
+		return FrozenDict(d)
+
+
+	def __copy__(self):
+		return self
+
+
+	def __deepcopy__(self, memo):
+		return self
+
+
+	def __reduce__(self):
+		return (FrozenDict, (dict(self),))
+
+
+	def __repr__(self):
+		return 'FrozenDict({})'.format(dict.__repr__(self))
+
+
+def freeze(obj):
+	'''
+	Return an immutable version of the object, frozen objects are returned as they are.
+	'''
+	cls = obj.__class__
+	if cls is FrozenDict:
+		return obj
+	if cls is dict or isinstance(obj, collections.abc.Mapping):
+		return FrozenDict((k, freeze(v)) for k, v in obj.items())
+	if cls is list or cls is tuple:
+		return tuple(freeze(v) for v in obj)
+	if cls is set:
+		return frozenset(obj)
+	if cls is bytearray:
+		return bytes(obj)
+	return obj
+
+
+def thaw(obj):
+	'''
+	Return a mutable deep copy of the (frozen) object.
+	'''
+	if isinstance(obj, dict):
+		return {k: thaw(v) for k, v in obj.items()}
+	if obj.__class__ is tuple:
+		return [thaw(v) for v in obj]
+	if obj.__class__ is frozenset:
+		return set(obj)
+	return obj
+
+
+def shallow_copy(obj):
+	if obj.__class__ is dict:
+		return dict(obj)
+	if obj.__class__ is list:
+		return list(obj)
+	if isinstance(obj, collections.abc.Mapping):
+		# E.g. an `EventContext`, a snapshot of its current content is taken
+		return dict(obj)
+	return copy.copy(obj)
+
+
+def serialize_copy(obj):
+	return pickle.loads(pickle.dumps(obj, pickle.HIGHEST_PROTOCOL))
+
+
+def no_copy(obj):
+	return obj
+
+
+CopyStrategies = {
+	'deep': copy.deepcopy,
+	'serialize': serialize_copy,
+	'shallow': shallow_copy,
+	'frozen': freeze,
+	'none': no_copy,
+}
+
+
+def get_copy_strategy(strategy):
+	'''
+	Resolve the strategy name (see `CopyStrategies`) into a copy function.
+	For a backward compatibility, True means 'deep' and False means 'none', a callable is returned as it is.
+	'''
+	if strategy is True:
+		return copy.deepcopy
+	if strategy is False or strategy is None:
+		return no_copy
+	if callable(strategy):
+		return strategy
+	try:
+		return CopyStrategies[strategy]
+	except KeyError:
+		raise ValueError("Unknown copy strategy '{}', use one of {}".format(strategy, ', '.join(CopyStrategies.keys())))
@@ -3,5 +3,10 @@ from ..abc.processor import Processor
 
 class JSONParser(Processor):
 
+	BatchRetry = True
+
 	def process(self, context, event):
 		return json.loads(event)
+
+	def process_batch(self, context, events):
+		return [json.loads(event) for event in events]
@@ -4,3 +4,6 @@ class NullSink(Sink):
 
 	def process(self, context, event):
 		pass
+
+	def process_batch(self, context, events):
+		return []
@@ -0,0 +1,150 @@
+import os
+import sys
+import copy
+import pickle
+import logging
+import concurrent.futures
+
+from ..abc.asyncprocessor import AsyncProcessor
+from ..abc.generator import Generator
+from ..abc.sink import Sink
+
+#
+
+L = logging.getLogger(__name__)
+
+#
+
+class OffloadProcessor(AsyncProcessor):
+
+	'''
+Runs the `process()` of a wrapped CPU-heavy processor outside of the event loop,
+in threads of the `asab.ProactorService` or in a pool of worker processes.
+
+class MyPipeline(bspump.Pipeline):
+
+	def __init__(self, app, pipeline_id):
+		super().__init__(app, pipeline_id)
+		self.build(
+			bspump.file.FileLineSource(app, self),
+			bspump.common.OffloadProcessor(app, self,
+				bspump.common.JSONParser(app, self),
+				config={'executor': 'process'}
+			),
+			bspump.common.NullSink(app, self),
+		)
+
+The event is handed over to the executor and it continues down the pipeline when the wrapped processor finishes.
+It is an `AsyncProcessor`, so `concurrency` and `ordered` options apply, a batch is offloaded as a single task.
+
+The 'thread' executor calls the wrapped processor concurrently from more threads, so it has to be thread-safe.
+It helps processors that release the GIL (hashing, encryption, compression).
+The 'process' executor sends a copy of the wrapped processor to worker processes once, then events and the context are pickled.
+The wrapped processor has to be picklable, it is checked when the `OffloadProcessor` is created.
+The 'process' executor requires Python 3.7 or newer (an initializer of the process pool).
+The wrapped processor has no `Pipeline` there and changes of the context made in the worker process are lost.
+The pool of worker processes is shut down when the application exits.
+	'''
+
+	ConfigDefaults = {
+		'executor': 'thread', # 'thread' (asab.ProactorService) or 'process'
+		'workers': 0, # Number of worker processes of the 'process' executor, 0 means the number of CPUs
+		'concurrency': 100, # Maximum number of events that are processed at once
+	}
+
+
+	def __init__(self, app, pipeline, processor, id=None, config=None):
+		if isinstance(processor, (Generator, Sink)):
+			raise TypeError("Only a processor can be offloaded, not '{}'".format(processor.__class__.__name__))
+
+		super().__init__(app, pipeline, id=id if id is not None else "Offload{}".format(processor.Id), config=config)
+		self.Processor = processor
+
+		self.Executor = self.Config['executor']
+		if self.Executor == 'thread':
+			self._executor = app.get_service("asab.ProactorService").Executor
+			self._process = processor.process
+			self._process_batch = processor.process_batch
+		elif self.Executor == 'process':
+			if sys.version_info < (3, 7):
+				raise RuntimeError("The 'process' executor of '{}' requires Python 3.7 or newer".format(self.Id))
+			self._executor = None # Created lazily, see _create_process_pool()
+			self._offloaded = self._prepare_offloaded(processor)
+			self._process = _offload_process
+			self._process_batch = _offload_process_batch
+			app.PubSub.subscribe("Application.exit!", self._on_exit)
+		else:
+			raise RuntimeError("Unknown executor '{}' of '{}'".format(self.Executor, self.Id))
+
+
+	async def process(self, context, event):
+		if self._executor is None:
+			self._executor = self._create_process_pool()
+		if self.Executor == 'process':
+			context = dict(context)
+		return await self.Loop.run_in_executor(self._executor, self._process, context, event)
+
+
+	async def process_batch(self, context, events):
+		if self._executor is None:
+			self._executor = self._create_process_pool()
+		if self.Executor == 'process':
+			context = dict(context)
+		return await self.Loop.run_in_executor(self._executor, self._process_batch, context, events)
+
+
+	def _prepare_offloaded(self, processor):
+		# The pipeline is not transferable to other processes
+		processor = copy.copy(processor)
+		processor.Pipeline = None
+
+		try:
+			pickle.dumps(processor, pickle.HIGHEST_PROTOCOL)
+		except Exception as e:
+			raise TypeError("Processor '{}' cannot be offloaded to the 'process' executor of '{}', it is not picklable: {}".format(
+				processor.Id, self.Id, e
+			)) from e
+
+		return processor
+
+
+	def _create_process_pool(self):
+		workers = int(self.Config['workers'])
+		if workers <= 0:
+			workers = os.cpu_count() or 1
+
+		return concurrent.futures.ProcessPoolExecutor(
+			max_workers=workers,
+			initializer=_offload_initializer,
+			initargs=(self._offloaded,),
+		)
+
+
+	def _on_exit(self, event_name):
+		# Worker processes of the pool would outlive the application otherwise
+		if self._executor is not None:
+			self._executor.shutdown(wait=False)
+
+
+	def rest_get(self):
+		rest = super().rest_get()
+		rest['Processor'] = self.Processor.rest_get()
+		rest['Executor'] = self.Executor
+		return rest
+
+#
+
+_offloaded_processor = None
+
+
+def _offload_initializer(processor):
+	global _offloaded_processor
+	_offloaded_processor = processor
+
+
+def _offload_process(context, event):
+	return _offloaded_processor.process(context, event)
+
+
+def _offload_process_batch(context, events):
+	return _offloaded_processor.process_batch(context, events)
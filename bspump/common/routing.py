@@ -1,9 +1,10 @@
 import logging
 import asyncio
-import copy
 from ..abc.source import Source
 from ..abc.sink import Sink
 from ..abc.processor import Processor
+from .copystrategy import get_copy_strategy
+from .spill import SpillQueue
 
 #
 
@@ -13,10 +14,38 @@ L = logging.getLogger(__name__)
 
 class InternalSource(Source):
 
+	'''
+	A source that receives events from other pipelines thru `put()`, see `RouterMixIn`.
+
+	If `spill_path` is set, the queue is spilled to segment files in that directory (see `bspump.common.spill.SpillQueue`)
+	once it reaches the backpressure limit, instead of throttling the producers.
+	Spilled events are processed in order after the in-memory queue and they survive a restart of the application,
+	events that remain in the in-memory queue are stored to the disk when the source is stopped.
+	The backpressure is then applied only when the spill grows over `spill_max_size` bytes.
+	Contexts and events must be picklable and each InternalSource needs its own `spill_path`.
+
+	The flow control uses two watermarks: the backpressure (that throttles routers) is applied when the queue
+	fills over `backpressure` and it is released only when the queue drains under `backpressure_low`.
+	Between the watermarks, routers are paced, i.e. they sleep up to `pace_max` seconds each time slice,
+	the delay grows with the queue fill. See `Pipeline.throttle()` and `Pipeline.pace()`.
+
+	Batching is opt-in: when `batch_max_size` is greater than 1, consecutive queued events with equal contexts
+	are processed as one batch by `Pipeline.process_batch()`, so they share a single context in the pipeline.
+	Enable it only for pipelines whose processors don't store per-event data in the context.
+	'''
+
+	PaceSteps = 4 # Number of pace levels between watermarks, each change is published
 
 	ConfigDefaults = {
-		'queue_max_size': 10, # 0 means unlimited size
-		'backpressure': 0.8, # Percentage of the queue that will result in a backpressure
+		'queue_max_size': 1000, # 0 means unlimited size
+		'backpressure': 0.8, # Percentage of the queue that will result in a backpressure (the high watermark)
+		'backpressure_low': 0.5, # Percentage of the queue that will release the backpressure (the low watermark)
+		'pace_max': 0.005, # In seconds, the maximum delay of routers between watermarks, 0 disables pacing
+		'copy_context': 'deep', # Copy strategy of the context in put(), see bspump.common.copystrategy
+		'batch_max_size': 1, # Maximum number of queued events processed at once as a batch that shares one context, 0 means unlimited
+		'spill_path': '', # Directory for spilling the queue to a disk, empty means no spilling
+		'spill_segment_size': 64*1024*1024, # Size of spill segment files in bytes
+		'spill_max_size': 0, # Size of the spill in bytes that results in a backpressure, 0 means unlimited
 	}
 
 
@@ -25,34 +54,149 @@ class InternalSource(Source):
 		self.Loop = app.Loop 
 
 		self.BackPressure = False
+		if float(self.Config['backpressure_low']) >= float(self.Config['backpressure']):
+			raise ValueError("The 'backpressure_low' of '{}' must be lower than the 'backpressure'".format(self.locate_address()))
+
 		maxsize = int(self.Config.get('queue_max_size'))
 		if maxsize == 0:
 			maxsize = None
 			self.BackPressureLimit = None
+			self.BackPressureLowLimit = None
 		else:
 			if maxsize == 1: maxsize = 2 # Special case
 			self.BackPressureLimit = maxsize * float(self.Config.get('backpressure'))
 			if self.BackPressureLimit == maxsize:
 				self.BackPressureLimit -= 1
 			assert(self.BackPressureLimit > 0)
+			self.BackPressureLowLimit = min(maxsize * float(self.Config.get('backpressure_low')), self.BackPressureLimit)
 		self.Queue = asyncio.Queue(maxsize=maxsize, loop=self.Loop)
+		self.CopyContext = get_copy_strategy(self.Config['copy_context'])
+
+		self.BatchMaxSize = int(self.Config['batch_max_size'])
+		if self.BatchMaxSize <= 0:
+			self.BatchMaxSize = float('inf')
+		if (type(self).process is not Source.process) and (type(self).process_batch is InternalSource.process_batch):
+			# The subclass customizes the processing of individual events, keep it working
+			self.BatchMaxSize = 1
+
+		spill_path = self.Config['spill_path']
+		if len(spill_path) > 0:
+			self.Spill = SpillQueue(spill_path, segment_size=int(self.Config['spill_segment_size']))
+			if self.Spill.Size > 0:
+				L.info("'{}' continues with {} bytes of spilled events".format(self.locate_address(), self.Spill.Size))
+
+			# Watermarks apply to the size of the spill
+			spill_max_size = int(self.Config['spill_max_size'])
+			if spill_max_size > 0:
+				self._high_watermark = spill_max_size
+				self._low_watermark = spill_max_size * float(self.Config['backpressure_low']) / float(self.Config['backpressure'])
+			else:
+				self._high_watermark = None
+				self._low_watermark = None
+		else:
+			self.Spill = None
+			self._high_watermark = self.BackPressureLimit
+			self._low_watermark = self.BackPressureLowLimit
+
+		self.PaceMax = float(self.Config['pace_max'])
+		self.Pace = 0.0
+		self._pace_level = 0
+
+
+	def _enqueue(self, item):
+		if (self.Spill is not None) and ((self.Spill.Size > 0) or ((self.BackPressureLimit is not None) and (self.BackPressureLimit <= self.Queue.qsize()))):
+			# Once spilling, all events go to the spill until it is drained to keep the order
+			self.Spill.put(item)
+		else:
+			self.Queue.put_nowait(item)
+
+
+	def _fill(self):
+		if self.Spill is not None:
+			return self.Spill.Size
+		return self.Queue.qsize()
+
+
+	def _check_backpressure_on(self):
+		if self._high_watermark is None:
+			return
+		fill = self._fill()
+		if (not self.BackPressure) and (self._high_watermark <= fill):
+			self.BackPressure = True
+			self.Pipeline.PubSub.publish("bspump.InternalSource.backpressure_on!", source=self)
+		self._update_pace(fill)
+
+
+	def _check_backpressure_off(self):
+		if self._high_watermark is None:
+			return
+		fill = self._fill()
+		if self.BackPressure and (self._low_watermark >= fill):
+			self.BackPressure = False
+			self.Pipeline.PubSub.publish("bspump.InternalSource.backpressure_off!", source=self)
+		self._update_pace(fill)
+
+
+	def _update_pace(self, fill):
+		if self.PaceMax <= 0:
+			return
+
+		if fill <= self._low_watermark:
+			level = 0
+		elif self._high_watermark <= self._low_watermark:
+			level = self.PaceSteps
+		else:
+			level = min(self.PaceSteps, int(self.PaceSteps * (fill - self._low_watermark) / (self._high_watermark - self._low_watermark)) + 1)
+
+		if level != self._pace_level:
+			self._pace_level = level
+			self.Pace = self.PaceMax * level / self.PaceSteps
+			self.Pipeline.PubSub.publish("bspump.InternalSource.pace!", source=self)
 
 
 	def put(self, context, event, copy_event=True):
 		'''
 		Context can be an empty dictionary if is not provided
+
+		The `copy_event` is a copy strategy of the event: 'deep', 'serialize', 'shallow', 'frozen' or 'none'
+		(see `bspump.common.copystrategy` for their safety), True means 'deep' and False means 'none'.
 		'''
-		if copy_event:
-			event = copy.deepcopy(event)
+		event = get_copy_strategy(copy_event)(event)
 
-		self.Queue.put_nowait((
-			copy.deepcopy(context),
+		self._enqueue((
+			self.CopyContext(context),
 			event
 		))
 
-		if (not self.BackPressure) and (self.BackPressureLimit is not None) and (self.BackPressureLimit <= self.Queue.qsize()):
-			self.BackPressure = True
-			self.Pipeline.PubSub.publish("bspump.InternalSource.backpressure_on!", source=self)
+		self._check_backpressure_on()
+
+
+	def put_many(self, context, events, copy_event=True):
+		'''
+		Put a list of events that share the same context into the queue.
+		The context is copied only once and the backpressure is evaluated once for the whole list.
+		Events are then delivered to the pipeline in batches if `batch_max_size` allows it.
+
+		If there is no spill, `asyncio.QueueFull` is raised before any event is queued when the queue
+		has no space for all events. With a spill, events over the backpressure limit are spilled.
+
+		The `copy_event` is a copy strategy of events, see `put()`.
+		'''
+		if (self.Spill is None) and self.Queue.maxsize and (len(events) > self.Queue.maxsize - self.Queue.qsize()):
+			raise asyncio.QueueFull()
+
+		copy_event = get_copy_strategy(copy_event)
+		context = self.CopyContext(context)
+
+		if self.Spill is None:
+			put_nowait = self.Queue.put_nowait
+			for event in events:
+				put_nowait((context, copy_event(event)))
+		else:
+			for event in events:
+				self._enqueue((context, copy_event(event)))
+
+		self._check_backpressure_on()
 
 
 	async def put_async(self, context, event, copy_event=False):
@@ -63,44 +207,112 @@ class InternalSource(Source):
 		It is designed to handle situation when the queue is becoming full.
 
 		Context can be an empty dictionary if is not provided.
+		The `copy_event` is a copy strategy of the event, see `put()`.
 		'''
-		if copy_event:
-			event = copy.deepcopy(event)
+		event = get_copy_strategy(copy_event)(event)
 
-		await self.Queue.put((
-			copy.deepcopy(context),
-			event
-		))
+		if self.Spill is None:
+			await self.Queue.put((
+				self.CopyContext(context),
+				event
+			))
+		else:
+			self._enqueue((
+				self.CopyContext(context),
+				event
+			))
 
-		if (not self.BackPressure) and (self.BackPressureLimit is not None) and (self.BackPressureLimit <= self.Queue.qsize()):
-			self.BackPressure = True
-			self.Pipeline.PubSub.publish("bspump.InternalSource.backpressure_on!", source=self)
+		self._check_backpressure_on()
 
 
 	async def main(self):
+		pending = None
 		try:
 
 			while True:
 				await self.Pipeline.ready()
-				context, event = await self.Queue.get()
+				if pending is not None:
+					context, event = pending
+					pending = None
+				elif (self.Spill is not None) and (self.Spill.Size > 0) and self.Queue.empty():
+					# Spilled events are newer than events in the in-memory queue
+					await self._process_spill()
+					continue
+				else:
+					context, event = await self.Queue.get()
+
+				# Events that are already in the queue and share the same context are processed as a batch
+				events = [event]
+				while (len(events) < self.BatchMaxSize) and (not self.Queue.empty()):
+					item = self.Queue.get_nowait()
+					if (item[0] is not context) and (item[0] != context):
+						pending = item
+						break
+					events.append(item[1])
+
+				self._check_backpressure_off()
+
+				if len(events) == 1:
+					await self.process(event, context={'ancestor':context})
+				else:
+					await self.process_batch(events, context={'ancestor':context})
+
+				for _ in range(len(events)):
+					self.Queue.task_done()
+
+		except asyncio.CancelledError:
+			items = [pending] if pending is not None else []
+			while not self.Queue.empty():
+				items.append(self.Queue.get_nowait())
+				self.Queue.task_done()
 
-				if (self.BackPressure) and (self.BackPressureLimit is not None) and (self.BackPressureLimit > self.Queue.qsize()):
-					self.BackPressure = False
-					self.Pipeline.PubSub.publish("bspump.InternalSource.backpressure_off!", source=self)
+			if self.Spill is not None:
+				# Spilled events that were read but not processed are rewound in front of the spill, after queued events
+				self.Spill.prepend(items)
+				self.Spill.flush()
+				if self.Spill.Size > 0:
+					L.info("'{}' stopped with {} bytes of events spilled in '{}'".format(
+						self.locate_address(), self.Spill.Size, self.Spill.Path
+					))
+			elif len(items) > 0:
+				L.warning("'{}' stopped with {} events in a queue".format(self.locate_address(), len(items)))
 
-				await self.process(event, context={'ancestor':context})
 
-				self.Queue.task_done()
+	async def _process_spill(self):
+		items = self.Spill.get(max(self.BatchMaxSize, 1000) if self.BatchMaxSize != float('inf') else 1000)
+		self._check_backpressure_off()
 
-		except asyncio.CancelledError:
-			if self.Queue.qsize() > 0:
-				L.warning("'{}' stopped with {} events in a queue".format(self.locate_address(), self.Queue.qsize()))
+		# Consecutive events with the same context are processed as a batch
+		start = 0
+		while start < len(items):
+			context = items[start][0]
+			end = start + 1
+			while (end < len(items)) and (end - start < self.BatchMaxSize) and (items[end][0] == context):
+				end += 1
+
+			if end - start == 1:
+				await self.process(items[start][1], context={'ancestor':context})
+			else:
+				await self.process_batch([item[1] for item in items[start:end]], context={'ancestor':context})
+			start = end
+
+		self.Spill.commit()
+
+
+	async def process_batch(self, events, context=None):
+		'''
+		Emit a batch of queued events into the pipeline, see `Pipeline.process_batch()`.
+		'''
+		await self.Pipeline.process_batch(events, context=context)
 
 
 	def rest_get(self):
 		rest = super().rest_get()
 		rest['Queue'] = self.Queue.qsize()
 		rest['BackPressure'] = self.BackPressure
+		rest['Pace'] = self.Pace
+		if self.Spill is not None:
+			rest['Spill'] = self.Spill.Size
 		return rest
 
 #
@@ -108,9 +320,15 @@ class InternalSource(Source):
 class RouterMixIn(object):
 
 
+	ConfigDefaults = {
+		'copy_event': 'deep', # Default copy strategy of routed events, see bspump.common.copystrategy
+	}
+
+
 	def _mixin_init(self, app):
 		self.ServiceBSPump = app.get_service("bspump.PumpService")
 		self.SourcesCache = {}
+		self.CopyEvent = get_copy_strategy(self.Config['copy_event'])
 
 
 	def locate(self, source_id):
@@ -133,6 +351,9 @@ class RouterMixIn(object):
 		if source.BackPressure:
 			self.Pipeline.throttle(source, enable=True)
 
+		source.Pipeline.PubSub.subscribe("bspump.InternalSource.pace!", self._on_internal_source_pace)
+		self.Pipeline.pace(source, getattr(source, 'Pace', 0))
+
 		return source
 
 
@@ -159,6 +380,9 @@ class RouterMixIn(object):
 		if source.BackPressure:
 			self.Pipeline.throttle(source, enable=False)
 
+		source.Pipeline.PubSub.unsubscribe("bspump.InternalSource.pace!", self._on_internal_source_pace)
+		self.Pipeline.pace(source, 0)
+
 
 
 	def dispatch(self, context, event, source_id, copy_event=True):
@@ -166,18 +390,34 @@ class RouterMixIn(object):
 		return self.route(context, event, source_id, copy_event=True)
 
 
-	def route(self, context, event, source_id, copy_event=True):
+	def route(self, context, event, source_id, copy_event=None):
 		'''
 		This method routes an event to a InternalSource `source_id`.
 
 		It can be called multiple times from a process() method, which results in a cloning of the event. 
+		The `copy_event` specifies a copy strategy for this route (see `InternalSource.put()`),
+		if it is None, the strategy from the `copy_event` configuration option is used.
 		'''
 		source = self.SourcesCache.get(source_id)
 		
 		if source is None:
 			source = self.locate(source_id)
 
-		source.put(context, event, copy_event=copy_event)
+		source.put(context, event, copy_event=self.CopyEvent if copy_event is None else copy_event)
+
+
+	def route_many(self, context, events, source_id, copy_event=None):
+		'''
+		This method routes a list of events that share the same context to a InternalSource `source_id`,
+		see `InternalSource.put_many()`. It is meant to be called from a process_batch() method.
+		`asyncio.QueueFull` is raised and no event is routed if the source has no space for all events.
+		'''
+		source = self.SourcesCache.get(source_id)
+
+		if source is None:
+			source = self.locate(source_id)
+
+		source.put_many(context, events, copy_event=self.CopyEvent if copy_event is None else copy_event)
 
 
 	def _on_target_pipeline_ready_change(self, event_name, pipeline):
@@ -198,6 +438,11 @@ class RouterMixIn(object):
 			L.warning("Unknown event '{}' received in _on_internal_source_backpressure_ready_change in '{}'".format(event_name, self))
 
 
+	def _on_internal_source_pace(self, event_name, source):
+		if source in self.SourcesCache.values():
+			self.Pipeline.pace(source, source.Pace)
+
+
 class RouterSink(Sink, RouterMixIn):
 
 	'''
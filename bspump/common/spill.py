@@ -0,0 +1,230 @@
+import os
+import mmap
+import pickle
+import struct
+import logging
+
+#
+
+L = logging.getLogger(__name__)
+
+#
+
+class SpillQueue(object):
+
+	'''
+A persistent FIFO queue of picklable items, it is used by `InternalSource` to spill its queue to a disk.
+
+Items are appended to segment files in the `path` directory, a segment is closed when it grows over `segment_size` bytes.
+Each record is a 4-byte little-endian length followed by the pickled item.
+Segments are read thru a memory map, a segment is deleted once it is completely consumed and committed.
+
+The read cursor is separate from the committed position, which is stored in the `offset` file.
+`commit()` moves the committed position to the read cursor once the read items are processed,
+items that were read but not committed are read again after `rewind()` or a restart (at-least-once delivery).
+	'''
+
+	_Length = struct.Struct('<I')
+	_Offset = struct.Struct('<QQ')
+
+
+	def __init__(self, path, segment_size=64*1024*1024):
+		self.Path = path
+		self.SegmentSize = segment_size
+		os.makedirs(self.Path, exist_ok=True)
+
+		segments = sorted(
+			int(name[:-4]) for name in os.listdir(self.Path)
+			if name.endswith('.seg') and name[:-4].isdigit()
+		)
+
+		self._offset_fd = os.open(os.path.join(self.Path, 'offset'), os.O_RDWR | os.O_CREAT, 0o644)
+		data = os.pread(self._offset_fd, self._Offset.size, 0)
+		if len(data) == self._Offset.size:
+			self._read_seq, self._read_pos = self._Offset.unpack(data)
+		else:
+			self._read_seq, self._read_pos = (segments[0] if len(segments) > 0 else 0), 0
+
+		# Remove segments that were consumed before the restart
+		for seq in segments:
+			if seq < self._read_seq:
+				os.unlink(self._segment_path(seq))
+		segments = [seq for seq in segments if seq >= self._read_seq]
+		if len(segments) > 0 and segments[0] != self._read_seq:
+			self._read_seq, self._read_pos = segments[0], 0
+		self._commit_seq, self._commit_pos = self._read_seq, self._read_pos
+
+		# New items always go to a new segment, so a record truncated by a crash can only be at the end of a closed segment
+		self._write_seq = (segments[-1] + 1) if len(segments) > 0 else self._read_seq
+		self._writer = open(self._segment_path(self._write_seq), 'ab')
+
+		self._mmap = None
+		self._mmap_seq = None
+		self._consumed = []
+		self._uncommitted = 0 # Number of bytes between the committed position and the read cursor
+
+		# Number of bytes that are stored and not read yet
+		self.Size = sum(os.path.getsize(self._segment_path(seq)) for seq in segments) - self._read_pos
+		if self.Size < 0:
+			L.warning("Invalid offset in '{}', reading from the start of the segment".format(self.Path))
+			self.Size += self._read_pos
+			self._read_pos = 0
+			self._commit_pos = 0
+
+
+	def _segment_path(self, seq):
+		return os.path.join(self.Path, "{:016d}.seg".format(seq))
+
+
+	def put(self, item):
+		data = pickle.dumps(item, pickle.HIGHEST_PROTOCOL)
+		self._writer.write(self._Length.pack(len(data)))
+		self._writer.write(data)
+		self.Size += self._Length.size + len(data)
+
+		if self._writer.tell() >= self.SegmentSize:
+			self._writer.close()
+			self._write_seq += 1
+			self._writer = open(self._segment_path(self._write_seq), 'ab')
+
+
+	def get(self, max_count):
+		'''
+		Read up to `max_count` items in the order they were put, call `commit()` once they are processed
+		or `rewind()` if they are not going to be processed.
+		'''
+		items = []
+		while (len(items) < max_count) and (self.Size > 0):
+			mm = self._mmap
+			if (mm is None) or (self._mmap_seq != self._read_seq) or (self._read_pos >= len(mm)):
+				mm = self._map()
+				if mm is None:
+					if self._read_seq == self._write_seq:
+						break
+					# The segment is exhausted, continue with the next one
+					self._next_segment()
+					continue
+
+			pos = self._read_pos + self._Length.size
+			end = pos
+			if end <= len(mm):
+				end += self._Length.unpack_from(mm, self._read_pos)[0]
+
+			if end > len(mm):
+				L.warning("Truncated record in '{}', skipping {} bytes".format(self._segment_path(self._read_seq), len(mm) - self._read_pos))
+				self.Size -= len(mm) - self._read_pos
+				self._uncommitted += len(mm) - self._read_pos
+				self._next_segment()
+				continue
+
+			items.append(pickle.loads(mm[pos:end]))
+			self.Size -= end - self._read_pos
+			self._uncommitted += end - self._read_pos
+			self._read_pos = end
+
+		return items
+
+
+	def _next_segment(self):
+		self._consumed.append(self._read_seq)
+		self._read_seq += 1
+		self._read_pos = 0
+
+
+	def _map(self):
+		if self._mmap is not None:
+			self._mmap.close()
+			self._mmap = None
+
+		if self._read_seq == self._write_seq:
+			self._writer.flush()
+
+		with open(self._segment_path(self._read_seq), 'rb') as f:
+			size = os.fstat(f.fileno()).st_size
+			if size <= self._read_pos:
+				return None
+			self._mmap = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+
+		self._mmap_seq = self._read_seq
+		return self._mmap
+
+
+	def commit(self):
+		'''
+		Move the committed position to the read cursor, persist it and delete consumed segments.
+		Call it only after items returned by `get()` are processed.
+		'''
+		self._commit_seq, self._commit_pos = self._read_seq, self._read_pos
+		self._uncommitted = 0
+		self._store_offset()
+
+		for seq in self._consumed:
+			try:
+				os.unlink(self._segment_path(seq))
+			except FileNotFoundError:
+				pass
+		self._consumed = []
+
+
+	def rewind(self):
+		'''
+		Move the read cursor back to the committed position, items that were read but not committed are read again.
+		'''
+		self._read_seq, self._read_pos = self._commit_seq, self._commit_pos
+		self.Size += self._uncommitted
+		self._uncommitted = 0
+		self._consumed = []
+
+
+	def _store_offset(self):
+		os.pwrite(self._offset_fd, self._Offset.pack(self._commit_seq, self._commit_pos), 0)
+
+
+	def prepend(self, items):
+		'''
+		Store `items` in front of the uncommitted content, it is used to persist in-memory items when the source is stopped.
+		Items that were read but not committed are rewound first, so they are kept after `items`.
+		The uncommitted rest of the current segment is rewritten together with items.
+		'''
+		self.rewind()
+		if len(items) == 0:
+			return
+
+		if self._mmap is not None:
+			self._mmap.close()
+			self._mmap = None
+
+		if self._read_seq == self._write_seq:
+			self._writer.close()
+
+		path = self._segment_path(self._read_seq)
+		with open(path + '.tmp', 'wb') as fo:
+			for item in items:
+				data = pickle.dumps(item, pickle.HIGHEST_PROTOCOL)
+				fo.write(self._Length.pack(len(data)))
+				fo.write(data)
+				self.Size += self._Length.size + len(data)
+
+			with open(path, 'rb') as fi:
+				fi.seek(self._read_pos)
+				while True:
+					chunk = fi.read(1024*1024)
+					if len(chunk) == 0:
+						break
+					fo.write(chunk)
+
+		os.replace(path + '.tmp', path)
+		self._read_pos = 0
+		self._commit_pos = 0
+		self._store_offset()
+
+		if self._read_seq == self._write_seq:
+			self._writer = open(path, 'ab')
+
+
+	def flush(self):
+		'''
+		Flush written items and persist the committed position, uncommitted items are read again after a restart.
+		'''
+		self._writer.flush()
+		self._store_offset()
@@ -1,5 +1,6 @@
 import logging
 from .routing import InternalSource, RouterProcessor
+from .copystrategy import freeze
 #
 
 L = logging.getLogger(__name__)
@@ -101,6 +102,21 @@ class TeeProcessor(RouterProcessor):
 
 
 	def process(self, context, event):
+		routed = event
+		if self.CopyEvent is freeze:
+			# The event is frozen only once and then it is shared by all targets
+			routed = freeze(event)
+
 		for source in self.Targets:
-			self.route(context, event, source)
+			self.route(context, routed, source)
 		return event
+
+
+	def process_batch(self, context, events):
+		routed = events
+		if self.CopyEvent is freeze:
+			routed = [freeze(event) for event in events]
+
+		for source in self.Targets:
+			self.route_many(context, routed, source)
+		return events
@@ -0,0 +1,123 @@
+import copy
+import collections.abc
+
+#
+
+class _Deleted(object):
+
+	def __repr__(self):
+		return '<deleted>'
+
+_DELETED = _Deleted()
+
+#
+
+class EventContext(collections.abc.MutableMapping):
+
+	'''
+A copy-on-write context of an event.
+
+The context is a layered, dictionary-like view over its parent context (a dictionary or another `EventContext`).
+Reads fall through to the parent, writes and deletes are stored in a local layer,
+which is allocated only when a processor writes to the context for a first time.
+The parent is never modified thru the view.
+
+	context = bspump.EventContext({'a': 1})
+	context['b'] = 2          # {'a': 1, 'b': 2}, the parent remains {'a': 1}
+	child = context.fork()    # A cheap child view, no data is copied
+	snapshot = context.copy() # An independent snapshot, as `dict.copy()`
+
+The parent should not be modified while the child view is in use, the change would be visible thru the view.
+A deep copy of the context produces a plain dictionary.
+	'''
+
+	__slots__ = ('Parent', '_local')
+
+
+	def __init__(self, parent=None):
+		self.Parent = parent
+		self._local = None
+
+
+	def __getitem__(self, key):
+		local = self._local
+		if local is not None and key in local:
+			value = local[key]
+			if value is _DELETED:
+				raise KeyError(key)
+			return value
+
+		if self.Parent is None:
+			raise KeyError(key)
+
+		return self.Parent[key]
+
+
+	def __setitem__(self, key, value):
+		if self._local is None:
+			self._local = {}
+		self._local[key] = value
+
+
+	def __delitem__(self, key):
+		self[key] # Raises KeyError if the key is not present
+		if self._local is None:
+			self._local = {}
+		self._local[key] = _DELETED
+
+
+	def __iter__(self):
+		local = self._local
+		if local is not None:
+			for key, value in local.items():
+				if value is not _DELETED:
+					yield key
+
+		if self.Parent is not None:
+			for key in self.Parent:
+				if local is None or key not in local:
+					yield key
+
+
+	def __len__(self):
+		if self._local is None:
+			return 0 if self.Parent is None else len(self.Parent)
+		return sum(1 for _ in self)
+
+
+	def __contains__(self, key):
+		local = self._local
+		if local is not None and key in local:
+			return local[key] is not _DELETED
+		return self.Parent is not None and key in self.Parent
+
+
+	def copy(self):
+		'''
+		Returns a shallow snapshot of the context, later changes of this context or its parents are not visible in it.
+		'''
+		return EventContext(dict(self))
+
+
+	def fork(self):
+		'''
+		Returns a child view, it is O(1) and doesn't copy any data, but it reflects later changes of this context.
+		'''
+		return EventContext(self)
+
+
+	def __copy__(self):
+		return self.copy()
+
+
+	def __deepcopy__(self, memo):
+		return copy.deepcopy(dict(self), memo)
+
+
+	def __reduce__(self):
+		# The context is pickled as a plain dictionary, e.g. when it is sent to another process
+		return (dict, (dict(self),))
+
+
+	def __repr__(self):
+		return '%s(%r)' % (self.__class__.__name__, dict(self))
@@ -0,0 +1,135 @@
+import asyncio
+import logging
+import time
+
+#
+
+L = logging.getLogger(__name__)
+
+#
+
+class DeadLetter(object):
+
+	'''
+The error policy of a pipeline that routes events, which failed in a processor, to a dead-letter `InternalSource`
+instead of stopping the whole pipeline. It is enabled by the `error_policy` option of the pipeline:
+
+[pipeline:KafkaPipeline]
+error_policy=dead_letter
+dead_letter=DeadLetterPipeline.*InternalSource
+
+The dead-letter pipeline receives the original context and an event like this one:
+
+{
+	'@timestamp': 1546300800.0,
+	'pipeline': 'KafkaPipeline',
+	'processor': 'JSONParser',
+	'exception': 'JSONDecodeError',
+	'error': 'Expecting value: line 1 column 1 (char 0)',
+	'event': b'{malformed',
+}
+
+The event is not copied, so it is in the state in which the processor failed.
+If the `dead_letter` is empty, failing events are only counted and dropped.
+
+The pipeline is stopped (as with the 'stop' policy) when errors of a single processor exceed
+the `dead_letter_error_rate` ratio of events that entered the pipeline in the current metrics period,
+once there is at least `dead_letter_min_errors` of them. It is stopped also if the dead-letter queue is full.
+Errors are counted by processors in the `bspump.pipeline.deadletter` counter.
+
+If a processor fails on a batch of events, all events of the batch are dead-lettered with the same error,
+because the processor may have already done side effects for some of them.
+Processors that declare `BatchRetry = True` (their `process_batch()` has no side effects)
+get the batch again one by one instead, so that only failing events are dead-lettered.
+	'''
+
+	def __init__(self, pipeline):
+		self.Pipeline = pipeline
+		self.Target = pipeline.Config['dead_letter']
+		self.ErrorRate = float(pipeline.Config['dead_letter_error_rate'])
+		self.MinErrors = int(pipeline.Config['dead_letter_min_errors'])
+
+		self._svc = pipeline.App.get_service("bspump.PumpService")
+		self._target = None
+		self._errors = {} # Number of errors of a processor in the current metrics period
+
+		self.MetricsCounter = pipeline.MetricsService.create_counter(
+			"bspump.pipeline.deadletter",
+			tags={'pipeline':pipeline.Id},
+			init_values={
+				'event.dead': 0,
+			}
+		)
+
+
+	def handle(self, processor, context, event, exc):
+		'''
+		Route the failing event to the dead letter.
+		Returns False if the pipeline should be stopped instead.
+		'''
+		return self.handle_batch(processor, context, [event], exc)
+
+
+	def handle_batch(self, processor, context, events, exc):
+		'''
+		Route all events of the failing batch to the dead letter.
+		Returns False if the pipeline should be stopped instead.
+		'''
+		if not isinstance(exc, Exception):
+			return False
+
+		errors = self._errors.get(processor, 0) + len(events)
+		self._errors[processor] = errors
+		if (errors >= self.MinErrors) and (errors > self.Pipeline.MetricsCounter.Values['event.in'] * self.ErrorRate):
+			L.error("Error rate of '{}' in the pipeline '{}' is over the limit".format(processor.Id, self.Pipeline.Id))
+			return False
+
+		if len(self.Target) > 0:
+			target = self._target
+			if target is None:
+				target = self._svc.locate(self.Target)
+				if target is None:
+					L.error("Cannot locate dead letter '{}' of the pipeline '{}'".format(self.Target, self.Pipeline.Id))
+					return False
+				self._target = target
+
+			try:
+				for event in events:
+					target.put(context, {
+						'@timestamp': time.time(),
+						'pipeline': self.Pipeline.Id,
+						'processor': processor.Id,
+						'exception': exc.__class__.__name__,
+						'error': str(exc),
+						'event': event,
+					}, copy_event=False)
+			except asyncio.QueueFull:
+				L.error("Dead letter '{}' of the pipeline '{}' is full".format(self.Target, self.Pipeline.Id))
+				return False
+
+		if errors == len(events):
+			L.warning("Processing error in '{}' of the pipeline '{}', the event is routed to a dead letter: {} ({})".format(
+				processor.Id, self.Pipeline.Id, exc, exc.__class__.__name__
+			))
+
+		counter = self.MetricsCounter
+		if processor.Id not in counter.Init:
+			counter.Init[processor.Id] = 0
+		if processor.Id not in counter.Values:
+			counter.Values[processor.Id] = 0
+		counter.add(processor.Id, len(events))
+		counter.add('event.dead', len(events))
+
+		return True
+
+
+	def flush(self):
+		# A new metrics period begins
+		self._errors = {}
+
+
+	def rest_get(self):
+		return {
+			'Target': self.Target,
+			'Errors': {processor.Id: errors for processor, errors in self._errors.items()},
+		}
@@ -1,5 +1,4 @@
 import csv
-import asyncio
 import logging
 from .fileabcsource import FileABCSource
 
@@ -24,6 +23,7 @@ class FileCSVSource(FileABCSource):
 		'quoting': None,
 		'skipinitialspace': None,
 		'strict': None,
+		'batch_size': 1, # Number of lines that are sent to a pipeline at once, see Pipeline.process_batch(); lines of a batch share one context
 	}
 
 
@@ -32,6 +32,7 @@ class FileCSVSource(FileABCSource):
 
 		self.Dialect = csv.get_dialect(self.Config['dialect'])
 		self.FieldNames = fieldnames
+		self.BatchSize = int(self.Config['batch_size'])
 
 
 	def reader(self, f):
@@ -69,14 +70,31 @@ class FileCSVSource(FileABCSource):
 
 
 	async def read(self, filename, f):
-		counter = 0
+		if self.BatchSize <= 1:
+			for line in self.reader(f):
+				await self.process(line, {
+					"filename": filename
+				})
+
+				# Give chance to others when we are in the middle of massive processing
+				await self.Pipeline.ready()
+			return
+
+		batch = []
 		for line in self.reader(f):
-			await self.process(line, {
+			batch.append(line)
+			if len(batch) < self.BatchSize:
+				continue
+
+			await self.Pipeline.process_batch(batch, {
 				"filename": filename
 			})
+			batch = []
 
 			# Give chance to others when we are in the middle of massive processing
-			counter += 1
-			if counter >= 10000:
-				await asyncio.sleep(0.01)
-				counter = 0
+			await self.Pipeline.ready()
+
+		if len(batch) > 0:
+			await self.Pipeline.process_batch(batch, {
+				"filename": filename
+			})
@@ -0,0 +1,3 @@
+from .pipeline import SharedMemoryPipeline
+from .source import SharedMemorySource
+from .ring import SharedRingBuffer
@@ -0,0 +1,161 @@
+import asyncio
+import logging
+
+from ..abc.source import Source
+from ..pipeline import Pipeline
+from .ring import SharedRingBuffer, default_path
+
+#
+
+L = logging.getLogger(__name__)
+
+#
+
+class SharedMemoryPipeline(Pipeline):
+
+	'''
+A proxy of a pipeline that runs in another process and receives events by a `SharedMemorySource`.
+Routers (`RouterSink`, `RouterProcessor`, `TeeProcessor`) can route events to its `SharedMemorySource`
+the same way as to an `InternalSource` of a pipeline in this process.
+
+Front-end process:
+
+class FrontPipeline(bspump.Pipeline):
+
+	def __init__(self, app, pipeline_id):
+		super().__init__(app, pipeline_id)
+		self.build(
+			bspump.kafka.KafkaSource(app, self, "KafkaConnection"),
+			bspump.common.TeeProcessor(app, self).bind("WorkerPipelineA.*SharedMemorySource").bind("WorkerPipelineB.*SharedMemorySource"),
+			bspump.common.NullSink(app, self),
+		)
+
+svc.add_pipelines(
+	FrontPipeline(app, "FrontPipeline"),
+	bspump.ipc.SharedMemoryPipeline(app, "WorkerPipelineA"),
+	bspump.ipc.SharedMemoryPipeline(app, "WorkerPipelineB"),
+)
+
+Worker process (one per worker pipeline):
+
+class WorkerPipeline(bspump.Pipeline):
+
+	def __init__(self, app, pipeline_id):
+		super().__init__(app, pipeline_id)
+		self.build(
+			bspump.ipc.SharedMemorySource(app, self),
+			bspump.common.PPrintSink(app, self),
+		)
+
+svc.add_pipeline(WorkerPipeline(app, "WorkerPipelineA"))
+
+Both sides use the ring buffer '/dev/shm/bspump-<pipeline id>' by default, the path can be configured by the `path` option.
+A ring buffer has exactly one producer and one consumer, the file is kept when processes exit,
+so events that were not consumed yet are delivered when the worker is started again.
+
+Events and contexts are transferred pickled, so the copy strategy of routers doesn't apply (events are always copied).
+The proxy is not ready while the worker pipeline is not ready or not running, which throttles routers.
+When the ring buffer fills over the `backpressure` ratio, the proxy source publishes `bspump.InternalSource.backpressure_on!`
+and `bspump.InternalSource.backpressure_off!` once the worker drains it under `backpressure_low`, the same as `InternalSource` does.
+	'''
+
+	ConfigDefaults = {
+		'path': '', # A path of the ring buffer file, '/dev/shm/bspump-<pipeline id>' by default
+		'size': 16*1024*1024, # Size of the ring buffer in bytes, applies only if this side creates it
+		'backpressure': 0.8, # Ratio of the ring buffer fill that will result in a backpressure
+		'backpressure_low': 0.5, # Ratio of the ring buffer fill that will release the backpressure
+		'poll_interval': 0.01, # In seconds, how often the worker state is checked
+	}
+
+
+	def __init__(self, app, pipeline_id, config=None):
+		super().__init__(app, pipeline_id, config=config)
+
+		path = self.Config['path']
+		if len(path) == 0:
+			path = default_path("bspump-{}".format(pipeline_id))
+
+		self.set_source(SharedMemoryTarget(app, self, SharedRingBuffer(path, size=int(self.Config['size']))))
+
+
+class SharedMemoryTarget(Source):
+
+	'''
+	A producer side of the ring buffer, it is the source of the `SharedMemoryPipeline` proxy.
+	It has the interface of `InternalSource`, so routers can put events into it.
+	'''
+
+	def __init__(self, app, pipeline, ring, id="SharedMemorySource", config=None):
+		super().__init__(app, pipeline, id=id, config=config)
+		self.Ring = ring
+		self.BackPressure = False
+		self.BackPressureLimit = self.Ring.Capacity * float(pipeline.Config['backpressure'])
+		self.BackPressureLowLimit = self.Ring.Capacity * float(pipeline.Config['backpressure_low'])
+		self.PollInterval = float(pipeline.Config['poll_interval'])
+
+		# The proxy is not ready until the worker reports it is
+		self._consumer_ready = False
+		pipeline.throttle(self, enable=True)
+
+
+	def put(self, context, event, copy_event=True):
+		'''
+		Context can be an empty dictionary if is not provided.
+		Events are always copied (pickled), the `copy_event` is accepted for a compatibility with `InternalSource.put()`.
+		'''
+		if not self.Ring.put((context, [event])):
+			raise asyncio.QueueFull()
+		self._check_backpressure_on()
+
+
+	def put_many(self, context, events, copy_event=True):
+		'''
+		Put a list of events that share the same context, they are stored as a single record.
+		'''
+		if not self.Ring.put((context, list(events))):
+			raise asyncio.QueueFull()
+		self._check_backpressure_on()
+
+
+	async def put_async(self, context, event, copy_event=False):
+		'''
+		Put an event, wait for a free space in the ring buffer if it is full.
+		'''
+		while not self.Ring.put((context, [event])):
+			await asyncio.sleep(self.PollInterval)
+		self._check_backpressure_on()
+
+
+	def _check_backpressure_on(self):
+		if (not self.BackPressure) and (self.BackPressureLimit <= self.Ring.used()):
+			self.BackPressure = True
+			self.Pipeline.PubSub.publish("bspump.InternalSource.backpressure_on!", source=self)
+
+
+	async def main(self):
+		# Watch the state of the worker, since it cannot notify this process directly
+		try:
+			while True:
+				ready = self.Ring.is_consumer_ready()
+				if ready != self._consumer_ready:
+					self._consumer_ready = ready
+					self.Pipeline.throttle(self, enable=not ready)
+
+				if self.BackPressure and (self.BackPressureLowLimit >= self.Ring.used()):
+					self.BackPressure = False
+					self.Pipeline.PubSub.publish("bspump.InternalSource.backpressure_off!", source=self)
+
+				await asyncio.sleep(self.PollInterval)
+
+		except asyncio.CancelledError:
+			pass
+
+
+	def rest_get(self):
+		rest = super().rest_get()
+		rest['Path'] = self.Ring.Path
+		rest['Used'] = self.Ring.used()
+		rest['Capacity'] = self.Ring.Capacity
+		rest['BackPressure'] = self.BackPressure
+		rest['WorkerReady'] = self._consumer_ready
+		return rest
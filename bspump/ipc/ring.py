@@ -0,0 +1,168 @@
+import os
+import mmap
+import pickle
+import struct
+import tempfile
+
+#
+
+_MAGIC = b'BSPRING1'
+
+# Header fields are placed in separate cache lines, so that the producer and the consumer do not share them
+_CAPACITY_OFFSET = 8
+_HEAD_OFFSET = 64 # Written only by the producer
+_TAIL_OFFSET = 128 # Written only by the consumer
+_READY_OFFSET = 192 # Written only by the consumer
+_DATA_OFFSET = 256
+
+_U64 = struct.Struct('<Q')
+_LENGTH = struct.Struct('<I')
+_WRAP = 0xFFFFFFFF # A record length marking the rest of the buffer as unused
+
+#
+
+def default_path(name):
+	'''
+	Return a path of a ring buffer `name` in a shared memory file system, if available.
+	'''
+	directory = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+	return os.path.join(directory, name)
+
+
+class SharedRingBuffer(object):
+
+	'''
+A single-producer, single-consumer ring buffer of pickled items in a memory-mapped file.
+The file is created by the side that opens it first, with a data area of `size` bytes.
+
+The head (the total number of bytes written) is updated by the producer only after the record is written
+and the tail (the total number of bytes read) is updated by the consumer only after the record is processed (see `peek()`),
+so the processes do not need any lock.
+Each record is a 4-byte length followed by a pickled item, records are 4-byte aligned and they do not wrap around.
+	'''
+
+	def __init__(self, path, size=16*1024*1024):
+		self.Path = path
+		size = (size + 3) & ~3
+
+		if not os.path.exists(path):
+			self._create(path, size)
+
+		with open(path, 'r+b') as f:
+			self._mmap = mmap.mmap(f.fileno(), 0)
+
+		if self._mmap[0:len(_MAGIC)] != _MAGIC:
+			raise RuntimeError("'{}' is not a ring buffer".format(path))
+		self.Capacity = _U64.unpack_from(self._mmap, _CAPACITY_OFFSET)[0]
+
+
+	def _create(self, path, size):
+		# The file is initialized under a temporary name and then linked, so the other side never sees it half-initialized
+		fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or '.')
+		try:
+			os.ftruncate(fd, _DATA_OFFSET + size)
+			os.pwrite(fd, _MAGIC, 0)
+			os.pwrite(fd, _U64.pack(size), _CAPACITY_OFFSET)
+			try:
+				os.link(tmp, path)
+			except FileExistsError:
+				pass
+		finally:
+			os.close(fd)
+			os.unlink(tmp)
+
+
+	def close(self):
+		self._mmap.close()
+
+
+	def used(self):
+		'''
+		Number of bytes occupied by unread records.
+		'''
+		return _U64.unpack_from(self._mmap, _HEAD_OFFSET)[0] - _U64.unpack_from(self._mmap, _TAIL_OFFSET)[0]
+
+
+	# Producer
+
+	def put(self, item):
+		'''
+		Append an item, returns False if there is not enough free space.
+		'''
+		data = pickle.dumps(item, pickle.HIGHEST_PROTOCOL)
+		record_size = (_LENGTH.size + len(data) + 3) & ~3
+		if record_size > self.Capacity // 2:
+			raise ValueError("Item of {} bytes is too large for a ring buffer '{}'".format(len(data), self.Path))
+
+		mm = self._mmap
+		head = _U64.unpack_from(mm, _HEAD_OFFSET)[0]
+		free = self.Capacity - (head - _U64.unpack_from(mm, _TAIL_OFFSET)[0])
+
+		position = head % self.Capacity
+		contiguous = self.Capacity - position
+		if record_size > contiguous:
+			# The record does not fit before the end of the buffer, skip the rest of it
+			if record_size + contiguous > free:
+				return False
+			_LENGTH.pack_into(mm, _DATA_OFFSET + position, _WRAP)
+			head += contiguous
+			position = 0
+		elif record_size > free:
+			return False
+
+		offset = _DATA_OFFSET + position
+		_LENGTH.pack_into(mm, offset, len(data))
+		mm[offset + _LENGTH.size:offset + _LENGTH.size + len(data)] = data
+
+		_U64.pack_into(mm, _HEAD_OFFSET, head + record_size)
+		return True
+
+
+	def is_consumer_ready(self):
+		return _U64.unpack_from(self._mmap, _READY_OFFSET)[0] != 0
+
+
+	# Consumer
+
+	def get(self, max_count):
+		'''
+		Read up to `max_count` items and release their space.
+		'''
+		items, tail = self.peek(max_count)
+		self.commit(tail)
+		return items
+
+
+	def peek(self, max_count):
+		'''
+		Read up to `max_count` items without releasing their space, returns (items, tail).
+		Pass the `tail` to `commit()` once the items are processed, until then they are read again by the next `peek()`.
+		'''
+		mm = self._mmap
+		head = _U64.unpack_from(mm, _HEAD_OFFSET)[0]
+		tail = _U64.unpack_from(mm, _TAIL_OFFSET)[0]
+
+		items = []
+		while (tail < head) and (len(items) < max_count):
+			position = tail % self.Capacity
+			offset = _DATA_OFFSET + position
+			length = _LENGTH.unpack_from(mm, offset)[0]
+			if length == _WRAP:
+				tail += self.Capacity - position
+				continue
+
+			items.append(pickle.loads(mm[offset + _LENGTH.size:offset + _LENGTH.size + length]))
+			tail += (_LENGTH.size + length + 3) & ~3
+
+		return items, tail
+
+
+	def commit(self, tail):
+		'''
+		Release the space of items read by `peek()`.
+		'''
+		_U64.pack_into(self._mmap, _TAIL_OFFSET, tail)
+
+
+	def set_consumer_ready(self, ready):
+		_U64.pack_into(self._mmap, _READY_OFFSET, 1 if ready else 0)
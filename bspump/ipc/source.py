@@ -0,0 +1,119 @@
+import asyncio
+import logging
+
+from ..abc.source import Source
+from .ring import SharedRingBuffer, default_path
+
+#
+
+L = logging.getLogger(__name__)
+
+#
+
+class SharedMemorySource(Source):
+
+	'''
+	A source that receives events from a `SharedMemoryPipeline` in another process thru a shared-memory ring buffer.
+	It is a cross-process counterpart of `InternalSource`.
+
+	The readiness of the pipeline is signalled to the producer thru the ring buffer,
+	the producer-side proxy pipeline is not ready while this pipeline is not ready or not running.
+
+	Records are released from the ring buffer only after they are processed, so records that are being processed
+	when the source is stopped are processed again by the next consumer.
+	The empty ring buffer is polled each `poll_interval` seconds, the interval doubles while the buffer stays empty
+	up to `poll_interval_max` seconds.
+
+	Each event is processed with its own context by default. If `batch` is enabled, events of consecutive records
+	with equal contexts are processed as one batch by `Pipeline.process_batch()`, so they share a single context.
+	'''
+
+	ConfigDefaults = {
+		'path': '', # A path of the ring buffer file, '/dev/shm/bspump-<pipeline id>' by default
+		'size': 16*1024*1024, # Size of the ring buffer in bytes, applies only if this side creates it
+		'batch_max_size': 1000, # Maximum number of records read from the ring buffer at once
+		'batch': 'no', # Process events of records with equal contexts as a batch, see Pipeline.process_batch()
+		'poll_interval': 0.001, # In seconds, how often the empty ring buffer is checked for new events
+		'poll_interval_max': 0.05, # In seconds, the maximum interval of checks when the ring buffer stays empty
+	}
+
+
+	def __init__(self, app, pipeline, id=None, config=None):
+		super().__init__(app, pipeline, id=id, config=config)
+
+		path = self.Config['path']
+		if len(path) == 0:
+			path = default_path("bspump-{}".format(pipeline.Id))
+		self.Ring = SharedRingBuffer(path, size=int(self.Config['size']))
+
+		self.BatchMaxSize = int(self.Config['batch_max_size'])
+		self._batch = self.Config['batch'].lower() == 'yes'
+		self.PollInterval = float(self.Config['poll_interval'])
+		self.PollIntervalMax = max(float(self.Config['poll_interval_max']), self.PollInterval)
+		self._running = False
+
+		pipeline.PubSub.subscribe("bspump.pipeline.ready!", self._on_pipeline_ready_change)
+		pipeline.PubSub.subscribe("bspump.pipeline.not_ready!", self._on_pipeline_ready_change)
+
+
+	def _on_pipeline_ready_change(self, event_name, pipeline):
+		if self._running:
+			self.Ring.set_consumer_ready(pipeline.is_ready())
+
+
+	async def main(self):
+		self._running = True
+		self.Ring.set_consumer_ready(self.Pipeline.is_ready())
+		poll_interval = self.PollInterval
+		try:
+			while True:
+				await self.Pipeline.ready()
+
+				items, tail = self.Ring.peek(self.BatchMaxSize)
+				if len(items) == 0:
+					# Back off exponentially while the ring buffer is empty
+					await asyncio.sleep(poll_interval)
+					poll_interval = min(poll_interval * 2, self.PollIntervalMax)
+					continue
+				poll_interval = self.PollInterval
+
+				if not self._batch:
+					for context, events in items:
+						for event in events:
+							await self.process(event, context={'ancestor':context})
+					self.Ring.commit(tail)
+					continue
+
+				# Each record is (context, events), consecutive records with the same context are processed as a batch
+				context, events = items[0]
+				for next_context, next_events in items[1:]:
+					if next_context == context:
+						events.extend(next_events)
+						continue
+					await self._emit(context, events)
+					context, events = next_context, next_events
+				await self._emit(context, events)
+
+				self.Ring.commit(tail)
+
+		except asyncio.CancelledError:
+			pass
+
+		finally:
+			self._running = False
+			self.Ring.set_consumer_ready(False)
+
+
+	async def _emit(self, context, events):
+		if len(events) == 1:
+			await self.process(events[0], context={'ancestor':context})
+		else:
+			await self.Pipeline.process_batch(events, context={'ancestor':context})
+
+
+	def rest_get(self):
+		rest = super().rest_get()
+		rest['Path'] = self.Ring.Path
+		rest['Used'] = self.Ring.used()
+		rest['Capacity'] = self.Ring.Capacity
+		return rest
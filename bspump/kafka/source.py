@@ -14,6 +14,14 @@ L = logging.getLogger(__name__)
 
 class KafkaSource(Source):
 
+	'''
+	Each message is processed with its own context `{"kafka": message}`.
+
+	If `batch` is enabled, messages fetched from a topic partition are processed as one batch with a shared context
+	`{"kafka_tp": topic_partition, "kafka_messages": messages}` instead, so processors that read `context['kafka']`
+	have to be adapted before the batching is enabled.
+	'''
+
 
 	ConfigDefaults = {
 		'topic': '', # Multiple values are allowed, separated by , character
@@ -22,6 +30,7 @@ class KafkaSource(Source):
 		'max_partition_fetch_bytes': 1048576,
 		'auto_offset_reset': 'latest',
 		'api_version': 'auto', # or e.g. 0.9.0
+		'batch': 'no', # Process messages from a partition as a batch, see Pipeline.process_batch() and process_messages()
 	}
 
 
@@ -33,6 +42,8 @@ class KafkaSource(Source):
 		self._group_id = self.Config['group_id']
 		if len(self._group_id) == 0: self._group_id = None
 
+		self._batch = self.Config['batch'].lower() == 'yes'
+
 		self.Connection = pipeline.locate_connection(app, connection)
 		self.Consumer = aiokafka.AIOKafkaConsumer(
 			*topics,
@@ -54,6 +65,9 @@ class KafkaSource(Source):
 				await self.Pipeline.ready()
 				data = await self.Consumer.getmany(timeout_ms=10000)
 				for tp, messages in data.items():
+					if self._batch:
+						await self.process_messages(tp, messages)
+						continue
 					for message in messages:
 						#TODO: If pipeline is not ready, don't commit messages ...
 						await self.process_message(message)
@@ -71,3 +85,11 @@ class KafkaSource(Source):
 	async def process_message(self, message):
 		context = { "kafka": message }
 		await self.process(message.value, context=context)
+
+
+	async def process_messages(self, tp, messages):
+		'''
+		Batch variant of `process_message()`, all messages fetched from a topic partition share one context.
+		'''
+		context = { "kafka_tp": tp, "kafka_messages": messages }
+		await self.Pipeline.process_batch([message.value for message in messages], context=context)
@@ -1,6 +1,12 @@
 import logging
 import csv
-import ipaddress
+import json
+import mmap
+import os
+import socket
+import struct
+
+import numpy as np
 
 from bspump.abc.lookup import DictionaryLookup
 
@@ -10,6 +16,20 @@ L = logging.getLogger(__name__)
 
 ###
 
+# IPv6 addresses are 128-bit keys, stored as (high, low) pairs of 64-bit integers that are compared lexicographically
+IPV6_DTYPE = np.dtype([('hi', '<u8'), ('lo', '<u8')])
+
+# https://blog.ip2location.com/knowledge-base/ipv4-mapped-ipv6-address/
+# 191.239.213.197 -> ::ffff:191.239.213.197
+IPV4_MAPPED_OFFSET = 281470681743360
+
+# The binary format: header, then 16-byte aligned sections of range starts, range ends, location indexes,
+# offsets of locations in the location table and the location table (JSON encoded locations)
+# Header: magic, key size (4 for IPv4, 16 for IPv6), reserved, number of ranges, number of locations
+IPGEO_MAGIC = b'BSIPGEO1'
+IPGEO_HEADER = struct.Struct(r"<8sLLQQ")
+
+
 class IPGeoLookup(DictionaryLookup):
 	'''
 This lookup performs transformation of IP address into a geographical location.
@@ -21,6 +41,13 @@ Free versions: IP2LOCATION-LITE-DB5.IPV6.CSV and IP2LOCATION-LITE-DB5.IPV4.CSV
 For better precision visit https://lite.ip2location.com to buy a commercial version of database.
 
 Usage: specify in configuration the path to the database in csv format.
+The path can be also a binary file created by `save()`, it is memory-mapped,
+so it is loaded instantly and pump processes on one host share its memory.
+The same binary format is used by the master/slave serialization and the lookup cache.
+
+IP address ranges are kept in sorted numpy arrays (uint32 for the IPv4 database, pairs of uint64 for the IPv6 one)
+and searched by a binary search. Equal locations are stored only once in `Locations`,
+ranges refer to them by an index. Use `lookup_location_many()` to look up a list of addresses at once.
 '''
 
 
@@ -31,8 +58,13 @@ Usage: specify in configuration the path to the database in csv format.
 
 	def __init__(self, app, lookup_id, config=None):
 		super().__init__(app, lookup_id=lookup_id, config=config)
-		self.TreeRoot = None
-		self.Locations = {}
+
+		self.Starts = None # Sorted first addresses of ranges
+		self.Ends = None # Last addresses of ranges
+		self.LocationIndex = None # Index of the location of a range in `Locations`
+		self.Locations = []
+		self._serialized = None
+
 		if self.Config['ipv4mapped'].lower() == 'yes':
 			self.IP4Mapped = True
 		else:
@@ -44,107 +76,322 @@ Usage: specify in configuration the path to the database in csv format.
 		if fname == '':
 			return
 
+		with open(fname, 'rb') as f:
+			magic = f.read(len(IPGEO_MAGIC))
+			if magic == IPGEO_MAGIC:
+				f.seek(0)
+				self.deserialize(self.read_cache(f))
+				L.debug("IPGeoLookup {} was successfully loaded".format(self.Id))
+				return True
+
+		starts = []
+		ends = []
+		location_index = []
+		locations = []
+		interned = {}
+		ordered = True
+		ipv6 = False
+
 		with open(fname, 'r') as f:
-			array = []
-			
 			for line in csv.reader(f, delimiter=","):
 				ip_int_address_start = int(line[0])
 				ip_int_address_end = int(line[1])
-				array.append(ip_int_address_start)
-				array.append(ip_int_address_end)
+				if starts and (ip_int_address_start < starts[-1]):
+					ordered = False
+				if ip_int_address_end > 0xFFFFFFFF:
+					ipv6 = True
+				starts.append(ip_int_address_start)
+				ends.append(ip_int_address_end)
+
 				lat = float(line[6])
 				lon = float(line[7])
-
 				if (lat == 0.0) or (lon == 0.0):
-					d = {'lat' : None, 'lon' : None}
-				else:
+					lat = lon = None
+
+				key = (lat, lon, line[2], line[4], line[5])
+				i = interned.get(key)
+				if i is None:
 					d = {'lat' : lat, 'lon' : lon}
+					if line[2] != '-': d['country'] = line[2]
+					if line[4] != '-': d['region'] = line[4]
+					if line[5] != '-': d['city'] = line[5]
+
+					i = len(locations)
+					interned[key] = i
+					locations.append(d)
+
+				location_index.append(i)
 
-				if line[2] != '-': d['country'] = line[2]
-				if line[4] != '-': d['region'] = line[4]
-				if line[5] != '-': d['city'] = line[5]
+		del interned
+
+		if ipv6:
+			starts = self._ipv6_array(starts)
+			ends = self._ipv6_array(ends)
+		else:
+			starts = np.array(starts, dtype=np.uint32)
+			ends = np.array(ends, dtype=np.uint32)
+		location_index = np.array(location_index, dtype=np.uint32)
 
-				self.Locations[ip_int_address_start] = d
-				self.Locations[ip_int_address_end] = d
+		if not ordered:
+			order = np.argsort(starts, kind='mergesort')
+			starts = starts[order]
+			ends = ends[order]
+			location_index = location_index[order]
 
-		self.TreeRoot = self.sorted_array_to_bst(array)
-		del array
+		self.set(starts, ends, location_index, locations)
 		L.debug("IPGeoLookup {} was successfully created".format(self.Id))
 		return True
 
-	def set(self, tree):
-		self.TreeRoot = tree
 
-
-	def sorted_array_to_bst(self, arr): 
-		if not arr: 
+	def set(self, starts, ends, location_index, locations):
+		'''
+		Set ranges of the lookup, `starts` and `ends` are sorted numpy arrays of the first and the last address of ranges,
+		either `np.uint32` (IPv4) or `IPV6_DTYPE`. `location_index` refers each range to its item in the `locations` list.
+		'''
+		if self.MasterURL is not None:
+			L.warn("'master_url' provided, set() method can not be used")
+
+		self.Starts = starts
+		self.Ends = ends
+		self.LocationIndex = location_index
+		self.Locations = locations
+		self._serialized = None
+
+
+	# Serialization
+
+	def serialize(self):
+		'''
+		Return the lookup in the binary format, the result is kept until the lookup is changed.
+		'''
+		if self._serialized is not None:
+			return bytes(self._serialized)
+
+		if self.Starts is None:
+			raise RuntimeError("IPGeoLookup '{}' is not loaded".format(self.Id))
+
+		locations = [json.dumps(location, separators=(',', ':')).encode('utf-8') for location in self.Locations]
+		location_offsets = np.zeros(len(locations) + 1, dtype='<u4')
+		np.cumsum([len(location) for location in locations], out=location_offsets[1:])
+
+		sections = [
+			IPGEO_HEADER.pack(IPGEO_MAGIC, self.Starts.dtype.itemsize, 0, len(self.Starts), len(locations)),
+			self.Starts.tobytes(),
+			self.Ends.tobytes(),
+			self.LocationIndex.astype('<u4').tobytes(),
+			location_offsets.tobytes(),
+			b''.join(locations),
+		]
+		padded = []
+		for section in sections:
+			padded.append(section)
+			padded.append(b'\0' * (-len(section) % 16))
+
+		self._serialized = b''.join(padded)
+		return self._serialized
+
+
+	def deserialize(self, data):
+		'''
+		Load the lookup from the binary format, `data` can be `bytes` or a memory-mapped file.
+		Arrays are not copied, they refer to `data`.
+		'''
+		data = memoryview(data)
+		magic, key_size, _, ranges, locations = IPGEO_HEADER.unpack_from(data)
+		if magic != IPGEO_MAGIC:
+			raise ValueError("Invalid format of the IPGeoLookup '{}'".format(self.Id))
+
+		if key_size == 4:
+			dtype = np.dtype('<u4')
+		elif key_size == 16:
+			dtype = IPV6_DTYPE
+		else:
+			raise ValueError("Invalid key size {} of the IPGeoLookup '{}'".format(key_size, self.Id))
+
+		offset = IPGEO_HEADER.size
+
+		def section(dtype, count):
+			nonlocal offset
+			array = np.frombuffer(data, dtype=dtype, count=count, offset=offset)
+			if not array.flags.aligned:
+				# Numpy copies unaligned arrays at each search, so better to do it once
+				array = array.copy()
+			offset += array.nbytes + (-array.nbytes % 16)
+			return array
+
+		starts = section(dtype, ranges)
+		ends = section(dtype, ranges)
+		location_index = section('<u4', ranges)
+		location_offsets = section('<u4', locations + 1)
+
+		self.Starts = starts
+		self.Ends = ends
+		self.LocationIndex = location_index
+		self.Locations = LocationTable(location_offsets, data[offset:])
+		self._serialized = data
+
+
+	def read_cache(self, f):
+		# Memory-map the data instead of reading them, pages are shared by all processes that use the same file
+		offset = f.tell()
+		f.seek(0, os.SEEK_END)
+		if f.tell() == offset:
+			return b''
+		return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))[offset:]
+
+
+	def save(self, path):
+		'''
+		Save the lookup in the binary format to a file, that can be used as a `path` of the lookup.
+		'''
+		tmp_path = path + '.tmp'
+		with open(tmp_path, 'wb') as fo:
+			fo.write(self.serialize())
+		os.rename(tmp_path, path)
+
+
+	@staticmethod
+	def _ipv6_array(values):
+		array = np.empty(len(values), dtype=IPV6_DTYPE)
+		array['hi'] = [v >> 64 for v in values]
+		array['lo'] = [v & 0xFFFFFFFFFFFFFFFF for v in values]
+		return array
+
+
+	def _address_to_int(self, address):
+		try:
+			if ':' in address:
+				hi, lo = struct.unpack('>QQ', socket.inet_pton(socket.AF_INET6, address))
+				return (hi << 64) | lo
+
+			elif '.' in address:
+				address_int, = struct.unpack('>L', socket.inet_pton(socket.AF_INET, address))
+				if self.IP4Mapped:
+					address_int += IPV4_MAPPED_OFFSET
+				return address_int
+
+		except OSError:
+			pass
+
+		raise ValueError("Invalid IPv4/IPv6 format: '{}'".format(address))
+
+
+	def search(self, address_int):
+		'''
+		Return the location of the range that contains the integer address or None if there is no such range.
+		'''
+		if self.Starts is None:
+			#L.warn("Cannnot enrich the location")
 			return None
 
-		mid = int(len(arr) / 2)
-		root = Node(arr[mid]) 
-		root.left = self.sorted_array_to_bst(arr[:mid]) 
-		root.right = self.sorted_array_to_bst(arr[mid+1:]) 
-		return root 
-
-
-	def search(self, value):
-		root = self.TreeRoot
-		while True:
-			if root.data == value:
-				return root.data
-			
-			if root.data > value:
-
-				l = root.left
-				if l is None:
-					return root.data
-				else:
-					root = l
-			if root.data < value:
-				r = root.right
-				if r is None:
-					return root.data
-				else:
-					root = r
+		if self.Starts.dtype == IPV6_DTYPE:
+			key = np.array((address_int >> 64, address_int & 0xFFFFFFFFFFFFFFFF), dtype=IPV6_DTYPE)
+		elif address_int > 0xFFFFFFFF:
+			return None
+		else:
+			key = np.uint32(address_int)
 
+		# The last range that starts at or before the address, it must also end at or after it
+		i = int(np.searchsorted(self.Starts, key, side='right')) - 1
+		if i < 0:
+			return None
 
-	def lookup_location_ipv4(self, address):
-		if self.TreeRoot is None:
-			#L.warn("Cannnot enrich the location")
+		if self.Starts.dtype == IPV6_DTYPE:
+			end = self.Ends[i]
+			if (end['hi'] < key['hi']) or ((end['hi'] == key['hi']) and (end['lo'] < key['lo'])):
+				return None
+		elif self.Ends[i] < key:
 			return None
 
-		address_int = int(ipaddress.IPv4Address(address))
+		return self.Locations[self.LocationIndex[i]]
 
-		if self.IP4Mapped:
-			# https://blog.ip2location.com/knowledge-base/ipv4-mapped-ipv6-address/
-			# 191.239.213.197 -> ::ffff:191.239.213.197
-			address_int += 281470681743360
 
-		value = self.search(address_int)
-		return self.Locations.get(value)
+	def lookup_location_ipv4(self, address):
+		if self.Starts is None:
+			return None
+		if ':' in address:
+			raise ValueError("Invalid IPv4 format: '{}'".format(address))
+		return self.search(self._address_to_int(address))
 
 
 	def lookup_location_ipv6(self, address):
-		if self.TreeRoot is None:
-			#L.warn("Cannnot enrich the location")
+		if self.Starts is None:
 			return None
+		if ':' not in address:
+			raise ValueError("Invalid IPv6 format: '{}'".format(address))
+		return self.search(self._address_to_int(address))
 
-		address_int = int(ipaddress.IPv6Address(address))
-
-		value = self.search(address_int)
-		return self.Locations.get(value)
 
 	def lookup_location(self, address):
-		if '.' in address:
-			return self.lookup_location_ipv4(address)
-		elif ':' in address:
-			return self.lookup_location_ipv6(address)
+		if self.Starts is None:
+			return None
+		return self.search(self._address_to_int(address))
+
+
+	def lookup_location_many(self, addresses):
+		'''
+		Look up a list of IPv4/IPv6 addresses at once, the binary search of all of them is done by a single numpy call.
+		Returns a list of locations (or None) in the order of `addresses`.
+		'''
+		result = [None] * len(addresses)
+		if self.Starts is None or len(addresses) == 0:
+			return result
+
+		ipv6 = self.Starts.dtype == IPV6_DTYPE
+		positions = []
+		keys = []
+		for position, address in enumerate(addresses):
+			address_int = self._address_to_int(address)
+			if (not ipv6) and (address_int > 0xFFFFFFFF):
+				continue
+			positions.append(position)
+			keys.append(address_int)
+
+		if len(keys) == 0:
+			return result
+
+		if ipv6:
+			keys = self._ipv6_array(keys)
 		else:
-			raise ValueError("Invalid IPv4/IPv6 format")
+			keys = np.array(keys, dtype=np.uint32)
+
+		# The address is in the range `i` if it starts at or before the address
+		# and the first range that ends at or after the address is the same one
+		i = np.searchsorted(self.Starts, keys, side='right') - 1
+		found = np.searchsorted(self.Ends, keys, side='left') == i
+		found &= i >= 0
+
+		locations = self.Locations
+		for position, index in zip(np.compress(found, positions), self.LocationIndex[i[found]]):
+			result[position] = locations[index]
+
+		return result
+
+
+class LocationTable(object):
+	'''
+	A read-only list of locations, that are stored JSON encoded in a buffer.
+	Locations are decoded when they are accessed for the first time.
+	'''
+
+	def __init__(self, offsets, data):
+		self.Offsets = offsets
+		self.Data = data
+		self._decoded = [None] * (len(offsets) - 1)
+
+
+	def __len__(self):
+		return len(self._decoded)
+
+
+	def __getitem__(self, index):
+		location = self._decoded[index]
+		if location is None:
+			location = json.loads(bytes(self.Data[self.Offsets[index]:self.Offsets[index+1]]).decode('utf-8'))
+			self._decoded[index] = location
+		return location
 
 
-class Node: 
-	def __init__(self, d): 
-		self.data = d 
-		self.left = None
-		self.right = None
+	def __iter__(self):
+		for index in range(len(self._decoded)):
+			yield self[index]
@@ -1,4 +1,8 @@
-import abc
+import asyncio
+import collections
+import time
+
+import bson
 
 from ..abc.lookup import MappingLookup
 
@@ -8,71 +12,351 @@ class MongoDBLookup(MappingLookup):
 The lookup that is linked with a MongoDB.
 It provides a mapping (dictionary-like) interface to pipelines.
 It feeds lookup data from MongoDB using a query.
-It also has a simple cache to reduce a number of datbase hits.
+It also has a cache to reduce a number of datbase hits.
 
 Example:
 
 class ProjectLookup(bspump.mongodb.MongoDBLookup):
 
-	async def count(self, database):
+	async def _count(self, database):
 		return await database['projects'].count_documents({})
 
-	def find_one(self, database, key):
+	def _find_one(self, database, key):
 		return database['projects'].find_one({'_id':key})
 
+	async def _find_many(self, database, keys):
+		return await database['projects'].find({'_id': {'$in': keys}}).to_list(None)
+
+	def _key_of(self, document):
+		return document['_id']
+
+The cache keeps at most `cache_size` least recently used items, found items expire after `cache_ttl` seconds,
+keys that were not found are cached as None for `cache_negative_ttl` seconds.
+
+A miss of `lookup[key]` or `lookup.get(key)` queries the database synchronously, which blocks the whole pump.
+Use `await lookup.get_async(key)` or `await lookup.prefetch(keys)` from an `AsyncProcessor` instead,
+concurrent misses are then coalesced and fetched by a single `$in` query of up to `prefetch_batch_size` keys:
+
+class ProjectEnricher(bspump.AsyncProcessor):
+
+	async def process_batch(self, context, events):
+		await self.Lookup.prefetch([event['project'] for event in events])
+		for event in events:
+			event['project'] = self.Lookup.get(event['project'])
+		return events
+
+Hits, misses, expired and evicted items, queries and blocking queries are counted in the `mongodb.lookup` counter.
+
+In the preload mode (`preload=yes`), `load()` reads the whole collection into memory
+and the lookup never queries the database per key, a key that is not in the collection is None.
+Only fields listed in `projection` are kept (and the key). When `update_field` is set (e.g. a modification timestamp or `_id`),
+later loads read only documents with a greater value of this field, so deleted documents are removed only by a restart.
+The lookup is loaded again each `update_period` seconds, or when `ensure_future_update()` is called.
+Slave lookups (see `master_url`) get preloaded documents from the master thru `/lookup/`.
 	'''
 
 	ConfigDefaults = {
 		'database': '', # Specify a database if you want to overload the connection setting
 		'collection':'', # Specify collection name
-		'key':'' # Specify key name used for search
+		'key':'', # Specify key name used for search
+		'cache_size': 10000, # Maximum number of cached items, 0 means unlimited
+		'cache_ttl': 600, # In seconds, how long found items are cached, 0 means forever
+		'cache_negative_ttl': 60, # In seconds, how long keys that were not found are cached, 0 disables it
+		'prefetch_batch_size': 1000, # Maximum number of keys fetched by a single query
+		'preload': 'no', # Load the whole collection into memory
+		'projection': '', # Comma-separated fields of documents loaded in the preload mode, all fields if empty
+		'update_field': '', # A field used to load only changed documents in the preload mode, the whole collection is loaded if empty
+		'update_period': 0, # In seconds, how often the lookup is loaded again, 0 disables it
 	}
 
 	def __init__(self, app, lookup_id, mongodb_connection, config=None):
 		super().__init__(app, lookup_id=lookup_id, config=config)
 		self.Connection = mongodb_connection
+		self.Loop = app.Loop
 
 		self.Database = self.Config['database']
 		if len(self.Database) == 0:
 			self.Database = self.Connection.Database
 
 		self.Count = -1
-		self.Cache = {}
+		self.Cache = collections.OrderedDict() # key -> (value, expiration time)
+		self.CacheSize = int(self.Config['cache_size'])
+		self.CacheTTL = float(self.Config['cache_ttl'])
+		self.CacheNegativeTTL = float(self.Config['cache_negative_ttl'])
+		self.PrefetchBatchSize = int(self.Config['prefetch_batch_size'])
+
+		self._pending = {} # Keys waiting for a query, key -> future
+		self._inflight = {} # Keys being queried, key -> future
+		self._flush_handle = None
+
+		self.Preload = self.Config['preload'].lower() == 'yes'
+		self.Documents = None # Preloaded documents, key -> document
+		self.UpdateField = self.Config['update_field']
+		if len(self.UpdateField) == 0:
+			self.UpdateField = None
+		self.LastUpdate = None # The greatest value of the `update_field` loaded so far
+
+		self.Projection = None
+		fields = [field.strip() for field in self.Config['projection'].split(',') if len(field.strip()) > 0]
+		if len(fields) > 0:
+			self.Projection = {'_id': 0}
+			for field in fields + [self.Config['key'], self.UpdateField]:
+				if field is not None:
+					self.Projection[field] = 1
+
+		self.UpdatePeriod = float(self.Config['update_period'])
+		self._update_time = time.time()
+		self._update_future = None
+		if self.UpdatePeriod > 0:
+			app.PubSub.subscribe("Application.tick!", self._on_tick)
 
 		metrics_service = app.get_service('asab.MetricsService')
-		self.CacheCounter = metrics_service.create_counter("mongodb.lookup", tags={}, init_values={'hit': 0, 'miss': 0})
+		self.CacheCounter = metrics_service.create_counter("mongodb.lookup", tags={'lookup': lookup_id}, init_values={
+			'hit': 0,
+			'miss': 0,
+			'expired': 0,
+			'evicted': 0,
+			'query': 0,
+			'blocking': 0,
+		})
 
 
 	def _find_one(self, database, key):
 		return database[self.Config['collection']].find_one({self.Config['key']:key})
 
+
+	async def _find_many(self, database, keys):
+		return await database[self.Config['collection']].find({self.Config['key']: {'$in': keys}}).to_list(None)
+
+
+	def _key_of(self, document):
+		return document[self.Config['key']]
+
 	
 	async def _count(self, database):
 		return await database[self.Config['collection']].count_documents({})
 
 
+	def _find_all(self, database, query):
+		return database[self.Config['collection']].find(query, self.Projection)
+
+
 	async def load(self):
-		self.Count = await self._count(self.Connection.Client[self.Database])
+		self._update_time = time.time()
+		database = self.Connection.Client[self.Database]
+		if not self.Preload:
+			self.Count = await self._count(database)
+			return
+
+		if (self.Documents is None) or (self.UpdateField is None) or (self.LastUpdate is None):
+			documents = {}
+			query = {}
+		else:
+			# Apply changed documents to the loaded ones
+			documents = self.Documents
+			query = {self.UpdateField: {'$gt': self.LastUpdate}}
+
+		changed = 0
+		last_update = self.LastUpdate
+		async for document in self._find_all(database, query):
+			documents[self._key_of(document)] = document
+			changed += 1
+			if self.UpdateField is not None:
+				value = document.get(self.UpdateField)
+				if (value is not None) and ((last_update is None) or (value > last_update)):
+					last_update = value
+
+		updated = (self.Documents is not documents) or (changed > 0)
+		self.Documents = documents
+		self.LastUpdate = last_update
+		self.Count = len(documents)
+		return updated
+
+
+	def _on_tick(self, event_name):
+		if (self._update_future is not None) and (not self._update_future.done()):
+			return
+		if time.time() - self._update_time >= self.UpdatePeriod:
+			self._update_time = time.time()
+			self._update_future = self.ensure_future_update(self.Loop)
+
+
+	# Serialization
+
+	def serialize(self):
+		'''
+		Preloaded documents are serialized as concatenated BSON documents.
+		'''
+		if self.Documents is None:
+			raise NotImplementedError("Lookup '{}' is not preloaded".format(self.Id))
+		return b''.join(bson.BSON.encode(document) for document in self.Documents.values())
+
+
+	def deserialize(self, data):
+		self.Documents = {self._key_of(document): document for document in bson.decode_all(data)}
+		self.Count = len(self.Documents)
+
+
+	# Cache
+
+	def _cache_get(self, key):
+		'''
+		Returns a tuple (found, value).
+		'''
+		try:
+			value, expiration = self.Cache[key]
+		except KeyError:
+			return False, None
+
+		if expiration < time.time():
+			del self.Cache[key]
+			self.CacheCounter.add('expired', 1)
+			return False, None
+
+		self.Cache.move_to_end(key)
+		return True, value
 
 
+	def _cache_set(self, key, value):
+		ttl = self.CacheTTL if value is not None else self.CacheNegativeTTL
+		if ttl > 0:
+			expiration = time.time() + ttl
+		elif value is not None:
+			expiration = float('inf')
+		else:
+			return
+
+		self.Cache[key] = (value, expiration)
+		self.Cache.move_to_end(key)
+
+		if self.CacheSize > 0:
+			while len(self.Cache) > self.CacheSize:
+				self.Cache.popitem(last=False)
+				self.CacheCounter.add('evicted', 1)
+
+
+	# Asynchronous access
+
+	async def get_async(self, key):
+		'''
+		Get an item without blocking the pump, None if it is not found.
+		'''
+		if self.Documents is not None:
+			return self.Documents.get(key)
+
+		found, value = self._cache_get(key)
+		if found:
+			self.CacheCounter.add('hit', 1)
+			return value
+
+		# The future is shared by concurrent requests of the key, so it must not be cancelled with this one
+		return await asyncio.shield(self._request(key), loop=self.Loop)
+
+
+	async def prefetch(self, keys):
+		'''
+		Fetch items of keys that are not in the cache into the cache, so that they can be accessed without blocking.
+		'''
+		if self.Documents is not None:
+			return
+
+		futures = []
+		for key in set(keys):
+			found, _ = self._cache_get(key)
+			if found:
+				self.CacheCounter.add('hit', 1)
+			else:
+				futures.append(self._request(key))
+
+		if len(futures) > 0:
+			self._flush()
+			await asyncio.shield(asyncio.gather(*futures, loop=self.Loop), loop=self.Loop)
+
+
+	def _request(self, key):
+		self.CacheCounter.add('miss', 1)
+
+		future = self._inflight.get(key)
+		if future is not None:
+			return future
+
+		future = self._pending.get(key)
+		if future is not None:
+			return future
+
+		future = self.Loop.create_future()
+		self._pending[key] = future
+
+		if len(self._pending) >= self.PrefetchBatchSize:
+			self._flush()
+		elif self._flush_handle is None:
+			# Collect keys requested in this iteration of the event loop
+			self._flush_handle = self.Loop.call_soon(self._flush)
+
+		return future
+
+
+	def _flush(self):
+		if self._flush_handle is not None:
+			self._flush_handle.cancel()
+			self._flush_handle = None
+
+		if len(self._pending) == 0:
+			return
+
+		pending = self._pending
+		self._pending = {}
+		self._inflight.update(pending)
+		asyncio.ensure_future(self._fetch(pending), loop=self.Loop)
+
+
+	async def _fetch(self, pending):
+		try:
+			documents = await self._find_many(self.Connection.Client[self.Database], list(pending.keys()))
+		except Exception as e:
+			for key, future in pending.items():
+				del self._inflight[key]
+				if not future.done():
+					future.set_exception(e)
+			return
+
+		self.CacheCounter.add('query', 1)
+		found = {self._key_of(document): document for document in documents}
+		for key, future in pending.items():
+			del self._inflight[key]
+			value = found.get(key)
+			self._cache_set(key, value)
+			if not future.done():
+				future.set_result(value)
+
+
+	# Mapping interface
+
 	def __len__(self):
 		return self.Count
 
 
 	def __getitem__(self, key):
-		try:
-			key = self.Cache[key]
+		if self.Documents is not None:
+			return self.Documents.get(key)
+
+		found, value = self._cache_get(key)
+		if found:
 			self.CacheCounter.add('hit', 1)
-			return key
-		except KeyError:
-			database = self.Connection.Client[self.Database].delegate
-			v = self._find_one(database, key)
-			self.Cache[key] = v
-			self.CacheCounter.add('miss', 1)
-			return v
+			return value
+
+		database = self.Connection.Client[self.Database].delegate
+		value = self._find_one(database, key)
+		self._cache_set(key, value)
+		self.CacheCounter.add('miss', 1)
+		self.CacheCounter.add('blocking', 1)
+		return value
 
 
 	def __iter__(self):
+		if self.Documents is not None:
+			return iter(self.Documents.values())
+
 		database = self.Connection.Client[self.Database].delegate
 		collection = self.Config['collection']
 		return database[collection].find().__iter__()
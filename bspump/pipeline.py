@@ -5,12 +5,17 @@ import logging
 import itertools
 import collections
 import datetime
+import time
 import asab
 from .abc.source import Source
 from .abc.sink import Sink
 from .abc.generator import Generator
+from .abc.asyncprocessor import AsyncProcessor
 from .abc.connection import Connection
+from .context import EventContext
 from .exception import ProcessingError
+from .profiler import PipelineProfiler
+from .deadletter import DeadLetter
 
 #
 
@@ -18,7 +23,12 @@ L = logging.getLogger(__name__)
 
 #
 
-class Pipeline(abc.ABC):
+# Async generators are available since Python 3.6
+_AsyncGeneratorType = getattr(types, 'AsyncGeneratorType', ())
+
+#
+
+class Pipeline(abc.ABC, asab.ConfigObject):
 
 	'''
 
@@ -40,16 +50,41 @@ class MyPipeline(bspump.Pipeline):
 			bspump.common.NullSink(app, self),
 		)
 
+## Profiling
+
+The pipeline can measure a wall time of each processor on a sampled subset of events.
+It is enabled by `profiler_sample_rate` option in the `[pipeline:<pipeline id>]` configuration section
+or by `set_profiler()` call, see `bspump.profiler.PipelineProfiler` for details.
+
+## Error policy
+
+By default, an exception raised by a processor stops the pipeline until the error is cleared by `set_error()`.
+With `error_policy=dead_letter`, the failing event is routed to a dead-letter `InternalSource`
+and the processing continues, see `bspump.deadletter.DeadLetter` for details.
+
 	'''
 
 
-	def __init__(self, app, id=None):
+	ConfigDefaults = {
+		'profiler_sample_rate': 0, # Profile 1 in N events, 0 means that profiling is disabled
+		'time_slice': 0.01, # In seconds, how long the pipeline can process events before it yields to other tasks in the event loop
+		'error_policy': 'stop', # What happens when a processor fails: 'stop' the pipeline or route the event to a 'dead_letter'
+		'dead_letter': '', # Address of the dead-letter InternalSource, e.g. 'DeadLetterPipeline.*InternalSource', empty means drop
+		'dead_letter_error_rate': 0.01, # Ratio of failing events of a processor that stops the pipeline anyway
+		'dead_letter_min_errors': 10, # Minimal number of errors of a processor in a metrics period to stop the pipeline
+	}
+
+
+	def __init__(self, app, id=None, config=None):
 		self.Id = id if id is not None else self.__class__.__name__
+		super().__init__("pipeline:{}".format(self.Id), config=config)
 		self.App = app
 		self.Loop = app.Loop
 
 		self.Sources = []
 		self.Processors = [[]] # List of lists of processors, the depth is increased by a Generator object
+		self._chains = [] # List of compiled processor chains, one per depth, see _build_chains()
+		self._continuations = {} # Compiled chains that continue after a given processor, see resume()
 		self._source_coros = [] # List of source main() coroutines
 
 		# Publish-Subscribe for this pipeline
@@ -81,6 +116,19 @@ class MyPipeline(bspump.Pipeline):
 				'ready': False,
 			}
 		)
+		# Seconds the pipeline was throttled, in total and by each throttling object, and paced
+		self.MetricsThrottle = self.MetricsService.create_counter(
+			"bspump.pipeline.throttle",
+			tags={'pipeline':self.Id},
+			init_values={
+				'throttled': 0.0,
+				'paced': 0.0,
+			}
+		)
+		app.PubSub.subscribe(
+			"Application.tick!",
+			self._on_tick
+		)
 		app.PubSub.subscribe(
 			"Application.Metrics.Flush!",
 			self._on_metrics_flush
@@ -96,21 +144,41 @@ class MyPipeline(bspump.Pipeline):
 
 		self._error = None # None if not in error state otherwise there is a tuple (context, event, exc, timestamp)
 
-		self._throttles = set()
+		self._throttles = {} # Object that throttles the pipeline: time since when it is throttled (or accounted)
+		self._throttled_since = None
+		self._paces = {} # Object that paces the pipeline: delay
+		self._pace = 0.0
 
 		self._ready = asyncio.Event(loop = app.Loop)
 		self._ready.clear()
 
 		# Chillout is used to break a pipeline processing to smaller tasks that allows other event in event loop to be processed
-		self._chillout_trigger = 10000
-		self._chillout_counter = 0
+		# The pipeline yields to the event loop when a time slice is exhausted
+		self._chillout_time_slice = float(self.Config['time_slice'])
+		self._chillout_deadline = self.Loop.time() + self._chillout_time_slice
 
 		self._context = {}
 
+		sample_rate = int(self.Config['profiler_sample_rate'])
+		self.Profiler = PipelineProfiler(self, sample_rate) if sample_rate > 0 else None
+		self._profiler = self.Profiler # Kept when the profiling is disabled, so that its gauges are reused
+
+		error_policy = self.Config['error_policy']
+		if error_policy == 'dead_letter':
+			self.DeadLetter = DeadLetter(self)
+		elif error_policy == 'stop':
+			self.DeadLetter = None
+		else:
+			raise ValueError("Unknown error policy '{}' of the pipeline '{}'".format(error_policy, self.Id))
+
 
 	def _on_metrics_flush(self, event_type, metric, values):
 		if metric != self.MetricsCounter:
 			return
+		if self.Profiler is not None:
+			self.Profiler.flush()
+		if self.DeadLetter is not None:
+			self.DeadLetter.flush()
 		if values["event.in"] == 0:
 			self.MetricsGauge.set("warning.ratio", 0.0)
 			self.MetricsGauge.set("error.ratio", 0.0)
@@ -185,15 +253,61 @@ class SampleInternalPipeline(bspump.Pipeline):
 
 
 	def throttle(self, who, enable=True):
+		'''
+		Stop (`enable=True`) or resume the processing of the pipeline on behalf of `who`.
+		The pipeline is ready only when no one throttles it.
+		The time spent throttled is accounted in the `bspump.pipeline.throttle` counter, by `who`.
+		'''
 		#L.debug("Pipeline '{}' throttle {} by {}".format(self.Id, "enabled" if enable else "disabled", who))
+		now = self.Loop.time()
 		if enable:
-			self._throttles.add(who)
+			if who not in self._throttles:
+				self._throttles[who] = now
+				if self._throttled_since is None:
+					self._throttled_since = now
 		else:
-			self._throttles.remove(who)
+			since = self._throttles.pop(who)
+			self._account_throttle(_throttle_label(who), now - since)
+			if len(self._throttles) == 0:
+				self._account_throttle('throttled', now - self._throttled_since)
+				self._throttled_since = None
 
 		self._evaluate_ready()
 
 
+	def pace(self, who, delay):
+		'''
+		Slow down the pipeline on behalf of `who` without stopping it.
+		The pipeline then sleeps `delay` seconds each time it yields to the event loop (see `time_slice` option),
+		the highest delay requested applies. The `delay` of 0 removes the pacing.
+		'''
+		if delay > 0:
+			self._paces[who] = delay
+		else:
+			self._paces.pop(who, None)
+		self._pace = max(self._paces.values()) if len(self._paces) > 0 else 0.0
+
+
+	def _account_throttle(self, label, duration):
+		counter = self.MetricsThrottle
+		if label not in counter.Init:
+			counter.Init[label] = 0.0
+		if label not in counter.Values:
+			counter.Values[label] = 0.0
+		counter.add(label, duration)
+
+
+	def _on_tick(self, event_name):
+		# Account the time of ongoing throttles, so that they are visible in metrics before they end
+		now = self.Loop.time()
+		for who, since in self._throttles.items():
+			self._account_throttle(_throttle_label(who), now - since)
+			self._throttles[who] = now
+		if self._throttled_since is not None:
+			self._account_throttle('throttled', now - self._throttled_since)
+			self._throttled_since = now
+
+
 	def _evaluate_ready(self):
 		orig_ready = self.is_ready()
 
@@ -218,12 +332,16 @@ class SampleInternalPipeline(bspump.Pipeline):
 	async def ready(self):
 		'''
 		Can be used in source: `await self.Pipeline.ready()`
+
+		It also yields to other tasks in the event loop, when the pipeline exhausted its time slice (see `time_slice` option).
 		'''
 
-		self._chillout_counter += 1
-		if self._chillout_counter >= self._chillout_trigger:
-			self._chillout_counter = 0
-			await asyncio.sleep(0.0001, loop = self.Loop)
+		if self.Loop.time() >= self._chillout_deadline:
+			pace = self._pace
+			await asyncio.sleep(pace, loop = self.Loop)
+			if pace > 0:
+				self.MetricsThrottle.add('paced', pace)
+			self._chillout_deadline = self.Loop.time() + self._chillout_time_slice
 
 		await self._ready.wait()
 		return True
@@ -234,38 +352,253 @@ class SampleInternalPipeline(bspump.Pipeline):
 
 
 	def _do_process(self, event, depth, context):
-		for processor in self.Processors[depth]:
+		return self._chains[depth](event, context)
+
+
+	def _build_chains(self):
+		'''
+		Compile processors of each depth into a single function (a chain).
+		The roles of processors (sink, generator) are resolved here once and not for every event.
+		'''
+		self._chains = [self._build_chain(depth) for depth in range(len(self.Processors))]
+		self._continuations = {}
+
+
+	def _build_chain(self, depth, start=0):
+		processors = self.Processors[depth][start:]
+		methods = tuple(_process_method(processor) for processor in processors)
+		generator_depth = len(self.Processors) > (depth + 1)
+		metrics_counter = self.MetricsCounter
+
+		# Metrics counted when an event is consumed by a processor, only applies on the last depth
+		consumed = {}
+		if not generator_depth:
+			for processor in processors:
+				if isinstance(processor, AsyncProcessor):
+					continue # The event is not consumed, it will be resumed later
+				consumed[processor.process] = 'event.out' if isinstance(processor, Sink) else 'event.drop'
+
+		def chain(event, context):
+			process = None
 			try:
-				event = processor.process(context, event)
+				for process in methods:
+					event = process(context, event)
+					if event is None: # Event has been consumed on the way
+						metric = consumed.get(process)
+						if metric is not None:
+							metrics_counter.add(metric, 1)
+						return None
+
 			except BaseException as e:
-				if depth > 0: raise # Handle error on the top level
-				L.exception("Pipeline processing error in the '{}' on depth {}".format(self.Id, depth))
-				self.set_error(context, event, e)
+				if self._on_processing_error(process.__self__, depth, context, event, e):
+					return None # The event has been routed to the dead letter
 				raise
 
-			if event is None: # Event has been consumed on the way
-				if len(self.Processors) == (depth + 1):
-					if isinstance(processor, Sink):
-						self.MetricsCounter.add('event.out', 1)
-					else:
-						self.MetricsCounter.add('event.drop', 1)
+			# If the event is generator and there is more in the processor pipeline, then enumerate generator
+			if generator_depth and isinstance(event, (types.GeneratorType, _AsyncGeneratorType)):
+				return event
+
+			self._on_incomplete_pipeline(depth, context, event)
+
+		if self.Profiler is None:
+			return chain
+
+		# Profiling is enabled, every N-th event is processed by an instrumented copy of the chain
+		steps = tuple((_process_method(processor), self.Profiler.histogram(processor).record) for processor in processors)
+		sample_rate = self.Profiler.SampleRate
+		sample_counter = 0
+
+		def profiled_chain(event, context):
+			nonlocal sample_counter
+			sample_counter += 1
+			if sample_counter < sample_rate:
+				return chain(event, context)
+			sample_counter = 0
+
+			process = None
+			try:
+				for process, record in steps:
+					t0 = time.perf_counter()
+					event = process(context, event)
+					record(time.perf_counter() - t0)
+					if event is None: # Event has been consumed on the way
+						metric = consumed.get(process)
+						if metric is not None:
+							metrics_counter.add(metric, 1)
+						return None
+
+			except BaseException as e:
+				if self._on_processing_error(process.__self__, depth, context, event, e):
+					return None # The event has been routed to the dead letter
+				raise
+
+			if generator_depth and isinstance(event, (types.GeneratorType, _AsyncGeneratorType)):
+				return event
+
+			self._on_incomplete_pipeline(depth, context, event)
+
+		return profiled_chain
+
+
+	def _on_processing_error(self, processor, depth, context, event, exc):
+		'''
+		Returns True if the event has been routed to the dead letter and the processing can continue.
+		'''
+		if self.DeadLetter is not None and self.DeadLetter.handle(processor, context, event, exc):
+			return True
+
+		L.exception("Pipeline processing error in the '{}' on depth {} in '{}'".format(self.Id, depth, processor.Id))
+		self.set_error(context, event, exc)
+		return False
 
-				return
 
-		assert(event is not None)
+	def _on_incomplete_pipeline(self, depth, context, event):
+		try:
+			raise ProcessingError("Incomplete pipeline, event '{}' is not consumed by a Sink".format(event))
+		except BaseException as e:
+			L.exception("Pipeline processing error in the '{}' on depth {}".format(self.Id, depth))
+			self.set_error(context, event, e)
+			raise
 
-		# If the event is generator and there is more in the processor pipeline, then enumerate generator
-		if isinstance(event, types.GeneratorType) and len(self.Processors) > depth:
-			return event
 
+	def set_profiler(self, sample_rate):
+		'''
+		Enable the profiling of 1 in `sample_rate` events or disable it, when `sample_rate` is 0.
+		The profiler and its gauges are created once, re-enabling the profiling only changes the sample rate.
+		'''
+		if sample_rate > 0:
+			if self._profiler is None:
+				self._profiler = PipelineProfiler(self, sample_rate)
+			else:
+				self._profiler.SampleRate = sample_rate
+			self.Profiler = self._profiler
 		else:
+			self.Profiler = None
+
+		self._build_chains()
+
+
+	def _do_process_batch(self, events, depth, context, start=0):
+		last_depth = len(self.Processors) == (depth + 1)
+
+		# Profiling, if enabled, samples every N-th batch
+		profiler = self.Profiler
+		if profiler is not None and not profiler.sample():
+			profiler = None
+
+		for index, processor in enumerate(self.Processors[depth][start:], start):
 			try:
-				raise ProcessingError("Incomplete pipeline, event '{}' is not consumed by a Sink".format(event))
+				process_batch = processor.submit_batch if isinstance(processor, AsyncProcessor) else processor.process_batch
+				if profiler is None:
+					nevents = process_batch(context, events)
+				else:
+					t0 = time.perf_counter()
+					nevents = process_batch(context, events)
+					profiler.histogram(processor).record((time.perf_counter() - t0) / len(events), len(events))
 			except BaseException as e:
-				L.exception("Pipeline processing error in the '{}' on depth {}".format(self.__class__.__name__, depth))
-				self.set_error(context, event, e)
+				if self.DeadLetter is not None and isinstance(e, Exception):
+					if processor.BatchRetry:
+						return self._do_process_one_by_one(events, depth, context, index)
+					if self.DeadLetter.handle_batch(processor, context, events, e):
+						return None # The whole batch has been routed to the dead letter
+				self._on_processing_error(processor, depth, context, events, e)
 				raise
 
+			if last_depth and not isinstance(processor, AsyncProcessor):
+				consumed = len(events) - len(nevents)
+				if consumed > 0:
+					if isinstance(processor, Sink):
+						self.MetricsCounter.add('event.out', consumed)
+					else:
+						self.MetricsCounter.add('event.drop', consumed)
+
+			events = nevents
+			if len(events) == 0: # All events have been consumed on the way
+				return None
+
+		# If there is more in the processor pipeline, events are generators that will be enumerated
+		if not last_depth:
+			return events
+
+		else:
+			self._on_incomplete_pipeline(depth, context, events)
+
+
+	def _do_process_one_by_one(self, events, depth, context, start):
+		# The batch failed in a processor, it is processed again event by event from that processor to find failing events
+		chain = self._build_chain(depth, start=start)
+		gevents = []
+		for event in events:
+			gevent = chain(event, context)
+			if gevent is not None:
+				gevents.append(gevent)
+		return gevents if len(gevents) > 0 else None
+
+
+	def resume(self, processor, context, event):
+		'''
+		Continue the processing of the event by processors that follow the `processor`.
+		It is called by processors that complete the processing of an event later, outside of the `process()` call,
+		such as `bspump.AsyncProcessor`.
+		The `event` that is None has been consumed by the `processor`.
+		'''
+		depth, start, chain = self._locate_continuation(processor)
+
+		if event is None:
+			if len(self.Processors) == (depth + 1):
+				self.MetricsCounter.add('event.drop', 1)
+			return
+
+		try:
+			gevent = chain(event, context)
+		except Exception:
+			return # The error has been already handled by set_error()
+
+		if gevent is not None:
+			self._spawn(self._generator_process(gevent, depth+1, context=context))
+
+
+	def resume_batch(self, processor, context, events, consumed=0):
+		'''
+		Batch variant of `resume()`, the `consumed` is the number of events of the batch that have been consumed by the `processor`.
+		'''
+		depth, start, chain = self._locate_continuation(processor)
+
+		if consumed > 0 and len(self.Processors) == (depth + 1):
+			self.MetricsCounter.add('event.drop', consumed)
+
+		if len(events) == 0:
+			return
+
+		try:
+			gevents = self._do_process_batch(events, depth, context, start=start)
+		except Exception:
+			return # The error has been already handled by set_error()
+
+		if gevents is not None:
+			self._spawn(self._generator_process_batch(gevents, depth+1, context=context, batch_size=len(events)))
+
+
+	def _locate_continuation(self, processor):
+		continuation = self._continuations.get(processor)
+		if continuation is not None:
+			return continuation
+
+		for depth, processors in enumerate(self.Processors):
+			for index, p in enumerate(processors):
+				if p is processor:
+					continuation = (depth, index + 1, self._build_chain(depth, start=index + 1))
+					self._continuations[processor] = continuation
+					return continuation
+
+		raise RuntimeError("Processor '{}' is not in the pipeline '{}'".format(processor.Id, self.Id))
+
+
+	def _spawn(self, coro):
+		future = asyncio.ensure_future(coro, loop=self.Loop)
+		future.add_done_callback(_on_spawned_done)
+		return future
+
 
 	async def process(self, event, context=None):
 		while not self.is_ready():
@@ -274,23 +607,104 @@ class SampleInternalPipeline(bspump.Pipeline):
 		self.MetricsCounter.add('event.in', 1)
 
 		if context is None:
-			context = self._context.copy()
+			context = EventContext(self._context)
 		else:
 			context.update(self._context)
 
-		gevent = self._do_process(event, depth=0, context=context)
+		gevent = self._chains[0](event, context)
 		if gevent is not None:	
 			await self._generator_process(gevent, 1, context=context)
 
 
 	async def _generator_process(self, event, depth, context):
-		for gevent in event:
-			while not self.is_ready():
+		'''
+		Enumerate the generator (or the async generator) and process generated events on the next depth.
+		Nested generators are enumerated iteratively, using a stack of active generators.
+		'''
+		stack = [(event, depth, context)]
+		while len(stack) > 0:
+			generator, depth, context = stack[-1]
+
+			try:
+				if isinstance(generator, _AsyncGeneratorType):
+					gevent = await generator.__anext__()
+				else:
+					gevent = next(generator)
+			except (StopIteration, StopAsyncIteration):
+				stack.pop()
+				continue
+			except BaseException as e:
+				L.exception("Pipeline generator error in the '{}' on depth {}".format(self.Id, depth))
+				self.set_error(context, None, e)
+				raise
+
+			if not self.is_ready() or self.Loop.time() >= self._chillout_deadline:
 				await self.ready()
-			
-			ngevent = self._do_process(gevent, depth, context.copy())
+
+			gcontext = EventContext(context)
+			ngevent = self._chains[depth](gevent, gcontext)
 			if ngevent is not None:
-				self._generator_process(ngevent, depth+1, context)
+				stack.append((ngevent, depth+1, gcontext))
+
+
+	async def process_batch(self, events, context=None):
+		'''
+		Process a list of events in one go.
+		The pipeline ready state is awaited and metrics are updated once per a batch instead of once per an event.
+		The context is shared by all events in the batch.
+
+		Processors receive the whole batch through their `process_batch()` method.
+		'''
+		if len(events) == 0:
+			return
+
+		while not self.is_ready():
+			await self.ready()
+
+		self.MetricsCounter.add('event.in', len(events))
+
+		if context is None:
+			context = EventContext(self._context)
+		else:
+			context.update(self._context)
+
+		gevents = self._do_process_batch(events, depth=0, context=context)
+		if gevents is not None:
+			await self._generator_process_batch(gevents, 1, context=context, batch_size=len(events))
+
+
+	async def _generator_process_batch(self, gevents, depth, context, batch_size):
+		'''
+		Batch variant of `_generator_process()`, generated events are collected into batches of `batch_size`.
+		'''
+		stack = [(gevent, depth) for gevent in reversed(gevents)]
+		while len(stack) > 0:
+			generator, depth = stack[-1]
+
+			try:
+				if isinstance(generator, _AsyncGeneratorType):
+					events = []
+					async for gevent in generator:
+						events.append(gevent)
+						if len(events) >= batch_size:
+							break
+				else:
+					events = list(itertools.islice(generator, batch_size))
+			except BaseException as e:
+				L.exception("Pipeline generator error in the '{}' on depth {}".format(self.Id, depth))
+				self.set_error(context, None, e)
+				raise
+
+			if len(events) == 0:
+				stack.pop()
+				continue
+
+			if not self.is_ready() or self.Loop.time() >= self._chillout_deadline:
+				await self.ready()
+
+			ngevents = self._do_process_batch(events, depth, context)
+			if ngevents is not None:
+				stack.extend((ngevent, depth+1) for ngevent in reversed(ngevents))
 
 
 	# Construction
@@ -310,6 +724,8 @@ class SampleInternalPipeline(bspump.Pipeline):
 		if isinstance(processor, Generator):
 			self.Processors.append([])
 
+		self._build_chains()
+
 
 	def build(self, source, *processors):
 		self.set_source(source)
@@ -359,6 +775,9 @@ class SampleInternalPipeline(bspump.Pipeline):
 	def start(self):
 		self.PubSub.publish("bspump.pipeline.start!", pipeline=self)
 
+		# Recompile processor chains in case that processors were modified after build()
+		self._build_chains()
+
 		# Start all non-started sources
 		for source in self.Sources:
 			source.start(self.Loop)
@@ -387,6 +806,17 @@ class SampleInternalPipeline(bspump.Pipeline):
 		for l, processors in enumerate(self.Processors):
 			rest['Processors'].append(processors)
 
+		if len(self._throttles) > 0:
+			rest['Throttles'] = [_throttle_label(who) for who in self._throttles]
+		if self._pace > 0:
+			rest['Pace'] = self._pace
+
+		if self.Profiler is not None:
+			rest['Profiler'] = self.Profiler.rest_get()
+
+		if self.DeadLetter is not None:
+			rest['DeadLetter'] = self.DeadLetter.rest_get()
+
 		if self._error:
 			error_text = str(self._error[2]) # (context, event, exc, timestamp)[2]
 			error_time = self._error[3]
@@ -401,6 +831,31 @@ class SampleInternalPipeline(bspump.Pipeline):
 ###
 
 
+def _process_method(processor):
+	# Asynchronous processors are entered thru submit(), the event is then resumed by the processor
+	if isinstance(processor, AsyncProcessor):
+		return processor.submit
+	return processor.process
+
+
+def _on_spawned_done(future):
+	# Errors are already handled by set_error(), the exception is retrieved to silence asyncio warning
+	if not future.cancelled():
+		future.exception()
+
+
+def _throttle_label(who):
+	# A name of the object that throttles a pipeline, used in metrics and in the Rest API
+	if isinstance(who, str):
+		return who
+	if isinstance(who, Pipeline):
+		return who.Id
+	locate_address = getattr(who, 'locate_address', None)
+	if locate_address is not None:
+		return locate_address()
+	return who.__class__.__name__
+
+
 class PipelineLogger(logging.Logger):
 
 	def __init__(self, name, metrics_counter, level=logging.NOTSET):
@@ -0,0 +1,163 @@
+import logging
+
+#
+
+L = logging.getLogger(__name__)
+
+#
+
+class LatencyHistogram(object):
+
+	'''
+HDR-style (log-linear) histogram of latencies.
+
+Values are recorded in seconds and counted in buckets, which width grows with the value,
+so that the relative error of the reported percentile is bounded (about 3% for the default `precision` of 5 bits).
+Recording is O(1) and the memory is proportional to the logarithm of the highest recorded value.
+
+	h = LatencyHistogram()
+	h.record(0.000120)
+	h.percentile(99)
+	'''
+
+	def __init__(self, unit=1e-8, precision=5):
+		self.Unit = unit # The smallest distinguishable value, in seconds
+		self.Precision = precision # Number of significant bits
+		self._half = 1 << (precision - 1)
+		self.reset()
+
+
+	def reset(self):
+		self.Buckets = []
+		self.Count = 0
+		self.Sum = 0.0
+		self.Max = 0.0
+
+
+	def _index(self, n):
+		shift = n.bit_length() - self.Precision
+		if shift <= 0:
+			return n
+		return (shift * self._half) + (n >> shift)
+
+
+	def _value(self, index):
+		'''
+		Returns the middle of the bucket, in seconds
+		'''
+		if index < (2 * self._half):
+			return index * self.Unit
+		shift = (index // self._half) - 1
+		sub = index - (shift * self._half)
+		return ((sub << shift) + ((1 << shift) / 2)) * self.Unit
+
+
+	def record(self, value, count=1):
+		index = self._index(int(value / self.Unit))
+		if index >= len(self.Buckets):
+			self.Buckets.extend([0] * (index + 1 - len(self.Buckets)))
+		self.Buckets[index] += count
+		self.Count += count
+		self.Sum += value * count
+		if value > self.Max:
+			self.Max = value
+
+
+	def percentile(self, p):
+		if self.Count == 0:
+			return 0.0
+
+		threshold = self.Count * p / 100.0
+		cumulative = 0
+		for index, count in enumerate(self.Buckets):
+			cumulative += count
+			if cumulative >= threshold and count > 0:
+				return min(self._value(index), self.Max)
+
+		return self.Max
+
+
+	def mean(self):
+		if self.Count == 0:
+			return 0.0
+		return self.Sum / self.Count
+
+#
+
+class PipelineProfiler(object):
+
+	'''
+Measures a wall time of each processor in the pipeline on a sampled subset of events (1 in `sample_rate`).
+
+Latencies are kept in `LatencyHistogram` per processor.
+Percentiles are published thru the `asab.MetricsService` as a `bspump.pipeline.profiler` gauge (tagged by the pipeline and the processor)
+and into the `Pipeline.rest_get()`, histograms are reset on each metrics flush.
+	'''
+
+	def __init__(self, pipeline, sample_rate):
+		assert(sample_rate > 0)
+		self.Pipeline = pipeline
+		self.SampleRate = sample_rate
+		self.Histograms = {}
+		self.Gauges = {} # processor id -> gauge, a gauge is registered in the metrics service only once
+		self.Snapshot = {}
+		self._sample_counter = 0
+
+
+	def sample(self):
+		'''
+		Returns True for every N-th call, where N is the sample rate.
+		'''
+		self._sample_counter += 1
+		if self._sample_counter < self.SampleRate:
+			return False
+		self._sample_counter = 0
+		return True
+
+
+	def histogram(self, processor):
+		histogram = self.Histograms.get(processor)
+		if histogram is not None:
+			return histogram
+
+		histogram = LatencyHistogram()
+		self.Histograms[processor] = histogram
+		if processor.Id not in self.Gauges:
+			self.Gauges[processor.Id] = self.Pipeline.MetricsService.create_gauge(
+				"bspump.pipeline.profiler",
+				tags={
+					'pipeline': self.Pipeline.Id,
+					'processor': processor.Id,
+				},
+				init_values=self._snapshot(histogram)
+			)
+		return histogram
+
+
+	def _snapshot(self, histogram):
+		return {
+			'sampled': histogram.Count,
+			'events': histogram.Count * self.SampleRate, # Estimated
+			'mean': histogram.mean(),
+			'p50': histogram.percentile(50),
+			'p90': histogram.percentile(90),
+			'p99': histogram.percentile(99),
+			'max': histogram.Max,
+		}
+
+
+	def flush(self):
+		for processor, histogram in self.Histograms.items():
+			snapshot = self._snapshot(histogram)
+			gauge = self.Gauges[processor.Id]
+			for k, v in snapshot.items():
+				gauge.set(k, v)
+			self.Snapshot[processor.Id] = snapshot
+			histogram.reset()
+
+
+	def rest_get(self):
+		return {
+			'SampleRate': self.SampleRate,
+			'Processors': self.Snapshot,
+		}
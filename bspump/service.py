@@ -13,6 +13,10 @@ L = logging.getLogger(__file__)
 
 class BSPumpService(asab.Service):
 
+	# How often (in seconds) the event loop lag is probed
+	LoopLagProbeInterval = 0.1
+
+
 	def __init__(self, app, service_name="bspump.PumpService"):
 		super().__init__(app, service_name)
 
@@ -20,6 +24,20 @@ class BSPumpService(asab.Service):
 		self.Connections = dict()
 		self.Lookups = dict()
 
+		# The event loop lag is a delay of a timer callback behind its schedule
+		# It shows how long tasks (e.g. pipelines) block the event loop, see `time_slice` option of the pipeline
+		metrics_service = app.get_service('asab.MetricsService')
+		self.LoopLagGauge = metrics_service.create_gauge(
+			"bspump.loop",
+			init_values={
+				'lag': 0.0,
+				'lag.max': 0.0,
+			}
+		)
+		self._loop_lag_max = 0.0
+		self._loop_lag_handle = None
+		app.PubSub.subscribe("Application.Metrics.Flush!", self._on_metrics_flush)
+
 
 	def locate(self, address):
 		if '.' in address:
@@ -98,7 +116,32 @@ class BSPumpService(asab.Service):
 
 	#
 
+	def _schedule_loop_lag_probe(self):
+		expected = self.App.Loop.time() + self.LoopLagProbeInterval
+		self._loop_lag_handle = self.App.Loop.call_at(expected, self._on_loop_lag_probe, expected)
+
+
+	def _on_loop_lag_probe(self, expected):
+		lag = max(0.0, self.App.Loop.time() - expected)
+		self.LoopLagGauge.set('lag', lag)
+		if lag > self._loop_lag_max:
+			self._loop_lag_max = lag
+			self.LoopLagGauge.set('lag.max', lag)
+		self._schedule_loop_lag_probe()
+
+
+	def _on_metrics_flush(self, event_type, metric, values):
+		if metric != self.LoopLagGauge:
+			return
+		# Maximum is tracked per a metrics flush period
+		self._loop_lag_max = 0.0
+		self.LoopLagGauge.set('lag.max', 0.0)
+
+	#
+
 	async def initialize(self, app):
+		self._schedule_loop_lag_probe()
+
 		# Await all lookups
 		lookup_update_tasks = [lookup.ensure_future_update(app.Loop) for lookup in self.Lookups.values()]
 		if len(lookup_update_tasks) > 0:
@@ -110,6 +153,10 @@ class BSPumpService(asab.Service):
 
 
 	async def finalize(self, app):
+		if self._loop_lag_handle is not None:
+			self._loop_lag_handle.cancel()
+			self._loop_lag_handle = None
+
 		# Stop all started pipelines
 		if len(self.Pipelines) > 0:
 			await asyncio.gather(*[pipeline.stop() for pipeline in self.Pipelines.values()], loop=app.Loop)
@@ -0,0 +1,3 @@
+from .pipeline import ShardedPipeline
+from .source import ShardSource
+from .sink import ShardingSink
@@ -0,0 +1,61 @@
+import struct
+import asyncio
+import pickle
+
+#
+
+# Frame types
+FRAME_EVENTS = ord('E') # Payload is a list of (context, event) tuples
+FRAME_METRICS = ord('M') # Payload is a dictionary of metric values
+
+_HEADER = struct.Struct(r"<IB") # Length of the payload, frame type
+
+#
+
+def pack_frame(frame_type, payload):
+	data = pickle.dumps(payload, protocol=pickle.HIGHEST_PROTOCOL)
+	return _HEADER.pack(len(data), frame_type) + data
+
+
+class FrameDecoder(object):
+
+	'''
+	Incrementally decodes frames from a stream of bytes.
+	'''
+
+	def __init__(self):
+		self._buffer = bytearray()
+
+
+	def feed(self, data):
+		'''
+		Add received bytes and return a list of complete frames (frame_type, payload).
+		'''
+		self._buffer.extend(data)
+
+		frames = []
+		offset = 0
+		while len(self._buffer) - offset >= _HEADER.size:
+			length, frame_type = _HEADER.unpack_from(self._buffer, offset)
+			end = offset + _HEADER.size + length
+			if len(self._buffer) < end:
+				break
+			frames.append((frame_type, pickle.loads(self._buffer[offset + _HEADER.size:end])))
+			offset = end
+
+		if offset > 0:
+			del self._buffer[:offset]
+
+		return frames
+
+
+async def read_frame(reader):
+	'''
+	Read one frame from `asyncio.StreamReader`, returns (frame_type, payload) or None at the end of the stream.
+	'''
+	try:
+		length, frame_type = _HEADER.unpack(await reader.readexactly(_HEADER.size))
+		data = await reader.readexactly(length)
+	except asyncio.IncompleteReadError:
+		return None
+	return frame_type, pickle.loads(data)
@@ -0,0 +1,265 @@
+import os
+import socket
+import asyncio
+import logging
+import multiprocessing
+
+from ..pipeline import Pipeline
+from ..application import BSPumpApplication
+from .frame import pack_frame, FrameDecoder, FRAME_EVENTS, FRAME_METRICS
+
+#
+
+L = logging.getLogger(__name__)
+
+#
+
+class ShardedPipeline(Pipeline):
+
+	'''
+A pipeline that runs in N worker processes, each one with its own copy of the pipeline.
+It allows to scale CPU-bound processing over more cores.
+
+The parent process keeps this object as a proxy of workers.
+Events are dispatched to workers by a `ShardingSink` of another pipeline, which partitions them by a key.
+The worker pipeline is created by `pipeline_factory(app, pipeline_id)` in each worker process
+and it has to use a `ShardSource` as its source.
+
+class EnrichPipeline(bspump.Pipeline):
+
+	def __init__(self, app, pipeline_id):
+		super().__init__(app, pipeline_id)
+		self.build(
+			bspump.shard.ShardSource(app, self),
+			bspump.common.JSONParser(app, self),
+			bspump.common.FlattenDictProcessor(app, self),
+			bspump.common.NullSink(app, self),
+		)
+
+class FrontPipeline(bspump.Pipeline):
+
+	def __init__(self, app, pipeline_id):
+		super().__init__(app, pipeline_id)
+		self.build(
+			bspump.kafka.KafkaSource(app, self, "KafkaConnection"),
+			bspump.shard.ShardingSink(app, self, "EnrichPipeline", key=lambda context, event: event[:16]),
+		)
+
+svc.add_pipelines(
+	FrontPipeline(app, "FrontPipeline"),
+	bspump.shard.ShardedPipeline(app, "EnrichPipeline", EnrichPipeline, config={'workers': 16}),
+)
+
+Worker processes are started by the 'spawn' method, so the `pipeline_factory` has to be importable (e.g. a class defined in a module)
+and the application script has to be guarded by `if __name__ == '__main__':`.
+Events are transferred to workers pickled together with their contexts, in batches, so contexts have to be picklable too.
+The worker pipeline gets the context of the event as the `ancestor` context.
+Workers report their pipeline metrics back, these are aggregated into the metrics of this pipeline
+and into the `bspump.shard` counter of each worker.
+	'''
+
+	ConfigDefaults = {
+		'workers': 0, # Number of worker processes, 0 means the number of CPUs
+		'stop_timeout': 5, # In seconds, how long to wait for workers to exit
+	}
+
+
+	def __init__(self, app, pipeline_id, pipeline_factory, config=None):
+		super().__init__(app, pipeline_id, config=config)
+		self.PipelineFactory = pipeline_factory
+
+		workers = int(self.Config['workers'])
+		if workers <= 0:
+			workers = os.cpu_count() or 1
+
+		self.Workers = [ShardWorker(self, worker_id) for worker_id in range(workers)]
+		self._flush_scheduled = False
+
+
+	def dispatch(self, shard, context, event):
+		'''
+		Send an event and its context to the worker with index `shard`.
+		Events are collected and sent to workers in batches, once per an event loop iteration.
+		'''
+		self.Workers[shard].Pending.append((context, event))
+		if not self._flush_scheduled:
+			self._flush_scheduled = True
+			self.Loop.call_soon(self._flush)
+
+
+	def _flush(self):
+		self._flush_scheduled = False
+		for worker in self.Workers:
+			worker.flush()
+
+
+	# Lifecycle ...
+
+	def start(self):
+		super().start()
+		for worker in self.Workers:
+			worker.start()
+
+
+	async def stop(self):
+		await super().stop()
+		self._flush()
+		for worker in self.Workers:
+			worker.close()
+		timeout = float(self.Config['stop_timeout'])
+		for worker in self.Workers:
+			await worker.join(timeout)
+
+
+	# Rest API
+
+	def rest_get(self):
+		rest = super().rest_get()
+		rest['Workers'] = [worker.rest_get() for worker in self.Workers]
+		return rest
+
+#
+
+class ShardWorker(asyncio.Protocol):
+
+	'''
+	A parent-side handle of one worker process of the `ShardedPipeline`.
+	It is also an asyncio protocol of the connection to the worker, its flow control throttles the sharded pipeline.
+	'''
+
+	def __init__(self, pipeline, worker_id):
+		self.Pipeline = pipeline
+		self.WorkerId = worker_id
+
+		self.Process = None
+		self.Transport = None
+		self.Pending = []
+		self.Metrics = {} # Last metrics reported by the worker
+		self.MetricsCounter = pipeline.MetricsService.create_counter(
+			"bspump.shard",
+			tags={
+				'pipeline': pipeline.Id,
+				'worker': str(worker_id),
+			},
+			init_values={
+				'event.in': 0,
+				'event.out': 0,
+				'event.drop': 0,
+				'warning': 0,
+				'error': 0,
+			}
+		)
+
+		self._decoder = FrameDecoder()
+		self._closing = False
+
+
+	def start(self):
+		if self.Process is not None:
+			return
+
+		ctx = multiprocessing.get_context('spawn')
+		parent_connection, child_connection = ctx.Pipe(duplex=True)
+		self.Process = ctx.Process(
+			target=_worker_main,
+			args=(self.Pipeline.PipelineFactory, self.Pipeline.Id, self.WorkerId, child_connection),
+			name="{}#{}".format(self.Pipeline.Id, self.WorkerId),
+			daemon=True,
+		)
+		self.Process.start()
+		child_connection.close()
+
+		sock = socket.socket(fileno=os.dup(parent_connection.fileno()))
+		parent_connection.close()
+
+		# The pipeline is not ready until the worker is connected
+		self.Pipeline.throttle(self, enable=True)
+		asyncio.ensure_future(self.Pipeline.Loop.create_connection(lambda: self, sock=sock), loop=self.Pipeline.Loop)
+
+
+	def flush(self):
+		if self.Transport is None or len(self.Pending) == 0:
+			return
+		self.Transport.write(pack_frame(FRAME_EVENTS, self.Pending))
+		self.Pending = []
+
+
+	def close(self):
+		self._closing = True
+		if self.Transport is not None:
+			self.Transport.close()
+
+
+	async def join(self, timeout):
+		if self.Process is None:
+			return
+		await self.Pipeline.Loop.run_in_executor(None, self.Process.join, timeout)
+		if self.Process.is_alive():
+			L.warning("Shard worker '{}' refused to stop, terminating".format(self.Process.name))
+			self.Process.terminate()
+
+
+	# asyncio.Protocol
+
+	def connection_made(self, transport):
+		self.Transport = transport
+		self.flush()
+		self.Pipeline.throttle(self, enable=False)
+
+
+	def connection_lost(self, exc):
+		self.Transport = None
+		if self._closing:
+			return
+		L.error("Shard worker '{}' disconnected".format(self.Process.name))
+		self.Pipeline.set_error(None, None, RuntimeError("Shard worker '{}' disconnected".format(self.Process.name)))
+
+
+	def pause_writing(self):
+		self.Pipeline.throttle(self, enable=True)
+
+
+	def resume_writing(self):
+		self.Pipeline.throttle(self, enable=False)
+
+
+	def data_received(self, data):
+		for frame_type, payload in self._decoder.feed(data):
+			if frame_type == FRAME_METRICS:
+				self.Metrics = payload
+				for k, v in payload.items():
+					if k in self.MetricsCounter.Values:
+						self.MetricsCounter.add(k, v)
+						self.Pipeline.MetricsCounter.add(k, v)
+			else:
+				L.warning("Unknown frame type {} received from shard worker '{}'".format(frame_type, self.Process.name))
+
+
+	def rest_get(self):
+		return {
+			'Id': self.WorkerId,
+			'PID': self.Process.pid if self.Process is not None else None,
+			'Alive': self.Process.is_alive() if self.Process is not None else False,
+			'Pending': len(self.Pending),
+			'Metrics': self.Metrics,
+		}
+
+#
+
+class ShardWorkerApplication(BSPumpApplication):
+
+	'''
+	The application of a worker process of the `ShardedPipeline`, the web API is disabled.
+	'''
+
+	def __init__(self, worker_id, connection):
+		self.ShardWorkerId = worker_id
+		self.ShardConnection = connection
+		super().__init__(web_listen="")
+
+
+def _worker_main(pipeline_factory, pipeline_id, worker_id, connection):
+	app = ShardWorkerApplication(worker_id, connection)
+	svc = app.get_service("bspump.PumpService")
+	svc.add_pipeline(pipeline_factory(app, "{}#{}".format(pipeline_id, worker_id)))
+	app.run()
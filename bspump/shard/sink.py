@@ -0,0 +1,80 @@
+import itertools
+import logging
+
+from ..abc.sink import Sink
+from .pipeline import ShardedPipeline
+
+#
+
+L = logging.getLogger(__name__)
+
+#
+
+class ShardingSink(Sink):
+
+	'''
+	Dispatches events to worker processes of the `ShardedPipeline` identified by `target` (a pipeline id).
+
+	Events with the same key are always dispatched to the same worker.
+	The key is obtained by `key(context, event)` callable, or events are distributed in a round-robin fashion, if the key is not provided.
+	Note that a hash of a string key is stable only during a life of the process.
+
+	The pipeline of the sink is throttled when the sharded pipeline is not ready, e.g. when workers cannot keep up.
+	'''
+
+	def __init__(self, app, pipeline, target, key=None, id=None, config=None):
+		super().__init__(app, pipeline, id=id, config=config)
+		self.Target = target
+		self.Key = key
+		self._svc = app.get_service("bspump.PumpService")
+		self._target = None
+		self._round_robin = itertools.count()
+
+
+	def locate(self):
+		target = self._svc.locate(self.Target)
+		if not isinstance(target, ShardedPipeline):
+			L.warning("Cannot locate sharded pipeline '{}' in '{}'".format(self.Target, self.Id))
+			raise RuntimeError("Cannot locate sharded pipeline '{}' in '{}'".format(self.Target, self.Id))
+
+		target.PubSub.subscribe("bspump.pipeline.not_ready!", self._on_target_pipeline_ready_change)
+		target.PubSub.subscribe("bspump.pipeline.ready!", self._on_target_pipeline_ready_change)
+
+		# If target pipeline is not ready, throttle
+		if not target.is_ready():
+			self.Pipeline.throttle(target, enable=True)
+
+		self._target = target
+		return target
+
+
+	def shard(self, context, event, workers):
+		if self.Key is None:
+			return next(self._round_robin) % workers
+		return hash(self.Key(context, event)) % workers
+
+
+	def process(self, context, event):
+		target = self._target
+		if target is None:
+			target = self.locate()
+		target.dispatch(self.shard(context, event, len(target.Workers)), context, event)
+
+
+	def process_batch(self, context, events):
+		target = self._target
+		if target is None:
+			target = self.locate()
+		workers = len(target.Workers)
+		for event in events:
+			target.dispatch(self.shard(context, event, workers), context, event)
+		return []
+
+
+	def _on_target_pipeline_ready_change(self, event_name, pipeline):
+		if event_name == "bspump.pipeline.ready!":
+			self.Pipeline.throttle(pipeline, enable=False)
+		elif event_name == "bspump.pipeline.not_ready!":
+			self.Pipeline.throttle(pipeline, enable=True)
+		else:
+			L.warning("Unknown event '{}' received in _on_target_pipeline_ready_change in '{}'".format(event_name, self))
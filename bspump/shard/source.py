@@ -0,0 +1,84 @@
+import os
+import socket
+import asyncio
+import logging
+
+from ..abc.source import Source
+from .frame import pack_frame, read_frame, FRAME_EVENTS, FRAME_METRICS
+
+#
+
+L = logging.getLogger(__name__)
+
+#
+
+class ShardSource(Source):
+
+	'''
+	A source of the worker pipeline of the `ShardedPipeline`.
+	It receives batches of events dispatched by a `ShardingSink` in the parent process
+	and it reports metrics of its pipeline back to the parent.
+	The context of an event in the parent process is the `ancestor` of its context in the worker pipeline.
+
+	The source reads the next batch only after the previous one has been processed,
+	so a slow worker pipeline stops the parent from sending more events to it.
+	'''
+
+	def __init__(self, app, pipeline, id=None, config=None):
+		super().__init__(app, pipeline, id=id, config=config)
+		self.App = app
+		self._writer = None
+
+
+	async def main(self):
+		sock = socket.socket(fileno=os.dup(self.App.ShardConnection.fileno()))
+		reader, self._writer = await asyncio.open_connection(sock=sock, loop=self.Pipeline.Loop)
+		self.App.PubSub.subscribe("Application.Metrics.Flush!", self._on_metrics_flush)
+
+		try:
+			while True:
+				await self.Pipeline.ready()
+				frame = await read_frame(reader)
+				if frame is None:
+					L.warning("Shard source '{}' was disconnected from the parent process".format(self.locate_address()))
+					self.App.stop()
+					break
+
+				frame_type, payload = frame
+				if frame_type == FRAME_EVENTS:
+					await self._process_frame(payload)
+				else:
+					L.warning("Unknown frame type {} received by '{}'".format(frame_type, self.locate_address()))
+
+		except asyncio.CancelledError:
+			pass
+
+		finally:
+			self.App.PubSub.unsubscribe("Application.Metrics.Flush!", self._on_metrics_flush)
+			self._writer.close()
+			self._writer = None
+
+
+	async def _process_frame(self, items):
+		# Consecutive events with the same context are processed as a batch,
+		# the pickling preserves the identity of a context shared by more events of the frame
+		start = 0
+		while start < len(items):
+			context = items[start][0]
+			end = start + 1
+			while (end < len(items)) and (items[end][0] is context):
+				end += 1
+
+			await self.Pipeline.process_batch(
+				[item[1] for item in items[start:end]],
+				context={'ancestor': context, 'shard': self.App.ShardWorkerId}
+			)
+			start = end
+
+
+	def _on_metrics_flush(self, event_type, metric, values):
+		if metric != self.Pipeline.MetricsCounter:
+			return
+		if self._writer is None:
+			return
+		self._writer.write(pack_frame(FRAME_METRICS, values))
@@ -47,7 +47,7 @@ async def lookup(request):
 
 	try:
 		data = lookup.serialize()
-	except AttributeError:
+	except (AttributeError, NotImplementedError):
 		raise aiohttp.web.HTTPNotImplemented()
 
 	assert(isinstance(data, bytes))